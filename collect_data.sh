@@ -38,6 +38,18 @@ cd mound
 rsync -zv 'pgc@192.168.1.220:/home/pgc/*temper*' . || exit 10
 rsync -zv 'pgc@192.168.1.220:/home/pgc/mound*' . || exit 10
 cd ..
+# the months CompactLogs.py moved out of the log.  Segments are sealed so
+# only new ones are copied, and the finer segments of a month are deleted
+# once it is compacted.  There are none until CompactLogs.py has run on
+# the mound, then segments stays empty and everything is in the log.
+mkdir -p segments
+if ssh pgc@192.168.1.220 test -d /home/pgc/mound_segments
+then
+    rsync -rtzv --delete 'pgc@192.168.1.220:/home/pgc/mound_segments/' segments || exit 10
+    src/CompactLogs.py -s segments --check || exit 11
+else
+    echo no segments on the mound yet
+fi
 echo done
 
 #
@@ -46,26 +58,27 @@ echo creating merged temperature data ...
 mkdir -p work
 cd work
 # mv temp.log temp.log.old
-cat ../mound/* |\
-  tr -d '\000' |\
-  sort |\
-  sed -f ../src/SensorIdToName.sed > full.log
 #
-# full.log now has all the data with names rather than IDs and no NULLS
-#
-grep EVENT full.log > event.log &
-grep -v EVENT full.log > temp.log &
-wait
-echo full.log, event.log and temp.log are ready to use
+# sort all the data, remove NULLs, use names rather than IDs and split
+# the events from the samples in one pass
+#
+../src/IngestLogs.py -t temp.log -e event.log ../mound/* $(../src/CompactLogs.py -s ../segments --list raw)
+# hour indexes so LogIndex.py can pull a range of time out quickly
+../src/LogIndex.py temp.log
+../src/LogIndex.py event.log
+# to ask questions with SQL keep a database of the samples and events too
+# (only the new lines are added each time), see MoundStore.py
+#../src/MoundStore.py -d mound.db -t temp.log -e event.log
+echo event.log and temp.log are ready to use
 
 #
 echo binning data ...
 #
-../src/BinByDayNew.py - < temp.log > temp_1d.csv &
-../src/BinByHourNew.py - < temp.log > temp_1h.csv &
-../src/BinBy10MinutesNew.py - < temp.log > temp_10m.csv &
-../src/BinBy1MinuteNew.py - < temp.log > temp_1m.csv &
-wait
+# one pass over temp.log makes temp_1d.csv, temp_1h.csv, temp_10m.csv and temp_1m.csv
+# (and temp_*.bin for numpy, see BinaryTable.py)
+# binning.checkpoint lets each run start where the last one stopped
+# and the aggregates of the compacted months are added (see CompactLogs.py)
+../src/BinData.py -i temp.log -o . -b -c binning.checkpoint -a $(../src/CompactLogs.py -s ../segments --list aggregates)
 echo done binning data
 
 # move back to top from work directory
@@ -79,11 +92,11 @@ cp work/event.log Data
 
 #zip Data/temp_data.zip temp_1d.csv temp_1h.csv temp_10m.csv temp_1m.csv
 #zip Data/event_data.zip event.log
-#zip Data/log.zip full.log
-#grep '^2017.12' full.log > Data/2017.12.log
-#grep '^2018.01' full.log > Data/2018.01.log
-#grep '^2018.06' full.log > Data/2018.06.log
-#grep '^2018.07' full.log > Data/2018.07.log
+#zip Data/log.zip work/temp.log work/event.log
+#src/LogIndex.py -f 2017.12 -t 2018.01 work/temp.log > Data/2017.12.log
+#src/LogIndex.py -f 2018.01 -t 2018.02 work/temp.log > Data/2018.01.log
+#src/LogIndex.py -f 2018.06 -t 2018.07 work/temp.log > Data/2018.06.log
+#src/LogIndex.py -f 2018.07 -t 2018.08 work/temp.log > Data/2018.07.log
 
 
 #
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Compare the memory and time used to bin samples with the dict of dicts of
+SensorValue objects the BinBy*New.py programs use against the
+sensor_accumulator used by BinData.py.
+
+The phase 1 logs ("timestamp DS18B20 id value") are read and the ids are
+turned in to names before anything is measured, so only the binning is
+timed.  Memory is the peak seen by tracemalloc while building the table.
+
+usage:
+    BenchmarkAccumulator.py [log ...]
+
+with no logs given the files in ../RawData.phase1 are used.
+
+Results on the phase 1 logs (82133 samples, 9 sensors) on one core of
+a 2.x GHz x86 box:
+
+    resolution     keys   dict KiB  array KiB   dict s  array s
+            1d       11         11          6    0.041    0.038
+            1h      226        222        103    0.051    0.066
+           10m     1352       1327        633    0.052    0.067
+            1m    13426      13339       6531    0.118    0.120
+
+The arrays need about half the memory.  Binning takes about the same time
+(a little more, as a method call replaces the inline dict lookups).
+"""
+
+import glob
+import sys
+import time
+import tracemalloc
+
+import SensorAccumulator
+import SensorIdToName
+
+DEFAULT_LOGS = '../RawData.phase1/temperature*'
+
+# resolution name and number of characters of the timestamp kept
+RESOLUTIONS = (('1d', 10), ('1h', 13), ('10m', 15), ('1m', 16))
+
+
+class SensorValue():
+    '''
+    copy of the class in the BinBy*New.py programs
+    '''
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+
+    def addValue(self, value):
+        self.count = self.count + 1
+        self.sum = self.sum + float(value)
+
+    def getAverage(self):
+        return (self.sum / self.count)
+
+    def getCount(self):
+        return self.count
+
+
+def read_samples(filenames):
+    '''
+    return a list of (timestamp, name, value) from phase 1 logs
+    '''
+    samples = []
+    for filename in filenames:
+        with open(filename) as f:
+            for line in f:
+                sl = line.translate(dict.fromkeys([0])).split()
+                if len(sl) != 4:
+                    continue
+                name = SensorIdToName.name_from_type_and_id(sl[1], sl[2])
+                samples.append((sl[0], name, float(sl[3])))
+    return samples
+
+
+def bin_with_dicts(samples, width):
+    sensor_map_values_by_timestamp = dict()
+    for timestamp, name, value in samples:
+        timestamp = timestamp[0:width]
+        if timestamp not in sensor_map_values_by_timestamp:
+            sensor_map_values_by_timestamp[timestamp] = dict()
+        if name not in sensor_map_values_by_timestamp[timestamp]:
+            sensor_map_values_by_timestamp[timestamp][name] = SensorValue()
+        sensor_map_values_by_timestamp[timestamp][name].addValue(value)
+    return sensor_map_values_by_timestamp
+
+
+def bin_with_accumulator(samples, width):
+    values = SensorAccumulator.sensor_accumulator()
+    for timestamp, name, value in samples:
+        values.add(timestamp[0:width], name, value)
+    return values
+
+
+def measure(function, samples, width):
+    '''
+    return (result, peak bytes, seconds) for function(samples, width)
+
+    time and memory are measured in separate runs as tracemalloc slows
+    things down
+    '''
+    start = time.perf_counter()
+    function(samples, width)
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = function(samples, width)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, seconds
+
+
+if __name__ == "__main__":
+    filenames = sys.argv[1:]
+    if not filenames:
+        filenames = sorted(glob.glob(DEFAULT_LOGS))
+    samples = read_samples(filenames)
+    names = { s[1] for s in samples }
+    print('{} samples, {} sensors from {}'.format(len(samples), len(names),
+                                                  ', '.join(filenames)))
+    print('{:>10} {:>8} {:>10} {:>10} {:>8} {:>8}'.format('resolution', 'keys',
+                                                         'dict KiB', 'array KiB',
+                                                         'dict s', 'array s'))
+    for resolution, width in RESOLUTIONS:
+        d, d_peak, d_seconds = measure(bin_with_dicts, samples, width)
+        a, a_peak, a_seconds = measure(bin_with_accumulator, samples, width)
+        # make sure both give the same answers
+        for ts, values_by_name in d.items():
+            for n, v in values_by_name.items():
+                assert v.getCount() == a.getCount(ts, n)
+                assert v.getAverage() == a.getAverage(ts, n)
+        print('{:>10} {:>8} {:>10} {:>10} {:>8.3f} {:>8.3f}'.format(resolution,
+                                                                  len(a),
+                                                                  d_peak // 1024,
+                                                                  a_peak // 1024,
+                                                                  d_seconds,
+                                                                  a_seconds))
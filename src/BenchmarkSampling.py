@@ -0,0 +1,510 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Compare ways of sampling the serial ports:
+    thread      a new thread for each port on each tick (as MoundController.py
+                used to)
+    sampler     a sampler thread for each port which lives as long as the
+                program and waits to be asked for a sample (as
+                PortSampler.py first did)
+    select      the sampling_scheduler of PortSampler.py (used by
+                MoundController.py) which reads all of the ports from one
+                thread and parses each answer in one go
+
+Four things are measured:
+    start   the time to start and join an empty thread against the time to
+            hand a request to a waiting thread and get the answer back
+    parse   the time to turn an answer in to the lines to be written a line
+            at a time (as MoundController.py used to) against all at once
+            with one timestamp
+    late    how late each tick of the sampling loop starts and how late
+            each port is asked for its samples (the NL is written), against
+            when the tick should have happened
+    cpu     the processor time used for each tick
+
+Without devices fake Arduinos are used:  a process which answers on the
+other end of a socket like DS18B20_SampleOnDemand does, after a delay
+(the conversion) with a line for each sensor at the speed of the serial
+port.  The fake ports read a byte at a time, as readline() of pyserial
+does.  With devices (e.g. /dev/ttyUSB0) those ports are sampled, so stop
+MoundController.py first.
+
+usage:
+    BenchmarkSampling.py [-t ticks] [-i interval] [-p ports] [-s sensors]
+                         [-d delay] [device ...]
+
+Results with the defaults (8 fake Arduinos with 8 sensors each) on one
+core of a 2.x GHz x86 box:
+
+    start           thread us  sampler us
+                         42.1        13.1
+
+    parse             line us    batch us
+                         34.3        15.0
+
+                          tick late ms        sample late ms     cpu ms
+    method             mean        max       mean        max   per tick
+    thread            0.616      9.135      1.127     10.186     11.057
+    sampler           0.207      1.487      0.506      1.810      9.879
+    select            0.213      1.799      0.197      1.868      2.995
+
+Starting a thread costs about three times handing work to one which is
+waiting, and parsing an answer all at once with one timestamp less than
+half of doing it a line at a time.  How late a tick starts is mostly how
+late the wait for it ends.  The largest are other things running on the
+box, so the means of all three move between 0.2 and 0.8 ms from run to
+run, while most select ticks start less than 0.1 ms late (it waits the
+whole milliseconds before a deadline and sleeps the rest).  Most of the
+processor time goes to reading a byte at a time, which select does not
+do, so it needs a quarter of the time of the others.  With -i 4 -d 0.75
+(the pumping rate and a 12 bit conversion) it is the same, about 3 ms of
+processor time a tick for 8 ports against 10 to 12 ms.
+"""
+
+import argparse
+import datetime
+import os
+import queue
+import select
+import socket
+import threading
+import time
+
+import PortSampler
+
+# as MoundController.py
+PORT_SPEED = 115200
+ARDUINO_RESET_TIME_IN_SECONDS = 3
+NL = '\n'.encode('UTF-8')
+
+# a byte is 10 bits on the wire
+BYTES_PER_SECOND = PORT_SPEED / 10
+
+# as MoundController.py
+DATETIME_FORMAT = '%Y.%m.%d_%H:%M:%S'
+
+# times to start a thread or wake a sampler for the start measurement
+START_REPEATS = 2000
+
+# answers parsed for the parse measurement
+PARSE_REPEATS = 2000
+
+
+def fake_arduino(sock, number, sensors, delay):
+    '''
+    answer like an Arduino running DS18B20_SampleOnDemand on sock:  after
+    a NL wait delay seconds (the conversion) then send a line for each
+    sensor and an empty line, as fast as the serial port would
+    '''
+    lines = [('DS18B20 28.ff.00.00.00.00.{:02x}.{:02x} 23.5000\r\n'.format(number, i)).encode('UTF-8')
+             for i in range(sensors)] + [b'\r\n']
+    try:
+        while True:
+            data = sock.recv(64)
+            if not data:
+                return
+            for i in range(data.count(NL)):
+                time.sleep(delay)
+                for l in lines:
+                    sock.sendall(l)
+                    time.sleep(len(l) / BYTES_PER_SECOND)
+    except OSError:
+        return  # the other end went away
+
+
+def start_fake_arduinos(count, sensors, delay):
+    '''
+    return a list of count fake_ports with a fake_arduino in another
+    process on the other end of each
+    '''
+    pairs = [socket.socketpair() for n in range(count)]
+    if 0 == os.fork():
+        for ours, theirs in pairs:
+            ours.close()
+        arduinos = [threading.Thread(target=fake_arduino, args=(theirs, n, sensors, delay))
+                    for n, (ours, theirs) in enumerate(pairs)]
+        for a in arduinos:
+            a.start()
+        for a in arduinos:
+            a.join()
+        os._exit(0)
+    ports = []
+    for n, (ours, theirs) in enumerate(pairs):
+        theirs.close()
+        ports.append(fake_port(ours, 'fake{}'.format(n)))
+    return ports
+
+
+class fake_port():
+    '''
+    the end of a socket to a fake_arduino, read like pyserial reads a
+    serial port
+    '''
+    def __init__(self, sock, name):
+        self.sock = sock
+        self.name = name
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def write(self, data):
+        self.sock.sendall(data)
+
+    def read(self, size=1):
+        while True:
+            select.select([self.sock], [], [])
+            try:
+                return os.read(self.sock.fileno(), size)
+            except BlockingIOError:
+                pass
+
+    def readline(self):
+        line = b''
+        while not line.endswith(NL):
+            c = self.read(1)
+            if not c:
+                break
+            line += c
+        return line
+
+
+class timed_port():
+    '''
+    a port which remembers when each NL was written to it
+    '''
+    def __init__(self, port):
+        self.port = port
+        self.name = getattr(port, 'name', str(port))
+        self.written = []
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def write(self, data):
+        self.written.append(time.time())
+        return self.port.write(data)
+
+    def readline(self):
+        return self.port.readline()
+
+
+def read_port(port):
+    '''
+    copy of the get_readings_from_port MoundController.py used before
+    PortSampler.read_answer, without DEBUG
+    '''
+    results = []
+    port.write(NL)  # ask for samples
+    l = port.readline().decode('UTF-8').strip()
+    while len(l.split()) > 0:
+        results.append(process_sensor_reading(l))
+        l = port.readline().decode('UTF-8')
+    return results
+
+
+class port_reader_thread(threading.Thread):
+    '''
+    copy of the class MoundController.py used before PortSampler.py
+    '''
+    def __init__(self, queue, port):
+        threading.Thread.__init__(self)
+        self.daemon = False
+        self.queue = queue
+        self.port = port
+
+    def run(self):
+        results = read_port(self.port)
+        for r in results:
+            if r:  # might have a None in the list, if so ignore it
+                self.queue.put(r)
+
+
+class threads_reader_thread(threading.Thread):
+    '''
+    copy of the ports_reader_thread MoundController.py used before
+    PortSampler.py, plus tick_late
+    '''
+    def __init__(self, queue, ports, interval_in_seconds):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.ports = ports
+        self.interval_in_seconds = interval_in_seconds
+        self.keep_running = True
+        self.tick_late = PortSampler.lateness()
+
+    def stop(self):
+        self.keep_running = False
+
+    def run(self):
+        next_sample_time = time.time()
+        while self.keep_running:
+            self.tick_late.add(time.time() - next_sample_time)
+            threads = []
+            for port in self.ports:
+                srt = port_reader_thread(self.queue, port)
+                threads.append(srt)
+                srt.start()
+            # wait for everything to complete
+            for t in threads:
+                t.join()
+
+            next_sample_time = next_sample_time + self.interval_in_seconds
+            delay_time = next_sample_time - time.time()
+            if 0 < delay_time:  # don't sleep if already next sample time
+                time.sleep(delay_time)
+
+
+class port_sampler(threading.Thread):
+    '''
+    Sample a port with read(port) each time it is asked to and queue up
+    the results, as PortSampler.py first did
+    '''
+    def __init__(self, port, read, write_queue):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.read = read
+        self.write_queue = write_queue
+        self.requests = queue.Queue()
+
+    def sample(self, done):
+        '''
+        ask for a sample, the sampler is put on done (a queue.Queue) when
+        it is finished
+        '''
+        self.requests.put(done)
+
+    def run(self):
+        while True:
+            done = self.requests.get()
+            for r in self.read(self.port):
+                if r:  # might have a None in the list, if so ignore it
+                    self.write_queue.put(r)
+            done.put(self)
+
+
+class samplers_reader_thread(threading.Thread):
+    '''
+    threads_reader_thread with a port_sampler for each port rather than a
+    new thread on each tick
+    '''
+    def __init__(self, queue, ports, interval_in_seconds, read):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.ports = ports
+        self.interval_in_seconds = interval_in_seconds
+        self.read = read
+        self.keep_running = True
+        self.tick_late = PortSampler.lateness()
+
+    def stop(self):
+        self.keep_running = False
+
+    def run(self):
+        port_samplers = [port_sampler(p, self.read, self.queue) for p in self.ports]
+        for s in port_samplers:
+            s.start()
+        done = queue.Queue()
+        next_sample_time = time.monotonic()
+        while self.keep_running:
+            self.tick_late.add(time.monotonic() - next_sample_time)
+            for s in port_samplers:
+                s.sample(done)
+            # wait for everything to complete
+            for s in port_samplers:
+                done.get()
+
+            next_sample_time = next_sample_time + self.interval_in_seconds
+            delay_time = next_sample_time - time.monotonic()
+            if 0 < delay_time:  # don't sleep if already next sample time
+                time.sleep(delay_time)
+
+
+def process_sensor_reading(line):
+    '''
+    copy of the function MoundController.py used before
+    process_sensor_readings, without the watched sensor
+    '''
+    if len(line.split()) == 3:
+        when = datetime.datetime.now().strftime(DATETIME_FORMAT)
+        items = line.split()
+        result = '{} {} {} {}\n'.format(when, items[0], items[1], items[2])
+        return result
+    else:
+        return None
+
+
+def process_sensor_readings(readings, when):
+    '''
+    process_sensor_readings of MoundController.py without the watched
+    sensor
+    '''
+    timestamp = datetime.datetime.fromtimestamp(when).strftime(DATETIME_FORMAT)
+    return ''.join(['{} {} {} {}\n'.format(timestamp, kind, sensor_id, value)
+                    for kind, sensor_id, value in readings])
+
+
+def measure_parse(sensors, repeats):
+    '''
+    return (seconds to turn an answer of sensors lines in to the lines to
+    be written a line at a time, seconds to do it all at once)
+    '''
+    lines = [('DS18B20 28.ff.00.00.00.00.00.{:02x} 23.5000\r\n'.format(i)).encode('UTF-8')
+             for i in range(sensors)]
+    start = time.perf_counter()
+    for i in range(repeats):
+        # as get_readings_from_port used to
+        results = []
+        l = lines[0].decode('UTF-8').strip()
+        for n in range(1, len(lines) + 1):
+            results.append(process_sensor_reading(l))
+            l = lines[n].decode('UTF-8') if n < len(lines) else ''
+    line_seconds = (time.perf_counter() - start) / repeats
+
+    answer = b''.join(lines)
+    start = time.perf_counter()
+    for i in range(repeats):
+        batch = process_sensor_readings(PortSampler.parse_answer(answer), time.time())
+    batch_seconds = (time.perf_counter() - start) / repeats
+    # the same but for the timestamps
+    assert [r.split()[1:] for r in results] == [b.split()[1:] for b in batch.splitlines()]
+    return line_seconds, batch_seconds
+
+
+def measure_start(repeats):
+    '''
+    return (seconds to start and join a thread, seconds to hand a request
+    to a waiting sampler and get it back)
+    '''
+    start = time.perf_counter()
+    for i in range(repeats):
+        t = threading.Thread(target=lambda: None)
+        t.start()
+        t.join()
+    thread_seconds = (time.perf_counter() - start) / repeats
+
+    s = port_sampler(None, lambda port: [], queue.Queue())
+    s.start()
+    done = queue.Queue()
+    start = time.perf_counter()
+    for i in range(repeats):
+        s.sample(done)
+        done.get()
+    sampler_seconds = (time.perf_counter() - start) / repeats
+    return thread_seconds, sampler_seconds
+
+
+def measure_ticks(reader, ports, ticks, interval):
+    '''
+    run reader (a thread sampling ports every interval seconds) for ticks
+    ticks and return (tick lateness, sample lateness, processor seconds)
+    '''
+    for p in ports:
+        p.written = []
+    start = time.process_time()
+    reader.start()
+    while reader.tick_late.count < ticks:
+        time.sleep(interval / 4)
+    reader.stop()
+    reader.join()
+    seconds = time.process_time() - start
+    # the ticks were meant to be interval apart from the first one
+    first = min(p.written[0] for p in ports)
+    sample_late = PortSampler.lateness()
+    for p in ports:
+        for i, when in enumerate(p.written):
+            sample_late.add(when - (first + i * interval))
+    return reader.tick_late, sample_late, seconds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='measure ways of sampling the serial ports')
+    parser.add_argument('-t', '--ticks', type=int, default=40,
+                        help='ticks of each method (default 40)')
+    parser.add_argument('-i', '--interval', type=float, default=0.5,
+                        help='seconds between ticks (default 0.5)')
+    parser.add_argument('-p', '--ports', type=int, default=8,
+                        help='number of fake ports (default 8)')
+    parser.add_argument('-s', '--sensors', type=int, default=8,
+                        help='sensors on each fake port (default 8)')
+    parser.add_argument('-d', '--delay', type=float, default=0.1,
+                        help='seconds a fake Arduino takes to answer (default 0.1)')
+    parser.add_argument('devices', nargs='*',
+                        help='serial devices to sample instead of fake ports')
+    args = parser.parse_args()
+
+    if args.devices:
+        import serial
+        ports = [timed_port(serial.Serial(d, PORT_SPEED)) for d in args.devices]
+        # the open causes the Arduino to reset
+        time.sleep(ARDUINO_RESET_TIME_IN_SECONDS)
+    else:
+        # before any threads are started here
+        ports = [timed_port(p)
+                 for p in start_fake_arduinos(args.ports, args.sensors, args.delay)]
+
+    thread_seconds, sampler_seconds = measure_start(START_REPEATS)
+    print('{:<12} {:>12} {:>11}'.format('start', 'thread us', 'sampler us'))
+    print('{:<12} {:>12.1f} {:>11.1f}'.format('', thread_seconds * 1000000,
+                                              sampler_seconds * 1000000))
+    print()
+
+    line_seconds, batch_seconds = measure_parse(args.sensors, PARSE_REPEATS)
+    print('{:<12} {:>12} {:>11}'.format('parse', 'line us', 'batch us'))
+    print('{:<12} {:>12.1f} {:>11.1f}'.format('', line_seconds * 1000000,
+                                              batch_seconds * 1000000))
+    print()
+
+    print('{} ticks of {} seconds, ports {}'.format(args.ticks, args.interval,
+                                                     ', '.join(p.name for p in ports)))
+    print('{:<12} {:>21} {:>21} {:>10}'.format('', 'tick late ms', 'sample late ms', 'cpu ms'))
+    print('{:<12} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('method', 'mean', 'max',
+                                                           'mean', 'max', 'per tick'))
+    for method in ('thread', 'sampler', 'select'):
+        write_queue = queue.Queue()
+        if 'thread' == method:
+            reader = threads_reader_thread(write_queue, ports, args.interval)
+        elif 'sampler' == method:
+            reader = samplers_reader_thread(write_queue, ports, args.interval,
+                                            read_port)
+        else:
+            reader = PortSampler.sampling_scheduler(write_queue, process_sensor_readings)
+            reader.set_interval(ports, args.interval)
+        tick_late, sample_late, seconds = measure_ticks(reader, ports, args.ticks,
+                                                        args.interval)
+        if not args.devices:
+            # make sure every sample was read
+            lines = sum(len(r.splitlines()) for r in write_queue.queue)
+            assert lines == sum(len(p.written) for p in ports) * args.sensors
+        print('{:<12} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(method,
+                                                                            tick_late.mean() * 1000,
+                                                                            tick_late.largest * 1000,
+                                                                            sample_late.mean() * 1000,
+                                                                            sample_late.largest * 1000,
+                                                                            seconds * 1000 / tick_late.count))
@@ -0,0 +1,1138 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Bin the temperature data at several resolutions in a single pass.
+
+The BinBy*New.py programs each read and parse all of temp.log to build a
+single table.  This reads temp.log once (with LogParser.py) and, as each
+line is parsed, adds the value to a table for each resolution (1d, 1h, 10m
+and 1m by default).
+After everything is read a CSV is written for each table in the same
+format the BinBy*New.py programs use:
+    temp_1d.csv, temp_1h.csv, temp_10m.csv and temp_1m.csv
+
+A resolution can be any number of seconds, minutes, hours or days, e.g.
+30s, 5m, 15m or 6h (which makes temp_30s.csv, ...).  The time slice of a
+sample is its timestamp in seconds since 1970 divided by the length of the
+resolution.  The label of a time slice is the timestamp of its start with
+the fields that are always zero left off.  1d, 1h, 10m and 1m keep the
+labels the BinBy*New.py programs make (so 10m is yyyy.mm.dd_hh:m).
+
+With "-c checkpoint_file" the state needed to carry on is saved after each
+run:  the byte offset reached in temp.log, the sum / count of the last
+(still open) time slice of each table and where the last row of each CSV
+starts.  The next run starts reading at that offset, adds the new lines to
+the open time slices and rewrites the CSVs from their last row onward, so
+the parsing and binning done is proportional to the new data rather than
+all the data.  A hash of all of temp.log before the offset is saved too,
+which costs reading (not parsing) the log once a run.
+
+Everything is rebuilt from the start of temp.log when the checkpoint can
+not be used:
+-- temp.log is shorter than the offset or the data before the offset changed
+   (anywhere, e.g. IngestLogs.py put a late line in its place)
+-- a new line falls in a time slice before the open one
+-- a new sensor name shows up (the heading line and every row change)
+-- a CSV is not the size it was when the checkpoint was saved
+
+With "-v" the tables are made with numpy by BinDataNumpy.py, which is much
+faster but needs numpy.
+
+With "-w N" temp.log is split in to N pieces at line boundaries and each
+piece is binned by a separate process.  Sums and counts can simply be
+added up so the tables from the pieces are merged (in order) to make the
+final tables.
+
+With "-s" the data is streamed:  each row is written as soon as the input
+moves past its time slice so only the current time slice of each table is
+held in memory.  This needs the input to be sorted by time, as
+collect_data.sh does.  The heading line needs every sensor name before any
+row is written so the names come from a quick first pass over the input,
+or with "-n" from SensorIdToName (which allows reading from stdin).  If a
+line is out of order, or has a name not in the heading, the tables are
+made in memory instead (or the program fails when reading stdin).  With
+"-k" the tables are made in memory as well and the program fails if any
+CSV is not the same as the streamed one.
+
+The average of a time slice is normally the mean of its samples.
+MoundController.py samples the pipe sensors every 4 seconds while pumping
+and every 58 seconds otherwise, so the mean of an hour or a day is pulled
+toward the pumping periods.  With "-t [max_gap]" each sample is weighted
+by the time since the last sample of the same sensor, but no more than
+max_gap (2m by default) so a sensor which was off for a while does not
+stand for all that time.  The first sample of a sensor gets max_gap.  The
+weight goes to the time slice of the sample, it is not split at the edge
+of the time slice, which matters little when the time slices are much
+longer than the gaps.  Only the time of the last sample of each sensor is
+kept (and saved in the checkpoint) so this is still one pass.  It can not
+be used with -v or -w as the pieces would not know the earlier samples.
+
+With "-x" the number of samples, smallest and largest value and standard
+deviation of each cell are found in the same pass (see
+SensorAccumulator.py) and written to companion files in the same format:
+    temp_1h_count.csv, temp_1h_min.csv, temp_1h_max.csv, temp_1h_stddev.csv
+This works with the checkpoint and -w but not with -s or -v.
+
+With "-b" the averages and sample counts of each table are also written
+to temp_1d.bin, ... (see BinaryTable.py) which numpy can map straight
+from the file rather than parsing the CSV:
+    names, starts, values, counts = BinaryTable.load_table('temp_1m.bin')
+Empty cells are NaN.  This works with everything but -s.  With "-u" the
+exact sums and counts are written to temp_1d.sums, ... from which
+Rollup.py can make coarser tables later without reading temp.log.
+
+Only the finest table of each chain (1m -> 10m -> 1h -> 1d) is made from
+the samples, the coarser ones are added up from it (see Rollup.py), except
+with -x where every table is made from the samples.  With the checkpoint
+this is done when everything is binned, the few new lines of a normal run
+are added to every table.
+
+With "-d mound.db" the tables are made from a database kept by
+MoundStore.py rather than from the logs, with a SQL GROUP BY for each
+table which reads only the (sensor, ts, value) index.  -t and -x can not
+be used with it.
+
+With "-a segment ..." the aggregates of the months CompactLogs.py has
+compacted are added too.  An aggregate only goes to the tables made of
+whole time slices of it:  1m aggregates go to every default table, 1h
+aggregates only to 1h and 1d, so those months are missing from temp_1m.csv
+and temp_10m.csv.  The sums and counts are exact so the rows are the same
+as those made from the samples.  This works with the checkpoint (a
+different set of segments bins everything again) and -w, not with -s, -v,
+-d, -t or -x (the aggregates have no weights or spread).
+
+More than one log can be given with "-i", and logs can be .gz files or
+.zip archives (read without unpacking them).  Lines in the phase 1 format
+    timestamp DS18B20 id value
+get their names from SensorIdToName, so the phase 1 and phase 2 data can
+be binned together:
+    BinData.py -i ../RawData.phase1/temp* temp.log
+The checkpoint and "-w" need a single uncompressed log.
+
+Lines which are not "timestamp name value" are put back together where
+possible (see LogParser.py).  The pieces which can not be used are written
+to the file given with "-q" and a count is printed at the end.
+
+Logs which are not compressed are read through their caches (see
+LogCache.py, kept under ~/.cache/MoundController/ or the directory given
+with "-e"), so a log is only parsed once and a run over a log which has
+not changed does not parse anything.  A log whose cache can not be made
+or written is parsed as it is.  The checkpoint and "-w" read byte ranges
+of the log itself:  they already only parse the new lines, or parse the
+pieces in parallel.
+
+usage:
+    BinData.py [-i temp.log ...] [-o output_directory] [-r 1d,1h,10m,1m,...]
+               [-t [max_gap]] [-x] [-b] [-u] [-q quarantine_file]
+               [-a segment ...] [-e cache_root]
+               [-c checkpoint_file | -s [-n] [-k] | -v | -w workers |
+                -d database]
+
+use "-i -" to read from stdin (no checkpoint is possible).
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+
+import BinaryTable
+import CompactLogs
+import LogCache
+import LogParser
+import Rollup
+import SensorAccumulator
+import SensorIdToName
+
+DEBUG = 0
+
+DEFAULT_INPUT_FILENAME = '../Data/temp.log'
+DEFAULT_OUTPUT_DIRECTORY = '../Data'
+OUTPUT_FILENAME_FORMAT = 'temp_{}.csv'
+BINARY_FILENAME_FORMAT = 'temp_{}.bin'
+SUMS_FILENAME_FORMAT = 'temp_{}.sums'
+
+DEFAULT_RESOLUTIONS = ('1d', '1h', '10m', '1m')
+
+# a little more than two of the 58 second sample intervals of MoundController.py
+DEFAULT_MAX_GAP = '2m'
+
+# a resolution is a number followed by one of these
+RESOLUTION_UNITS = {
+    's' : 1,
+    'm' : 60,
+    'h' : 60 * 60,
+    'd' : 24 * 60 * 60,
+    }
+RESOLUTION_RE = re.compile(r'([1-9][0-9]*)([smhd])\Z')
+
+#                     111111111
+#           0123456789012345678
+# format is yyyy.mm.dd_hh.mm.ss
+# labels keep this many characters from the left of the timestamp
+LABEL_WIDTHS = (
+    (24 * 60 * 60, 10),  # toss hour, minute and second parts
+    (60 * 60, 13),       # toss minute and second parts
+    (60, 16),            # toss second parts
+    (1, 19),
+    )
+# the BinBy*New.py programs cut 10 minute labels in the middle of the minute
+LEGACY_LABEL_WIDTHS = {
+    '10m' : 15,
+    }
+
+# how each statistic is written, the averages (and the rest) use ',{:.4f} '
+CELL_FORMATS = {
+    'count' : ',{:d} ',
+    }
+
+CHECKPOINT_VERSION = 4
+
+
+class RebuildNeeded(Exception):
+    '''
+    The checkpoint can not be used and everything must be binned again.
+    '''
+
+
+class StreamError(Exception):
+    '''
+    The input can not be streamed (out of order or an unexpected name).
+    '''
+
+
+def resolution_seconds(resolution):
+    '''
+    return the number of seconds in a resolution such as 30s, 15m, 6h or 1d
+
+    raise ValueError if it does not make sense
+    '''
+    m = RESOLUTION_RE.match(resolution)
+    if not m:
+        raise ValueError('unknown resolution "{}"'.format(resolution))
+    return int(m.group(1)) * RESOLUTION_UNITS[m.group(2)]
+
+
+def label_width(resolution, seconds):
+    '''
+    return how many characters of the yyyy.mm.dd_hh:mm:ss timestamp of the
+    start of a time slice are used as its label
+    '''
+    if resolution in LEGACY_LABEL_WIDTHS:
+        return LEGACY_LABEL_WIDTHS[resolution]
+    for unit, width in LABEL_WIDTHS:
+        if 0 == seconds % unit:
+            return width
+
+
+def format_row(timestamp, averages, cell_format=',{:.4f} '):
+    '''
+    return the CSV line for one time slice.  averages are in heading order
+    with None for empty cells, which are written as a single space.
+    '''
+    row = ['"{}"'.format(timestamp)]
+    for a in averages:
+        if a is None:
+            row.append(', ')
+        else:
+            row.append(cell_format.format(a))
+    row.append('\n')
+    return ''.join(row)
+
+
+def format_heading(names):
+    return '"when"' + ''.join(',"{}"'.format(n) for n in names) + '\n'
+
+
+class binned_table():
+    '''
+    Hold the average value of each sensor for each time slice of one
+    resolution.
+
+    The key of a time slice is (seconds since 1970 // seconds in the
+    resolution).
+
+    With statistics the count, min, max and stddev of each cell are kept
+    too and each can be written as a CSV of its own.  With binary the
+    averages and counts are also written to a BinaryTable.py file, with
+    sums the exact sums and counts.
+    '''
+    def __init__(self, resolution, statistics=False, binary=False, sums=False):
+        self.resolution = resolution
+        self.seconds = resolution_seconds(resolution)
+        self.label_width = label_width(resolution, self.seconds)
+        self.statistics = statistics
+        self.binary = binary
+        self.sums = sums
+        self.values = self.new_values()
+        # time slices before this have been written and can not change
+        self.floor = -sys.maxsize
+        # where the last row starts and the size of each CSV (and the
+        # binary tables, as 'binary' and 'sums') last written
+        self.csv_last_row_offset = dict()
+        self.csv_size = dict()
+
+    def new_values(self):
+        if self.statistics:
+            return SensorAccumulator.sensor_statistics()
+        return SensorAccumulator.sensor_accumulator()
+
+    def outputs(self):
+        '''
+        return the list of things which are written to CSVs
+        '''
+        if self.statistics:
+            return ['average'] + list(SensorAccumulator.STATISTICS)
+        return ['average']
+
+    def binary_outputs(self):
+        '''
+        return the list of BinaryTable.py files written, 'binary' and / or
+        'sums'
+        '''
+        return [o for o, wanted in (('binary', self.binary), ('sums', self.sums))
+                if wanted]
+
+    def row(self, key, names, statistic):
+        if 'average' == statistic:
+            return self.values.row_averages(key, names)
+        return self.values.row_statistics(key, names, statistic)
+
+    def label(self, key):
+        return LogParser.format_timestamp(key * self.seconds, self.label_width)
+
+    def add(self, seconds, name, value):
+        key = seconds // self.seconds
+        if key < self.floor:
+            raise RebuildNeeded('{} is before open {} time slice {}'.format(self.label(key),
+                                                                          self.resolution,
+                                                                          self.label(self.floor)))
+        self.values.add(key, name, value)
+
+    def add_weighted(self, seconds, name, value, weight):
+        key = seconds // self.seconds
+        if key < self.floor:
+            raise RebuildNeeded('{} is before open {} time slice {}'.format(self.label(key),
+                                                                          self.resolution,
+                                                                          self.label(self.floor)))
+        self.values.add_weighted(key, name, value, weight)
+
+    def write_csv(self, ofile, heading=True, statistic='average'):
+        '''
+        write the table (or one of the statistics) with a heading line of
+        names and a line for each time slice.  Empty cells are written as
+        a single space.
+
+        Remember where the last row starts and how big the file is so
+        the rows can be replaced by a later run.
+        '''
+        sn = sorted(self.values.names)
+        cell_format = CELL_FORMATS.get(statistic, ',{:.4f} ')
+
+        if heading:
+            ofile.write(format_heading(sn))
+        # print data
+        position = ofile.tell()
+        last_row_offset = position
+        for key in sorted(self.values.keys):
+            row = format_row(self.label(key), self.row(key, sn, statistic),
+                             cell_format)
+            ofile.write(row)
+            # ofile.tell() is slow for text files so keep count here
+            last_row_offset = position
+            position += len(row.encode('UTF-8'))
+        self.csv_last_row_offset[statistic] = last_row_offset
+        self.csv_size[statistic] = position
+
+    def update_csv(self, ofile, names, statistic='average'):
+        '''
+        replace the rows from the open time slice onward in a CSV written
+        by an earlier run.  names are the sensor names in that CSV.
+        '''
+        if sorted(self.values.names) != names:
+            raise RebuildNeeded('new sensor name in {} table'.format(self.resolution))
+        ofile.seek(0, os.SEEK_END)
+        if ofile.tell() != self.csv_size[statistic]:
+            raise RebuildNeeded('{} changed since the checkpoint'.format(ofile.name))
+        ofile.seek(self.csv_last_row_offset[statistic])
+        ofile.truncate()
+        self.write_csv(ofile, heading=False, statistic=statistic)
+
+    def write_binary(self, ofile, heading=True, output='binary'):
+        '''
+        write the averages (or with output 'sums' the sums) and counts as
+        a BinaryTable.py file, which is open for writing bytes, remembering
+        where the last row starts as write_csv does
+        '''
+        sums = 'sums' == output
+        sn = sorted(self.values.names)
+        row_format = BinaryTable.row_format(len(sn), sums)
+        row_values = self.values.row_sums if sums else self.values.row_averages
+
+        if heading:
+            ofile.write(BinaryTable.format_header(sn, sums))
+        position = ofile.tell()
+        last_row_offset = position
+        rows = []
+        for key in sorted(self.values.keys):
+            rows.append(BinaryTable.format_row(row_format, key * self.seconds,
+                                               row_values(key, sn),
+                                               self.values.row_counts(key, sn)))
+            last_row_offset = position
+            position += row_format.size
+        ofile.write(b''.join(rows))
+        self.csv_last_row_offset[output] = last_row_offset
+        self.csv_size[output] = position
+
+    def update_binary(self, ofile, names, output='binary'):
+        '''
+        replace the rows from the open time slice onward in a binary table
+        written by an earlier run.  names are the sensor names in it.
+        '''
+        if sorted(self.values.names) != names:
+            raise RebuildNeeded('new sensor name in {} table'.format(self.resolution))
+        ofile.seek(0, os.SEEK_END)
+        if ofile.tell() != self.csv_size.get(output):
+            raise RebuildNeeded('{} changed since the checkpoint'.format(ofile.name))
+        ofile.seek(self.csv_last_row_offset[output])
+        ofile.truncate()
+        self.write_binary(ofile, heading=False, output=output)
+
+    def merge(self, other):
+        '''
+        add the values of a table of the same resolution to this one
+        '''
+        if 0 == len(self.values):
+            self.values = other.values  # nothing to add to
+        else:
+            self.values.merge(other.values)
+
+    def roll_up(self, finer):
+        '''
+        add the values of a table whose time slices fit a whole number of
+        times in the time slices of this one
+        '''
+        self.values.merge(finer.values, self.seconds // finer.seconds)
+
+    def close_time_slices(self):
+        '''
+        forget all but the last time slice which may still get more values
+        '''
+        if self.values.keys:
+            last = max(self.values.keys)
+            self.values = self.values.keep_only([last])
+            self.floor = last
+
+    def get_state(self):
+        bins = dict()
+        for key, n, *cell in self.values.items():
+            bins.setdefault(key, dict())[n] = cell
+        return { 'statistics' : self.statistics,
+                 'binary' : self.binary,
+                 'sums' : self.sums,
+                 'names' : sorted(self.values.names),
+                 'floor' : self.floor,
+                 'bins' : bins,
+                 'csv_last_row_offset' : self.csv_last_row_offset,
+                 'csv_size' : self.csv_size }
+
+    def set_state(self, state):
+        self.floor = state['floor']
+        self.csv_last_row_offset = state['csv_last_row_offset']
+        self.csv_size = state['csv_size']
+        self.values = self.new_values()
+        for n in state['names']:
+            self.values.add_name(n)
+        # JSON turns the integer keys in to strings
+        for key, values_by_name in state['bins'].items():
+            for n, cell in values_by_name.items():
+                self.values.set(int(key), n, *cell)
+
+
+class streaming_table():
+    '''
+    Write the average value of each sensor for each time slice of one
+    resolution as soon as the input moves on to the next time slice.
+
+    The input must be sorted by time and only use the names given.
+    '''
+    def __init__(self, resolution, names, ofile):
+        self.resolution = resolution
+        self.seconds = resolution_seconds(resolution)
+        self.label_width = label_width(resolution, self.seconds)
+        self.names = sorted(names)
+        self.name_set = set(names)
+        self.ofile = ofile
+        self.key = None
+        self.values = SensorAccumulator.sensor_accumulator()
+        self.ofile.write(format_heading(self.names))
+
+    def label(self, key):
+        return LogParser.format_timestamp(key * self.seconds, self.label_width)
+
+    def add(self, seconds, name, value):
+        self.add_weighted(seconds, name, value, 1)
+
+    def add_weighted(self, seconds, name, value, weight):
+        key = seconds // self.seconds
+        if key != self.key:
+            if self.key is not None:
+                if key < self.key:
+                    raise StreamError('{} follows {}'.format(self.label(key),
+                                                              self.label(self.key)))
+                self.close()
+            self.key = key
+        if name not in self.name_set:
+            raise StreamError('"{}" is not in the heading'.format(name))
+        self.values.add_weighted(key, name, value, weight)
+
+    def close(self):
+        '''
+        write the current time slice
+        '''
+        if self.values.keys:
+            self.ofile.write(format_row(self.label(self.key),
+                                        self.values.row_averages(self.key,
+                                                                 self.names)))
+        self.values.clear()
+
+
+class sample_weights():
+    '''
+    Weigh each sample by the number of seconds since the last sample of
+    the same sensor, but no more than max_gap seconds.  The first sample
+    of a sensor gets max_gap.
+
+    last_seen holds the time of the last sample of each sensor.
+    '''
+    def __init__(self, max_gap):
+        self.max_gap = max_gap
+        self.last_seen = dict()
+
+    def weigh(self, records):
+        '''
+        yield (seconds, name, value, weight) for each (seconds, name, value)
+        '''
+        max_gap = self.max_gap
+        last_seen = self.last_seen
+        for seconds, name, value in records:
+            last = last_seen.get(name)
+            if last is None:
+                weight = max_gap
+                last_seen[name] = seconds
+            elif seconds > last:
+                weight = min(seconds - last, max_gap)
+                last_seen[name] = seconds
+            else:
+                weight = 0  # same time as (or before) the last sample
+            yield seconds, name, value, weight
+
+
+def bin_lines(records, tables, weights=None):
+    '''
+    add each (seconds, name, value) record to every table, weighted by
+    weights (a sample_weights) if it is given
+
+    return the number of entries used
+    '''
+    entries = 0
+    if weights is None:
+        for seconds, name, value in records:
+            for t in tables:
+                t.add(seconds, name, value)
+            entries+=1
+    else:
+        for seconds, name, value, weight in weights.weigh(records):
+            for t in tables:
+                t.add_weighted(seconds, name, value, weight)
+            entries+=1
+
+    return entries
+
+
+def bin_log(filename, tables, offset=0, end=None, weights=None, damage=None,
+            partial=False):
+    '''
+    bin the lines of filename starting at offset (and stopping at end), a
+    partial last line only if partial is True (see LogParser.log_records).
+    Bad lines are counted in damage (a LogParser.damage_report).
+
+    return the number of entries used and the offset after the last line
+    '''
+    with open(filename, 'rb') as ifile:
+        records = LogParser.log_records(LogParser.map_log(ifile), offset, end,
+                                        damage, partial)
+        entries = bin_lines(records, tables, weights)
+    return entries, records.offset
+
+
+def is_plain_log(inputs):
+    '''
+    return True if inputs is a single uncompressed log, which can be
+    memory mapped
+    '''
+    return (1 == len(inputs) and '-' != inputs[0]
+            and not LogParser.is_archive(inputs[0]))
+
+
+def bin_inputs(inputs, tables, weights=None, damage=None, cache_root=None):
+    '''
+    bin all the lines of inputs, a list of logs (see LogParser.open_logs),
+    through their caches under cache_root (see LogCache.py).  The tables
+    which can be are made from finer ones (see Rollup.py).
+
+    return the number of entries used
+    '''
+    base, steps = Rollup.rollup_plan(tables)
+    entries = bin_lines(LogCache.read_records(inputs, damage, cache_root), base,
+                        weights)
+    Rollup.roll_up(steps)
+    return entries
+
+
+def add_aggregates(filenames, tables):
+    '''
+    add the sums and counts of CompactLogs.py aggregate segments to each
+    table whose time slices are made of whole time slices of them
+
+    return the number of entries used
+    '''
+    entries = 0
+    for start, seconds, name, count, total, smallest, largest in CompactLogs.read_aggregates(filenames):
+        for t in tables:
+            if 0 == t.seconds % seconds:
+                t.values.add_total(start // t.seconds, name, total, count)
+        entries += count
+    return entries
+
+
+def aggregates_signature(filenames):
+    '''
+    return what the checkpoint keeps of the aggregate segments used, which
+    never change once they are sealed
+    '''
+    return [[os.path.basename(f), os.path.getsize(f)] for f in filenames]
+
+
+def split_log(filename, pieces):
+    '''
+    return a list of (start, end) byte offsets which split filename in to
+    about equal pieces at line boundaries
+    '''
+    size = os.path.getsize(filename)
+    starts = [0]
+    with open(filename, 'rb') as f:
+        for i in range(1, pieces):
+            f.seek(max(size * i // pieces, starts[-1]))
+            if f.tell() > 0:
+                f.seek(f.tell() - 1)
+                f.readline()  # move to the start of the next line
+            starts.append(f.tell())
+    ends = starts[1:] + [size]
+    return [(s, e) for s, e in zip(starts, ends) if s < e]
+
+
+def bin_piece(piece):
+    '''
+    bin one piece of a log in a worker process
+
+    piece is (filename, start, end, resolutions, statistics)
+
+    return (list of binned_table, number of entries used, damage_report).
+    Only the base tables of Rollup.rollup_plan are filled in.
+    '''
+    filename, start, end, resolutions, statistics = piece
+    tables = make_tables(resolutions, statistics)
+    base, steps = Rollup.rollup_plan(tables)
+    damage = LogParser.damage_report(keep=True)
+    entries, offset = bin_log(filename, base, start, end, damage=damage,
+                              partial=True)
+    return tables, entries, damage
+
+
+def parallel_bin(input_filename, resolutions, workers, statistics=False,
+                 damage=None, binary=False, sums=False):
+    '''
+    bin pieces of input_filename in workers processes and merge the results
+    (and the damage reports in to damage)
+
+    return (list of binned_table, number of entries used)
+    '''
+    pieces = [(input_filename, start, end, resolutions, statistics)
+              for start, end in split_log(input_filename, workers)]
+    tables = make_tables(resolutions, statistics, binary, sums)
+    entries = 0
+    with multiprocessing.Pool(workers) as pool:
+        # results come back in order so the sums are added up in order
+        for piece_tables, piece_entries, piece_damage in pool.imap(bin_piece, pieces):
+            for t, p in zip(tables, piece_tables):
+                t.merge(p)
+            entries += piece_entries
+            if damage is not None:
+                damage.merge(piece_damage)
+    base, steps = Rollup.rollup_plan(tables)
+    Rollup.roll_up(steps)
+    return tables, entries
+
+
+def csv_filename(output_directory, resolution, statistic='average'):
+    if 'average' != statistic:
+        resolution = resolution + '_' + statistic
+    return os.path.join(output_directory,
+                        OUTPUT_FILENAME_FORMAT.format(resolution))
+
+
+def binary_filename(output_directory, resolution, output='binary'):
+    if 'sums' == output:
+        return os.path.join(output_directory,
+                            SUMS_FILENAME_FORMAT.format(resolution))
+    return os.path.join(output_directory,
+                        BINARY_FILENAME_FORMAT.format(resolution))
+
+
+def write_tables(tables, output_directory):
+    for t in tables:
+        for statistic in t.outputs():
+            with open(csv_filename(output_directory, t.resolution, statistic), 'w') as ofile:
+                t.write_csv(ofile, statistic=statistic)
+        for output in t.binary_outputs():
+            with open(binary_filename(output_directory, t.resolution, output), 'wb') as ofile:
+                t.write_binary(ofile, output=output)
+
+
+def update_tables(tables, output_directory, names):
+    '''
+    replace the changed rows at the end of each CSV.  names maps each
+    resolution to the sensor names in its CSV.
+    '''
+    for t in tables:
+        for statistic in t.outputs():
+            filename = csv_filename(output_directory, t.resolution, statistic)
+            try:
+                with open(filename, 'r+') as ofile:
+                    t.update_csv(ofile, names[t.resolution], statistic)
+            except FileNotFoundError:
+                raise RebuildNeeded('{} is missing'.format(filename))
+        for output in t.binary_outputs():
+            filename = binary_filename(output_directory, t.resolution, output)
+            try:
+                with open(filename, 'r+b') as ofile:
+                    t.update_binary(ofile, names[t.resolution], output)
+            except FileNotFoundError:
+                raise RebuildNeeded('{} is missing'.format(filename))
+
+
+def save_checkpoint(checkpoint_filename, input_filename, offset, tables,
+                    weights=None, aggregates=(), hashed=(0, None)):
+    '''
+    save the state to carry on from offset in input_filename.  hashed is
+    (start, hasher) if the LogParser.log_hash of the log before start is
+    known already.
+    '''
+    start, hasher = hashed
+    hasher = LogParser.log_hash(input_filename, offset, start, hasher)
+    checkpoint = { 'version' : CHECKPOINT_VERSION,
+                   'offset' : offset,
+                   'hash' : hasher.hexdigest(),
+                   'aggregates' : aggregates_signature(aggregates),
+                   'tables' : { t.resolution : t.get_state() for t in tables } }
+    if weights is not None:
+        checkpoint['max_gap'] = weights.max_gap
+        checkpoint['last_seen'] = weights.last_seen
+    # write a new file and rename it so a crash can not leave half a checkpoint
+    temp_filename = checkpoint_filename + '.new'
+    with open(temp_filename, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_filename, checkpoint_filename)
+
+
+def load_checkpoint(checkpoint_filename, input_filename, tables, weights=None,
+                    aggregates=()):
+    '''
+    restore the state of tables (and weights) from the checkpoint and
+    return (the offset to carry on from in input_filename, which must have
+    been binned along with the same aggregate segments, the
+    LogParser.log_hash of the log before that offset)
+
+    return (0, None) (and leave tables alone) if there is no checkpoint
+    that can be used
+    '''
+    try:
+        with open(checkpoint_filename) as f:
+            checkpoint = json.load(f)
+    except FileNotFoundError:
+        return 0, None
+    if checkpoint.get('version') != CHECKPOINT_VERSION:
+        return 0, None
+    # weighted and plain sums can not be mixed
+    if checkpoint.get('max_gap') != (None if weights is None else weights.max_gap):
+        return 0, None
+    offset = checkpoint['offset']
+    if os.path.getsize(input_filename) < offset:
+        return 0, None
+    if checkpoint.get('aggregates', []) != aggregates_signature(aggregates):
+        return 0, None
+    for t in tables:
+        if t.resolution not in checkpoint['tables']:
+            return 0, None
+        if checkpoint['tables'][t.resolution]['statistics'] != t.statistics:
+            return 0, None
+        if checkpoint['tables'][t.resolution].get('binary', False) != t.binary:
+            return 0, None
+        if checkpoint['tables'][t.resolution].get('sums', False) != t.sums:
+            return 0, None
+    # the most costly check, last
+    hasher = LogParser.log_hash(input_filename, offset)
+    if hasher.hexdigest() != checkpoint['hash']:
+        return 0, None
+    for t in tables:
+        t.set_state(checkpoint['tables'][t.resolution])
+    if weights is not None:
+        weights.last_seen = checkpoint['last_seen']
+    return offset, hasher
+
+
+def incremental_bin(input_filename, output_directory, resolutions,
+                    checkpoint_filename, max_gap=None, statistics=False,
+                    damage=None, binary=False, sums=False, aggregates=()):
+    '''
+    carry on from the checkpoint if possible, otherwise bin everything
+    (and the aggregate segments).  save a new checkpoint when done.
+    Samples are weighted by time if max_gap is given.
+
+    return the number of entries used
+    '''
+    tables = make_tables(resolutions, statistics, binary, sums)
+    weights = make_weights(max_gap)
+    offset, hasher = load_checkpoint(checkpoint_filename, input_filename, tables,
+                                     weights, aggregates)
+    hashed = (offset, hasher)
+    # the damage is only kept if the lines are not read again
+    attempt = LogParser.damage_report(keep=True)
+    try:
+        if 0 == offset:
+            raise RebuildNeeded('no usable checkpoint')
+        names = { t.resolution : sorted(t.values.names) for t in tables }
+        entries, offset = bin_log(input_filename, tables, offset, weights=weights,
+                                  damage=attempt)
+        update_tables(tables, output_directory, names)
+        if damage is not None:
+            damage.merge(attempt)
+    except RebuildNeeded as e:
+        if DEBUG:
+            print('binning everything: {}'.format(e), file=sys.stderr)
+        tables = make_tables(resolutions, statistics, binary, sums)
+        weights = make_weights(max_gap)
+        base, steps = Rollup.rollup_plan(tables)
+        entries, offset = bin_log(input_filename, base, weights=weights,
+                                  damage=damage)
+        Rollup.roll_up(steps)
+        entries += add_aggregates(aggregates, tables)
+        write_tables(tables, output_directory)
+        hashed = (0, None)
+
+    for t in tables:
+        t.close_time_slices()
+    save_checkpoint(checkpoint_filename, input_filename, offset, tables, weights,
+                    aggregates, hashed)
+    return entries
+
+
+def scan_names(inputs, cache_root=None):
+    '''
+    return the set of names used in inputs, a list of logs
+    '''
+    names = set()
+    for filename in inputs:
+        columns = LogCache.cached_columns(filename, cache_root=cache_root)
+        if columns is None:
+            names.update(name for seconds, name, value in LogParser.read_logs([filename]))
+        else:
+            names.update(columns[0])
+            names.update(name for seconds, name, value
+                         in LogParser.log_records(columns[4], partial=True))
+    return names
+
+
+def names_from_map():
+    '''
+    return the set of names SensorIdToName knows about, as
+    LogParser.sensor_name gives them
+    '''
+    names = set(LogParser.read_sed_names().values())
+    for type, names_by_id in SensorIdToName.name_from_type_and_id_map.items():
+        names.update(LogParser.sensor_name(type, id) for id in names_by_id)
+    return names
+
+
+def stream_bin(inputs, output_directory, resolutions, names,
+               max_gap=None, damage=None, cache_root=None):
+    '''
+    write each row of each table as soon as its time slice is complete.
+    Samples are weighted by time if max_gap is given.
+
+    return the number of entries used
+    '''
+    ofiles = []
+    try:
+        tables = []
+        for r in resolutions:
+            ofile = open(csv_filename(output_directory, r), 'w')
+            ofiles.append(ofile)
+            tables.append(streaming_table(r, names, ofile))
+        # every streaming table is made from the samples, they keep only
+        # the current time slice so can not be added up (see Rollup.py)
+        entries = bin_lines(LogCache.read_records(inputs, damage, cache_root),
+                            tables, make_weights(max_gap))
+        for t in tables:
+            t.close()
+    finally:
+        for ofile in ofiles:
+            ofile.close()
+    return entries
+
+
+def check_stream(inputs, output_directory, resolutions, max_gap=None,
+                 cache_root=None):
+    '''
+    make the tables in memory and compare their CSVs with those stream_bin
+    wrote to output_directory
+
+    return a list of the CSVs which are not the same
+    '''
+    tables = make_tables(resolutions)
+    bin_inputs(inputs, tables, make_weights(max_gap), cache_root=cache_root)
+    different = []
+    for t in tables:
+        expected = io.StringIO()
+        t.write_csv(expected)
+        filename = csv_filename(output_directory, t.resolution)
+        with open(filename) as ifile:
+            if ifile.read() != expected.getvalue():
+                different.append(filename)
+    return different
+
+
+def vector_bin(inputs, output_directory, resolutions, damage=None,
+               binary=False, sums=False, cache_root=None):
+    '''
+    make the tables with numpy (and the binary and sums tables if binary
+    and sums)
+
+    return the number of entries used
+    '''
+    import BinDataNumpy  # only needed (along with numpy) here
+
+    resolutions = [(r, resolution_seconds(r), label_width(r, resolution_seconds(r)))
+                   for r in resolutions]
+    tables, names, entries = BinDataNumpy.bin_logs(inputs, resolutions, damage,
+                                                   cache_root)
+    for t in tables:
+        with open(csv_filename(output_directory, t.resolution), 'w') as ofile:
+            t.write_csv(ofile, names.names)
+        if binary:
+            with open(binary_filename(output_directory, t.resolution), 'wb') as ofile:
+                t.write_binary(ofile, names.names)
+        if sums:
+            with open(binary_filename(output_directory, t.resolution, 'sums'), 'wb') as ofile:
+                t.write_binary(ofile, names.names, sums=True)
+    return entries
+
+
+def database_bin(database_filename, tables):
+    '''
+    make the tables from the samples in a MoundStore.py database with a
+    GROUP BY query for each base table (see Rollup.py)
+
+    return the number of entries used
+    '''
+    import MoundStore  # only needed here
+
+    connection = MoundStore.connect(database_filename)
+    base, steps = Rollup.rollup_plan(tables)
+    for t in base:
+        # every table holds all the samples
+        entries = 0
+        for key, name, total, count in MoundStore.time_slices(connection, t.seconds):
+            t.values.set(key, name, total, count)
+            entries += count
+    connection.close()
+    Rollup.roll_up(steps)
+    return entries
+
+
+def make_tables(resolutions, statistics=False, binary=False, sums=False):
+    return [binned_table(r, statistics, binary, sums) for r in resolutions]
+
+
+def make_weights(max_gap):
+    if max_gap is None:
+        return None
+    return sample_weights(max_gap)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='bin temperature data at several resolutions in one pass')
+    parser.add_argument('-i', '--input', nargs='+', default=[DEFAULT_INPUT_FILENAME],
+                        help='logs of "timestamp name value" lines (or .gz, .zip), "-" for stdin')
+    parser.add_argument('-o', '--output-directory', default=DEFAULT_OUTPUT_DIRECTORY,
+                        help='where to write the temp_*.csv files')
+    parser.add_argument('-r', '--resolutions', '--interval', default=','.join(DEFAULT_RESOLUTIONS),
+                        help='comma separated list of intervals such as 30s, 15m, 6h or 1d')
+    parser.add_argument('-t', '--time-weighted', nargs='?', const=DEFAULT_MAX_GAP,
+                        metavar='MAX_GAP',
+                        help='weight samples by the time since the last one, up to MAX_GAP (default {})'.format(DEFAULT_MAX_GAP))
+    parser.add_argument('-x', '--statistics', action='store_true',
+                        help='also write the count, min, max and stddev of each cell')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='also write the averages and counts to temp_*.bin for numpy')
+    parser.add_argument('-u', '--sums', action='store_true',
+                        help='also write the exact sums and counts to temp_*.sums for Rollup.py')
+    parser.add_argument('-a', '--aggregates', nargs='*', default=[],
+                        metavar='SEGMENT',
+                        help='also add these aggregate segments made by CompactLogs.py')
+    parser.add_argument('-e', '--cache-root', default=LogCache.DEFAULT_CACHE_ROOT,
+                        help='where the caches of the logs are kept (default {})'.format(LogCache.DEFAULT_CACHE_ROOT))
+    parser.add_argument('-q', '--quarantine',
+                        help='write the pieces of lines which can not be used to this file')
+    parser.add_argument('-c', '--checkpoint',
+                        help='carry on from (and save) the state in this file')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='write rows as each time slice ends (input sorted by time)')
+    parser.add_argument('-n', '--names-from-map', action='store_true',
+                        help='with --stream, use the names from SensorIdToName for the heading')
+    parser.add_argument('-k', '--check', action='store_true',
+                        help='with --stream, also bin in memory and fail if the CSVs differ')
+    parser.add_argument('-v', '--vectorized', action='store_true',
+                        help='make the tables with numpy')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of processes to bin pieces of the input')
+    parser.add_argument('-d', '--database',
+                        help='make the tables from this MoundStore.py database rather than the input')
+    args = parser.parse_args()
+
+    resolutions = args.resolutions.split(',')
+    try:
+        tables = make_tables(resolutions, args.statistics, args.binary, args.sums)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if 1 < sum(1 for o in (args.checkpoint, args.stream, args.vectorized,
+                           args.workers > 1, args.database) if o):
+        parser.error('only one of --checkpoint, --stream, --vectorized, --workers and --database can be used')
+    if args.check and (not args.stream or '-' in args.input):
+        parser.error('--check needs --stream and inputs which can be read again')
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    if args.statistics and (args.stream or args.vectorized or args.database):
+        parser.error('--statistics can not be used with --stream, --vectorized or --database')
+    if (args.binary or args.sums) and args.stream:
+        parser.error('--binary and --sums can not be used with --stream')
+    if args.aggregates and (args.stream or args.vectorized or args.database
+                            or args.time_weighted or args.statistics):
+        parser.error('--aggregates can not be used with --stream, --vectorized, --database, --time-weighted or --statistics')
+    max_gap = None
+    if args.time_weighted:
+        if args.vectorized or args.workers > 1 or args.database:
+            parser.error('--time-weighted can not be used with --vectorized, --workers or --database')
+        try:
+            max_gap = resolution_seconds(args.time_weighted)
+        except ValueError as e:
+            parser.error('bad --time-weighted gap: {}'.format(e))
+
+    quarantine = None
+    if args.quarantine:
+        quarantine = open(args.quarantine, 'w', encoding='UTF-8')
+    damage = LogParser.damage_report(quarantine)
+
+    if args.database:
+        entries = database_bin(args.database, tables)
+        write_tables(tables, args.output_directory)
+    elif args.vectorized:
+        entries = vector_bin(args.input, args.output_directory, resolutions,
+                             damage, args.binary, args.sums, args.cache_root)
+    elif args.checkpoint:
+        if not is_plain_log(args.input):
+            parser.error('a checkpoint needs one uncompressed file to read')
+        entries = incremental_bin(args.input[0], args.output_directory,
+                                  resolutions, args.checkpoint, max_gap,
+                                  args.statistics, damage, args.binary,
+                                  args.sums, args.aggregates)
+    elif args.stream:
+        if args.names_from_map:
+            names = names_from_map()
+        elif '-' in args.input:
+            parser.error('streaming from stdin needs --names-from-map')
+        else:
+            names = scan_names(args.input, args.cache_root)
+        # the damage is only kept if the lines are not read again
+        attempt = LogParser.damage_report(keep=True)
+        try:
+            entries = stream_bin(args.input, args.output_directory,
+                                 resolutions, names, max_gap, attempt,
+                                 args.cache_root)
+            damage.merge(attempt)
+            if args.check:
+                different = check_stream(args.input, args.output_directory,
+                                         resolutions, max_gap, args.cache_root)
+                if different:
+                    print('streamed tables differ from binning in memory: {}'.format(' '.join(different)),
+                          file=sys.stderr)
+                    sys.exit(1)
+        except StreamError as e:
+            if '-' in args.input:
+                print('can not stream: {}'.format(e), file=sys.stderr)
+                sys.exit(1)
+            print('can not stream ({}), binning in memory'.format(e),
+                  file=sys.stderr)
+            tables = make_tables(resolutions)
+            entries = bin_inputs(args.input, tables, make_weights(max_gap), damage,
+                                 args.cache_root)
+            write_tables(tables, args.output_directory)
+    else:
+        if args.workers > 1:
+            if not is_plain_log(args.input):
+                parser.error('--workers needs one uncompressed file to read')
+            tables, entries = parallel_bin(args.input[0], resolutions, args.workers,
+                                           args.statistics, damage, args.binary,
+                                           args.sums)
+        else:
+            entries = bin_inputs(args.input, tables, make_weights(max_gap), damage,
+                                 args.cache_root)
+        entries += add_aggregates(args.aggregates, tables)
+        write_tables(tables, args.output_directory)
+
+    if quarantine is not None:
+        quarantine.close()
+    if damage:
+        print(damage.summary(), file=sys.stderr)
+    if DEBUG:
+        print('{} entries read'.format(entries), file=sys.stderr)
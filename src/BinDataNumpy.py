@@ -0,0 +1,441 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Bin the temperature data with numpy rather than a python loop per line.
+
+temp.log is read in large chunks.  Each chunk is turned in to three
+columns:  the timestamp as integer seconds since 1970 (the local time in
+the log is treated as if it were UTC so there are no daylight saving
+gaps), an index in to a table of sensor names and the value.
+
+For each resolution the time slice of a sample is (seconds // width) and
+the (time slice, sensor) pair is made in to one integer key.  np.unique
+and np.bincount then give the sum and count for each key in the chunk.
+The partial sums from all the chunks are added up the same way at the
+end, and the CSV is written in the same format as BinData.py and the
+BinBy*New.py programs.
+
+A log which can be cached (see LogCache.py) already is in columns so
+nothing is parsed unless it changed, the columns are used straight from
+the cache.  Other logs (stdin, .gz and .zip files, or when the cache can
+not be written) are parsed here.
+
+Most chunks are clean and are split with one bytes.split() call.  If a
+chunk has a bad line (or is from a phase 1 log) it is parsed again by
+LogParser.py, which splits glued records and counts (and quarantines) the
+pieces it can not use.
+
+The values are kept as float64 rather than float32 so the sums (and the
+CSV) are the same as the python programs make.  DS18B20 readings are
+multiples of 1/16 degree so adding them up in a different order (which
+happens when a time slice spans two chunks) gives exactly the same sum.
+
+Only the finest table of each chain is made from the samples, the keys of
+the coarser ones are made from its keys and added up with reduce_keys()
+(see Rollup.py).  The binary tables (BinaryTable.py) are written straight
+from the arrays.
+
+numpy is needed for this, BinData.py uses it with "--vectorized".
+"""
+
+import io
+
+import numpy as np
+
+import BinaryTable
+import LogCache
+import LogParser
+import Rollup
+
+DEBUG = 0
+
+# read this much of the log at a time
+CHUNK_BYTES = 16 * 1024 * 1024
+
+# add this many records from a LogCache to the tables at a time
+CHUNK_RECORDS = 1024 * 1024
+
+# the sensor index is the low part of a key so there can be this many names
+MAX_SENSORS = 1 << 16
+
+#                     111111111
+#           0123456789012345678
+# format is yyyy.mm.dd_hh:mm:ss
+TIMESTAMP_LENGTH = 19
+TIMESTAMP_DIGITS = (0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18)
+TIMESTAMP_SEPARATORS = { 4 : b'.', 7 : b'.', 10 : b'_', 13 : b':', 16 : b':' }
+
+# February has one more in leap years
+DAYS_IN_MONTH = (31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def read_chunks(f, chunk_bytes=CHUNK_BYTES):
+    '''
+    yield chunks of the binary file f which end at the end of a line
+    '''
+    rest = b''
+    while True:
+        data = f.read(chunk_bytes)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        if 0 == end:
+            rest = data
+            continue
+        rest = data[end:]
+        yield data[:end]
+    if rest:
+        yield rest
+
+
+def days_from_civil(y, m, d):
+    '''
+    days since 1970-01-01 for arrays of year, month and day
+    (the algorithm from http://howardhinnant.github.io/date_algorithms.html)
+    '''
+    y = y - (m <= 2)
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + np.where(m > 2, -3, 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def days_in_month(y, m):
+    '''
+    number of days in each month for arrays of year and month (1 to 12)
+    '''
+    leap = (y % 4 == 0) & ((y % 100 != 0) | (y % 400 == 0))
+    return np.array(DAYS_IN_MONTH)[m - 1] + ((m == 2) & leap)
+
+
+def timestamps_to_seconds(timestamps):
+    '''
+    return (seconds since 1970, good) for an array of yyyy.mm.dd_hh:mm:ss
+    byte strings.  good is False for the ones which are not timestamps.
+    '''
+    n = len(timestamps)
+    good = np.char.str_len(timestamps) == TIMESTAMP_LENGTH
+    c = np.frombuffer(timestamps.astype('S{}'.format(TIMESTAMP_LENGTH)).tobytes(),
+                      dtype=np.uint8).reshape(n, TIMESTAMP_LENGTH)
+    digits = c[:, TIMESTAMP_DIGITS].astype(np.int64) - ord('0')
+    good &= np.all((digits >= 0) & (digits <= 9), axis=1)
+    for i, s in TIMESTAMP_SEPARATORS.items():
+        good &= c[:, i] == ord(s)
+
+    def number(first, count):
+        v = np.zeros(n, dtype=np.int64)
+        for i in range(first, first + count):
+            v = v * 10 + digits[:, i]
+        return v
+    year = number(0, 4)
+    month = number(4, 2)
+    day = number(6, 2)
+    hour = number(8, 2)
+    minute = number(10, 2)
+    second = number(12, 2)
+    # the same dates and times LogParser.timestamp_to_seconds takes
+    good &= (year >= 1) & (month >= 1) & (month <= 12) & (day >= 1)
+    good &= day <= days_in_month(year, np.clip(month, 1, 12))
+    good &= (hour <= 23) & (minute <= 59) & (second <= 59)
+
+    days = days_from_civil(year, month, day)
+    return ((days * 24 + hour) * 60 + minute) * 60 + second, good
+
+
+class name_table():
+    '''
+    give each sensor name a small integer index
+    '''
+    def __init__(self):
+        self.names = []
+        self.index = dict()
+
+    def indexes(self, names):
+        '''
+        return an array with the index of each of an array of byte string names
+        '''
+        unique_names, inverse = np.unique(names, return_inverse=True)
+        lookup = np.empty(len(unique_names), dtype=np.int64)
+        for i, name in enumerate(unique_names):
+            name = bytes(name)
+            if name not in self.index:
+                if len(self.names) == MAX_SENSORS:
+                    raise ValueError('more than {} sensor names'.format(MAX_SENSORS))
+                self.index[name] = len(self.names)
+                self.names.append(name)
+            lookup[i] = self.index[name]
+        return lookup[inverse.reshape(-1)]
+
+
+def parse_lines(chunk, damage):
+    '''
+    return (seconds, names, values) arrays for the records in chunk found
+    by LogParser, which counts the damage in damage
+    '''
+    records = LogParser.log_records(b'', damage=damage).parse_chunk(chunk)
+    return (np.array([r[0] for r in records], dtype=np.int64),
+            np.array([r[1].encode('UTF-8') for r in records], dtype=bytes),
+            np.array([r[2] for r in records], dtype=np.float64))
+
+
+def parse_chunk(chunk, names, damage=None):
+    '''
+    return (seconds, sensor index, value) columns for the good lines of
+    chunk.  names is the name_table for the sensor indexes.  Bad lines are
+    counted in damage (a LogParser.damage_report).
+    '''
+    chunk = chunk.replace(b'\0', b'')  # remove null characters
+    fields = chunk.split()
+    columns = None
+    if 0 == len(fields) % 3:
+        fields = np.array(fields, dtype=bytes).reshape(-1, 3)
+        try:
+            columns = (fields[:, 0], fields[:, 1], fields[:, 2].astype(np.float64))
+        except ValueError:
+            pass
+    if columns is not None:
+        seconds, good = timestamps_to_seconds(columns[0])
+        if good.all():
+            timestamps, sensor_names, values = columns
+            return seconds, names.indexes(sensor_names), values
+        # a line with a bad timestamp or the wrong number of fields,
+        # which moves the fields of all the lines after it
+    seconds, sensor_names, values = parse_lines(chunk, damage)
+    if 0 == len(seconds):
+        return seconds, np.zeros(0, dtype=np.int64), values
+    return seconds, names.indexes(sensor_names), values
+
+
+class vector_table():
+    '''
+    Sum and count for each (time slice, sensor) of one resolution, kept as
+    a list of partial results (one for each chunk) which are added up by
+    finish().
+
+    seconds is the length of a time slice and label_width the number of
+    characters of the yyyy.mm.dd_hh:mm:ss start of a time slice used as
+    its label.
+    '''
+    def __init__(self, resolution, seconds, label_width):
+        self.resolution = resolution
+        self.seconds = seconds
+        self.label_width = label_width
+        self.partials = []
+
+    def add(self, seconds, sensors, values):
+        keys = (seconds // self.seconds) * MAX_SENSORS + sensors
+        self.partials.append(reduce_keys(keys, values, np.ones(len(keys))))
+
+    def reduce(self):
+        '''
+        add up the partial results, return (keys, sums, counts)
+        '''
+        if not self.partials:
+            keys = np.zeros(0, dtype=np.int64)
+            sums = counts = np.zeros(0)
+        else:
+            keys, sums, counts = reduce_keys(*[np.concatenate(c) for c in zip(*self.partials)])
+        self.partials = [(keys, sums, counts)]
+        return keys, sums, counts
+
+    def roll_up(self, finer):
+        '''
+        add the sums and counts of a table whose time slices fit a whole
+        number of times in the time slices of this one
+        '''
+        keys, sums, counts = finer.reduce()
+        ratio = self.seconds // finer.seconds
+        keys = (keys // MAX_SENSORS // ratio) * MAX_SENSORS + keys % MAX_SENSORS
+        self.partials.append(reduce_keys(keys, sums, counts))
+
+    def finish(self, width):
+        '''
+        return (time slice starts in seconds, sums, counts).  sums and counts
+        have a row for each time slice and width columns, one for each
+        sensor index.
+        '''
+        keys, sums, counts = self.reduce()
+        slices, rows = np.unique(keys // MAX_SENSORS, return_inverse=True)
+        columns = keys % MAX_SENSORS
+        sum_table = np.zeros((len(slices), width))
+        count_table = np.zeros((len(slices), width), dtype=np.int64)
+        sum_table[rows.reshape(-1), columns] = sums
+        count_table[rows.reshape(-1), columns] = counts.astype(np.int64)
+        return slices * self.seconds, sum_table, count_table
+
+    def write_csv(self, ofile, names):
+        '''
+        write the table in the same format as BinData.py.  names is the list
+        of byte string names for the sensor indexes.
+        '''
+        names = [n.decode('UTF-8') for n in names]
+        starts, sums, counts = self.finish(len(names))
+        order = sorted(range(len(names)), key=lambda i: names[i])
+        ofile.write('"when"' + ''.join(',"{}"'.format(names[i]) for i in order) + '\n')
+        if 0 == len(starts):
+            return
+
+        labels = format_labels(starts, self.label_width)
+        sums = sums[:, order]
+        counts = counts[:, order]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = sums / counts
+        # temperatures come in 1/16 degree steps so there are far fewer
+        # different averages than cells, only format each one once
+        present = counts > 0
+        unique_averages, inverse = np.unique(averages[present], return_inverse=True)
+        cells = np.full(averages.shape, ', ', dtype=object)
+        cells[present] = np.array([',{:.4f} '.format(a) for a in unique_averages.tolist()],
+                                  dtype=object)[inverse.reshape(-1)]
+        for label, row in zip(labels, cells.tolist()):
+            ofile.write('"' + label + '"' + ''.join(row) + '\n')
+
+    def write_binary(self, ofile, names, sums=False):
+        '''
+        write the averages (or the sums if sums) and counts as a
+        BinaryTable.py file.  names is the list of byte string names for
+        the sensor indexes.
+        '''
+        names = [n.decode('UTF-8') for n in names]
+        starts, sum_table, counts = self.finish(len(names))
+        order = sorted(range(len(names)), key=lambda i: names[i])
+        ofile.write(BinaryTable.format_header([names[i] for i in order], sums))
+
+        rows = np.zeros(len(starts), dtype=BinaryTable.row_dtype(len(names), sums))
+        rows['start'] = starts
+        sum_table = sum_table[:, order]
+        counts = counts[:, order]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # np.nan rather than the NaN of 0 / 0 so the bytes are the same
+            # as BinData.py writes
+            values = sum_table if sums else sum_table / counts
+            rows['values'] = np.where(counts > 0, values, np.nan)
+        rows['counts'] = counts
+        ofile.write(rows.tobytes())
+
+
+def reduce_keys(keys, sums, counts):
+    '''
+    add up the sums and counts which have the same key
+
+    return (unique keys, sums, counts)
+    '''
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    return (unique_keys,
+            np.bincount(inverse, weights=sums, minlength=len(unique_keys)),
+            np.bincount(inverse, weights=counts, minlength=len(unique_keys)))
+
+
+def format_labels(starts, width):
+    '''
+    return the yyyy.mm.dd_hh:mm:ss strings for starts cut to width characters
+    '''
+    text = np.datetime_as_string(starts.astype('datetime64[s]'), unit='s')
+    return [t[0:width].replace('-', '.').replace('T', '_') for t in text]
+
+
+def bin_files(files, resolutions, damage=None):
+    '''
+    bin the lines of each of the open binary files at each of resolutions,
+    a list of (resolution, seconds, label width).  Bad lines are counted in
+    damage.
+
+    return (list of vector_table, name_table, number of entries used)
+    '''
+    names = name_table()
+    tables = [vector_table(r, seconds, width) for r, seconds, width in resolutions]
+    base, steps = Rollup.rollup_plan(tables)
+    entries = add_files(files, names, base, damage)
+    Rollup.roll_up(steps)
+    return tables, names, entries
+
+
+def add_files(files, names, tables, damage=None):
+    '''
+    parse the open binary files and add their lines to tables.  names is
+    the name_table for the sensor indexes.
+
+    return the number of entries used
+    '''
+    entries = 0
+    for f in files:
+        for chunk in read_chunks(f):
+            seconds, sensors, values = parse_chunk(chunk, names, damage)
+            for t in tables:
+                t.add(seconds, sensors, values)
+            entries += len(seconds)
+    return entries
+
+
+def bin_columns(columns, names, tables):
+    '''
+    add the (names, seconds, sensors, values) columns of a LogCache to
+    tables.  names is the name_table for the sensor indexes.
+
+    return the number of entries used
+    '''
+    cache_names, seconds, sensors, values = columns
+    if 0 == len(seconds):
+        return 0
+    # the cache has its own sensor indexes
+    lookup = names.indexes(np.array([n.encode('UTF-8') for n in cache_names],
+                                    dtype=bytes))
+    seconds = np.frombuffer(seconds, dtype=np.int64)
+    sensors = np.frombuffer(sensors, dtype=np.uint16)
+    values = np.frombuffer(values, dtype=np.float64)
+    for start in range(0, len(seconds), CHUNK_RECORDS):
+        end = start + CHUNK_RECORDS
+        chunk_sensors = lookup[sensors[start:end]]
+        for t in tables:
+            t.add(seconds[start:end], chunk_sensors, values[start:end])
+    return len(seconds)
+
+
+def bin_logs(filenames, resolutions, damage=None, cache_root=None):
+    '''
+    bin the logs in filenames (see LogParser.open_logs), from their caches
+    (under cache_root) where they can be cached, as bin_files does
+    '''
+    names = name_table()
+    tables = [vector_table(r, seconds, width) for r, seconds, width in resolutions]
+    base, steps = Rollup.rollup_plan(tables)
+    entries = 0
+    for filename in filenames:
+        columns = LogCache.cached_columns(filename, damage, cache_root)
+        if columns is None:
+            entries += add_files(LogParser.open_logs([filename]), names, base,
+                                 damage)
+        else:
+            entries += bin_columns(columns[:4], names, base)
+            # a partial last line, which is not cached until it is finished
+            entries += add_files([io.BytesIO(columns[4])], names, base, damage)
+    Rollup.roll_up(steps)
+    return tables, names, entries
+
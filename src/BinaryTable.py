@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Read and write binned tables in a binary form which numpy can use straight
+from the file (temp_1m.bin, ...), rather than parsing a CSV.
+
+The file is a header, the sensor names and then one fixed size row for each
+time slice, all little endian:
+
+    magic        8 bytes   b'MOUNDTBL'
+    version      uint32
+    columns      uint32    number of sensors
+    names size   uint32    bytes of names
+    names                  UTF-8 JSON list of the sensor names, padded
+                           with spaces to a multiple of 8 bytes
+    rows, each:
+        start    int64     seconds since 1970 of the start of the slice
+        values   float32 * columns, the averages, NaN where empty
+        counts   uint32 * columns, the number of samples (total seconds
+                           with BinData.py -t)
+
+The number of rows comes from the size of the file.  Rows of fixed size
+let BinData.py replace the last row and add more, as it does with the CSV.
+
+A sums table (temp_1m.sums, ...) has the magic b'MOUNDSUM' and the exact
+float64 sums in place of the averages, so it can be added up in to
+coarser tables later (see Rollup.py).  load_table() gives the sums as the
+values of a sums table.
+
+load_table() maps the file with numpy and returns views of it, so nothing
+is copied or parsed however big the table is:
+
+    names, starts, values, counts = BinaryTable.load_table('temp_1m.bin')
+    inlet = values[:, names.index('pipe_inlet')]
+
+numpy is only needed to load a table, not to write one.
+"""
+
+import json
+import struct
+import sys
+
+MAGIC = b'MOUNDTBL'
+SUMS_MAGIC = b'MOUNDSUM'
+VERSION = 1
+HEADER = struct.Struct('<8sIII')
+ALIGNMENT = 8
+
+
+def format_header(names, sums=False):
+    '''
+    return the bytes of the header and names for a table of names
+    '''
+    text = json.dumps(list(names)).encode('UTF-8')
+    text += b' ' * (-(HEADER.size + len(text)) % ALIGNMENT)
+    return HEADER.pack(SUMS_MAGIC if sums else MAGIC, VERSION, len(names),
+                       len(text)) + text
+
+
+def row_format(columns, sums=False):
+    return struct.Struct('<q{0}{1}{0}I'.format(columns, 'd' if sums else 'f'))
+
+
+def format_row(row, start, averages, counts):
+    '''
+    return the bytes of a row.  row is the row_format() of the table,
+    averages (or sums) are None where there are no values.
+    '''
+    return row.pack(start, *[float('nan') if a is None else a for a in averages],
+                    *counts)
+
+
+def read_header(f):
+    '''
+    return (names, offset of the first row, True for a sums table) from
+    the start of open file f
+
+    raise ValueError if it is not a table
+    '''
+    header = f.read(HEADER.size)
+    if len(header) != HEADER.size:
+        raise ValueError('{} is too short'.format(f.name))
+    magic, version, columns, names_size = HEADER.unpack(header)
+    if magic not in (MAGIC, SUMS_MAGIC) or VERSION != version:
+        raise ValueError('{} is not a version {} table'.format(f.name, VERSION))
+    names = json.loads(f.read(names_size).decode('UTF-8'))
+    if len(names) != columns:
+        raise ValueError('{} has {} names for {} columns'.format(f.name, len(names),
+                                                              columns))
+    return names, HEADER.size + names_size, SUMS_MAGIC == magic
+
+
+def read_rows(filename):
+    '''
+    return (names, True for a sums table, rows) for a table.  rows yields
+    (start, values, counts) for each row, values are None where there are
+    none.  This does not need numpy.
+    '''
+    f = open(filename, 'rb')
+    names, offset, sums = read_header(f)
+    row = row_format(len(names), sums)
+
+    def rows():
+        with f:
+            f.seek(offset)
+            while True:
+                data = f.read(row.size)
+                if len(data) < row.size:
+                    break
+                start, *fields = row.unpack(data)
+                values = fields[0:len(names)]
+                counts = fields[len(names):]
+                yield (start, [None if c == 0 else v for v, c in zip(values, counts)],
+                       counts)
+    return names, sums, rows()
+
+
+def row_dtype(columns, sums=False):
+    import numpy as np
+    return np.dtype([('start', '<i8'),
+                     ('values', '<f8' if sums else '<f4', (columns,)),
+                     ('counts', '<u4', (columns,))])
+
+
+def load_table(filename):
+    '''
+    return (names, starts, values, counts) for a table file.  starts has
+    one entry per time slice, values and counts a row per time slice and a
+    column for each of names.  They are read only views of a memory map
+    of the file.
+    '''
+    import numpy as np
+
+    with open(filename, 'rb') as f:
+        names, offset, sums = read_header(f)
+    dtype = row_dtype(len(names), sums)
+    data = np.memmap(filename, dtype=np.uint8, mode='r')
+    rows = (len(data) - offset) // dtype.itemsize
+    table = data[offset:offset + rows * dtype.itemsize].view(dtype)
+    return names, table['start'], table['values'], table['counts']
+
+
+if __name__ == "__main__":
+    import time
+
+    for filename in sys.argv[1:]:
+        start = time.perf_counter()
+        names, starts, values, counts = load_table(filename)
+        print('{}: {} rows of {} sensors loaded in {:.6f} seconds'.format(filename,
+                                                                         len(starts),
+                                                                         len(names),
+                                                                         time.perf_counter() - start))
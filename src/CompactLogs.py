@@ -0,0 +1,676 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+
+@author: pgcrumley@gmail.com
+
+
+Keep the log of MoundController.py from growing forever.
+
+MoundController.py appends every sample to /home/pgc/mound_controller.log
+and collect_data.sh copies all of it each time.  This moves the lines of
+each finished month out of the log in to a segment of its own and, as the
+months get older, replaces the samples with aggregates following a policy
+such as the default
+    raw:30d,1m:365d,1h
+which keeps every sample of a month until the month is 30 days old, then
+the count, sum, smallest and largest value of each sensor for each minute
+until it is a year old, then the same for each hour.  A last tier with an
+age (e.g. 1h:1825d) drops the months older than that.
+
+The segments are gzip files in a directory of their own, one for each
+month and tier:
+    mound_controller.2019.01.raw.gz     the lines of the log
+    mound_controller.2019.01.1m.gz      1 minute aggregates
+    mound_controller.2019.01.events.gz  the EVENT lines, kept once the
+                                        raw segment is gone
+An aggregate is a line
+    timestamp seconds name count sum min max
+where the timestamp is the start of the time slice and the name comes from
+SensorIdToName.  The sums are exact (the values are multiples of 1/16
+degree) so the tables BinData.py -a makes from 1m aggregates are the same
+as those made from the samples, for 1m and anything made of whole minutes.
+A month of 1 minute cells is held in memory while it is made (about 40 MB
+for 30 sensors).
+
+A segment is sealed:  it is written once, made read only and its SHA-256
+is added to SHA256SUMS in the directory, which can be checked with
+    sha256sum -c SHA256SUMS
+or with --check.  A segment is checked before it is compacted, and one
+which is not in SHA256SUMS was left by a run which did not finish and is
+removed.  As segments never change rsync only copies the new ones.
+
+A line of the log belongs to the month of the latest timestamp seen up to
+it, so lines a little out of order stay where they are and the raw
+segments of a log, in order, are the lines it had.  Lines which show up
+after their month was moved out go with the next month.  The raw segments
+are written from the start of the log (which only grows), then, holding a
+lock (flock) on the log, the rest of it is copied to a new log which
+replaces it.  MoundController.py takes the same lock to write (see
+LogWriter.py) and opens the new log when the old one was replaced, so no
+line is lost.
+
+--list gives the segments to read for the months gone from the log, the
+finest there is of each month:
+    IngestLogs.py ... ../mound/* $(CompactLogs.py -s ../segments --list raw)
+    BinData.py ... -a $(CompactLogs.py -s ../segments --list aggregates)
+
+usage:
+    CompactLogs.py [-l log] [-s segment_directory] [-p policy] [-n now]
+                   [--check | --list raw|aggregates]
+
+On the controller run it once a day, e.g. with the crontab line
+    15 0 * * * /home/pgc/Sandbox/Sensors/MoundController/CompactLogs.py -l /home/pgc/mound_controller.log
+"""
+
+import argparse
+import datetime
+import fcntl
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import sys
+
+import IngestLogs
+import LogParser
+import SensorAccumulator
+
+DEBUG = 0
+
+DEFAULT_SEGMENT_DIRECTORY = '/home/pgc/mound_segments'
+DEFAULT_POLICY = 'raw:30d,1m:365d,1h'
+MANIFEST_FILENAME = 'SHA256SUMS'
+
+RAW = 'raw'
+EVENTS = 'events'
+
+# base.yyyy.mm.tier.gz
+SEGMENT_RE = re.compile(r'(?P<base>.+)\.(?P<month>\d{4}\.\d\d)\.(?P<tier>raw|events|[1-9][0-9]*[smhd])\.gz\Z')
+
+# the month of each line which starts with a timestamp
+LINE_MONTH_RE = re.compile(rb'^(\d{4}\.\d\d)\.\d\d_\d\d:\d\d:\d\d', re.MULTILINE)
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# sealed segments are read only
+SEALED_MODE = 0o444
+
+# copy and check this much at a time
+READ_BYTES = 1024 * 1024
+
+
+class SegmentError(Exception):
+    '''
+    A segment is damaged or can not be made.
+    '''
+
+
+def parse_policy(text):
+    '''
+    return a list of (tier, seconds, age) for a policy such as
+    raw:30d,1m:365d,1h.  tier is 'raw' or a resolution, seconds is its
+    length (0 for raw).  A month is kept at the first tier it is younger
+    than the age (in seconds) of, None is no limit.
+
+    raise ValueError if it does not make sense
+    '''
+    import BinData  # only for resolution_seconds
+
+    policy = []
+    for entry in text.split(','):
+        tier, _, age = entry.partition(':')
+        if RAW == tier:
+            if policy:
+                raise ValueError('only the first tier can be raw')
+            seconds = 0
+        else:
+            seconds = BinData.resolution_seconds(tier)
+            # a time slice must not cross the end of a month
+            if SECONDS_PER_DAY % seconds:
+                raise ValueError('{} does not fit a whole number of times in a day'.format(tier))
+            if policy and seconds <= policy[-1][1]:
+                raise ValueError('{} is not longer than {}'.format(tier, policy[-1][0]))
+            if policy and policy[-1][1] and seconds % policy[-1][1]:
+                raise ValueError('{} is not a whole number of {}'.format(tier, policy[-1][0]))
+        age = BinData.resolution_seconds(age) if age else None
+        if policy:
+            if policy[-1][2] is None:
+                raise ValueError('only the last tier can be kept for ever')
+            if age is not None and age <= policy[-1][2]:
+                raise ValueError('the age of {} is not more than the age of {}'.format(tier,
+                                                                                    policy[-1][0]))
+        policy.append((tier, seconds, age))
+    return policy
+
+
+def next_month(month):
+    '''
+    return the yyyy.mm after month
+    '''
+    year, number = int(month[0:4]), int(month[5:7])
+    if 12 == number:
+        return '{:04d}.01'.format(year + 1)
+    return '{:04d}.{:02d}'.format(year, number + 1)
+
+
+def month_end(month):
+    '''
+    return the seconds since 1970 at the end of a yyyy.mm month
+    '''
+    return LogParser.timestamp_to_seconds(next_month(month) + '.01_00:00')
+
+
+def target_tier(policy, month, now):
+    '''
+    return the index in policy of the tier for month at the time now (in
+    seconds since 1970), None if the month is older than every tier
+    '''
+    age = now - month_end(month)
+    for i, (tier, seconds, limit) in enumerate(policy):
+        if limit is None or age < limit:
+            return i
+    return None
+
+
+def current_seconds():
+    '''
+    return the time now in seconds since 1970, treating the local time as
+    if it were UTC as the logs do (see LogParser.py)
+    '''
+    return LogParser.timestamp_to_seconds(datetime.datetime.now().strftime(LogParser.TIMESTAMP_FORMAT))
+
+
+def file_sha256(filename):
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(READ_BYTES)
+            if not data:
+                break
+            h.update(data)
+    return h.hexdigest()
+
+
+def load_manifest(directory):
+    '''
+    return {segment filename (without the directory) : SHA-256} from
+    SHA256SUMS in directory
+    '''
+    manifest = dict()
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME)) as f:
+            for line in f:
+                digest, name = line.rstrip('\n').split('  ', 1)
+                manifest[name] = digest
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def save_manifest(directory, manifest):
+    '''
+    write SHA256SUMS in directory, in the form sha256sum -c reads
+    '''
+    filename = os.path.join(directory, MANIFEST_FILENAME)
+    # write a new file and rename it so a crash can not leave half of it
+    temp_filename = filename + '.new'
+    with open(temp_filename, 'w') as f:
+        for name in sorted(manifest):
+            f.write('{}  {}\n'.format(manifest[name], name))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_filename, filename)
+
+
+def segment_filename(directory, base, month, tier):
+    return os.path.join(directory, '{}.{}.{}.gz'.format(base, month, tier))
+
+
+def find_segments(directory):
+    '''
+    return {(base, month) : {tier : filename}} for the segments in
+    directory
+    '''
+    segments = dict()
+    for name in os.listdir(directory):
+        m = SEGMENT_RE.match(name)
+        if m:
+            tiers = segments.setdefault((m.group('base'), m.group('month')), dict())
+            tiers[m.group('tier')] = os.path.join(directory, name)
+    return segments
+
+
+def data_tiers(tiers):
+    '''
+    return a list of (seconds, tier) for the tiers of a month which hold
+    samples, finest (raw, 0 seconds) first
+    '''
+    import BinData  # only for resolution_seconds
+
+    return sorted((0 if RAW == t else BinData.resolution_seconds(t), t)
+                  for t in tiers if EVENTS != t)
+
+
+class digest_file():
+    '''
+    A file to write to which only keeps the SHA-256 of what was written.
+    '''
+    def __init__(self):
+        self.hash = hashlib.sha256()
+
+    def write(self, data):
+        self.hash.update(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+def compress(chunks, f):
+    '''
+    write the bytes of chunks (an iterable) to the open file f with gzip
+    '''
+    # no name or time in the header so the same lines always make the
+    # same bytes
+    with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as z:
+        for chunk in chunks:
+            z.write(chunk)
+
+
+def segment_digest(chunks):
+    '''
+    return the SHA-256 of the segment chunks would make
+    '''
+    f = digest_file()
+    compress(chunks, f)
+    return f.hash.hexdigest()
+
+
+def write_segment(filename, chunks, manifest):
+    '''
+    write the bytes of chunks (an iterable) to a new segment and seal it:
+    it is made read only and its SHA-256 is added to manifest, which is
+    saved
+    '''
+    temp_filename = filename + '.new'
+    with open(temp_filename, 'wb') as f:
+        compress(chunks, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.chmod(temp_filename, SEALED_MODE)
+    os.replace(temp_filename, filename)
+    manifest[os.path.basename(filename)] = file_sha256(filename)
+    save_manifest(os.path.dirname(filename), manifest)
+
+
+def remove_segment(filename, manifest):
+    '''
+    take a segment out of manifest (which is saved) and then remove it
+    '''
+    manifest.pop(os.path.basename(filename), None)
+    save_manifest(os.path.dirname(filename), manifest)
+    os.remove(filename)
+
+
+def check_segment(filename, manifest):
+    '''
+    raise SegmentError if the SHA-256 of a segment is not the one in
+    manifest
+    '''
+    expected = manifest.get(os.path.basename(filename))
+    if expected is None:
+        raise SegmentError('{} is not sealed'.format(filename))
+    if file_sha256(filename) != expected:
+        raise SegmentError('{} does not match its SHA-256'.format(filename))
+
+
+def check_segments(directory):
+    '''
+    return a list of the problems with the segments in directory:  those
+    in SHA256SUMS which are missing or do not match and those not in it
+    '''
+    manifest = load_manifest(directory)
+    problems = []
+    for name in sorted(manifest):
+        filename = os.path.join(directory, name)
+        if not os.path.exists(filename):
+            problems.append('{} is missing'.format(filename))
+            continue
+        try:
+            check_segment(filename, manifest)
+        except SegmentError as e:
+            problems.append(str(e))
+    for tiers in find_segments(directory).values():
+        for filename in sorted(tiers.values()):
+            if os.path.basename(filename) not in manifest:
+                problems.append('{} is not sealed'.format(filename))
+    return problems
+
+
+def remove_unsealed(directory, manifest):
+    '''
+    remove the segments (and partly written .new files) left in directory
+    by a run which did not finish
+    '''
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.new'):
+            unsealed = SEGMENT_RE.match(name[:-len('.new')]) is not None
+        else:
+            unsealed = SEGMENT_RE.match(name) is not None and name not in manifest
+        if unsealed:
+            print('removing unsealed {}'.format(name), file=sys.stderr)
+            os.remove(os.path.join(directory, name))
+
+
+def log_base(log_filename):
+    '''
+    return the start of the names of the segments of a log, e.g.
+    mound_controller for /home/pgc/mound_controller.log
+    '''
+    base = os.path.basename(log_filename)
+    if base.endswith('.log'):
+        base = base[:-len('.log')]
+    return base
+
+
+def month_pieces(data, current):
+    '''
+    return a list of (month, start, end) for the lines of each finished
+    month (before current, a yyyy.mm) at the start of data, a log.  A
+    piece ends where a line of a later month starts, anything before the
+    first timestamp goes with the first piece.  Months after current (a
+    clock which jumped ahead) do not end a piece.
+    '''
+    current = current.encode()
+    pieces = []
+    month = None
+    start = 0
+    for m in LINE_MONTH_RE.finditer(data):
+        line_month = m.group(1)
+        if (month is not None and line_month <= month) or line_month > current:
+            continue
+        if month is not None:
+            pieces.append((month.decode(), start, m.start()))
+            start = m.start()
+        month = line_month
+        if month == current:
+            break
+    return pieces
+
+
+def chunks_of(data, start, end):
+    '''
+    yield the bytes of data from start to end, READ_BYTES at a time
+    '''
+    for offset in range(start, end, READ_BYTES):
+        yield data[offset:min(offset + READ_BYTES, end)]
+
+
+def cut_log(log_filename, cut):
+    '''
+    replace log_filename with a copy of itself from offset cut on, holding
+    the lock MoundController.py takes to write to it
+    '''
+    directory, name = os.path.split(log_filename)
+    # a hidden name so nothing copying mound* picks it up
+    temp_filename = os.path.join(directory, '.' + name + '.new')
+    with open(log_filename, 'rb') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(cut)
+        with open(temp_filename, 'wb') as new:
+            shutil.copyfileobj(f, new, READ_BYTES)
+            new.flush()
+            os.fsync(new.fileno())
+        shutil.copymode(log_filename, temp_filename)
+        os.replace(temp_filename, log_filename)
+        # the lock goes with f, then MoundController.py opens the new log
+
+
+def rotate_log(log_filename, directory, manifest, current):
+    '''
+    move the lines of the months before current (a yyyy.mm) at the start
+    of log_filename to sealed raw segments in directory
+
+    return the list of months moved
+    '''
+    base = log_base(log_filename)
+    sealed = set()
+    for name in manifest:
+        m = SEGMENT_RE.match(name)
+        if m and base == m.group('base'):
+            sealed.add(m.group('month'))
+    moved = []
+    cut = 0
+    with open(log_filename, 'rb') as f:
+        data = LogParser.map_log(f)
+        for month, start, end in month_pieces(data, current):
+            filename = segment_filename(directory, base, month, RAW)
+            if month in sealed:
+                if (manifest.get(os.path.basename(filename))
+                        == segment_digest(chunks_of(data, cut, end))):
+                    # moved by a run which stopped before the log was cut
+                    cut = end
+                # otherwise these lines showed up after the month was
+                # moved out and go with the next month
+                continue
+            write_segment(filename, chunks_of(data, cut, end), manifest)
+            moved.append(month)
+            cut = end
+    if cut:
+        cut_log(log_filename, cut)
+    return moved
+
+
+def format_aggregate(start, seconds, name, total, count, smallest, largest):
+    return '{} {} {} {} {!r} {!r} {!r}\n'.format(LogParser.format_timestamp(start),
+                                                 seconds, name, count, total,
+                                                 smallest, largest)
+
+
+def aggregate_lines(values, seconds):
+    '''
+    yield the lines (as bytes) of an aggregate segment of values (a
+    SensorAccumulator.sensor_extremes keyed by time slice), a time slice
+    at a time in time order
+    '''
+    names = sorted(values.names)
+    for key in sorted(values.keys):
+        lines = []
+        for name, cell in zip(names, values.row_cells(key, names)):
+            if cell is not None:
+                lines.append(format_aggregate(key * seconds, seconds, name, *cell))
+        yield ''.join(lines).encode('UTF-8')
+
+
+def read_aggregates(filenames):
+    '''
+    yield (start, seconds, name, count, sum, min, max) for each line of
+    the aggregate segments filenames
+
+    raise SegmentError for a line which is not an aggregate
+    '''
+    timestamp = None
+    start = 0
+    for filename in filenames:
+        with gzip.open(filename, 'rt', encoding='UTF-8') as f:
+            for number, line in enumerate(f, 1):
+                sl = line.split()
+                try:
+                    if 7 != len(sl) or not LogParser.TIMESTAMP_RE.match(sl[0]):
+                        raise ValueError('not "timestamp seconds name count sum min max"')
+                    # every sensor of a time slice has the same timestamp
+                    if sl[0] != timestamp:
+                        start = LogParser.timestamp_to_seconds(sl[0])
+                        timestamp = sl[0]
+                    aggregate = (start, int(sl[1]), sl[2], int(sl[3]), float(sl[4]),
+                                 float(sl[5]), float(sl[6]))
+                except ValueError as e:
+                    raise SegmentError('{} line {}: {}'.format(filename, number, e))
+                yield aggregate
+
+
+def event_lines(filename):
+    '''
+    yield the EVENT lines (as bytes, with a line ending) of a log, see
+    IngestLogs.read_lines
+    '''
+    for line in IngestLogs.read_lines(filename):
+        sl = line.split(None, 2)
+        if len(sl) > 1 and b'EVENT' == sl[1]:
+            yield line + b'\n'
+
+
+def compact(directory, policy, now, manifest, damage=None):
+    '''
+    compact (or drop) the months in directory which are older than their
+    tier of policy allows at the time now.  The samples of raw segments
+    which can not be used are counted in damage (a LogParser.damage_report).
+
+    return a list of (base, month, tier) for the segments made, tier is
+    None for a month dropped
+    '''
+    done = []
+    for (base, month), tiers in sorted(find_segments(directory).items()):
+        target = target_tier(policy, month, now)
+        if target is None:
+            for filename in tiers.values():
+                remove_segment(filename, manifest)
+            done.append((base, month, None))
+            continue
+        tier, seconds, age = policy[target]
+        data = data_tiers(tiers)
+        if not data or seconds <= data[0][0]:
+            continue  # nothing finer than the tier it should be
+        finest_seconds, finest = data[0]
+        if finest_seconds and seconds % finest_seconds:
+            raise SegmentError('{} can not be made from {}'.format(tier, tiers[finest]))
+
+        source = tiers[finest]
+        check_segment(source, manifest)
+        values = SensorAccumulator.sensor_extremes()
+        if RAW == finest:
+            if EVENTS not in tiers:
+                write_segment(segment_filename(directory, base, month, EVENTS),
+                              event_lines(source), manifest)
+            for when, name, value in LogParser.read_logs([source], damage):
+                values.add(when // seconds, name, value)
+        else:
+            for start, s, name, count, total, smallest, largest in read_aggregates([source]):
+                values.add_cell(start // seconds, name, total, count, smallest, largest)
+        write_segment(segment_filename(directory, base, month, tier),
+                      aggregate_lines(values, seconds), manifest)
+        for s, t in data:
+            if s < seconds:
+                remove_segment(tiers[t], manifest)
+        done.append((base, month, tier))
+    return done
+
+
+def usable_segments(directory, kind):
+    '''
+    return the filenames of the segments in directory to read for the
+    months gone from the log, in time order.  kind 'raw' gives logs for
+    IngestLogs.py:  the raw segment of each month or, once it is gone, the
+    events.  kind 'aggregates' gives the finest aggregates of each month
+    which has no raw segment, for BinData.py -a.
+    '''
+    filenames = []
+    for (base, month), tiers in sorted(find_segments(directory).items(),
+                                       key=lambda item: (item[0][1], item[0][0])):
+        if RAW in tiers:
+            if 'raw' == kind:
+                filenames.append(tiers[RAW])
+        elif 'raw' == kind:
+            if EVENTS in tiers:
+                filenames.append(tiers[EVENTS])
+        else:
+            data = data_tiers(tiers)
+            if data:
+                filenames.append(tiers[data[0][1]])
+    return filenames
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='move finished months out of the controller log and compact them as they age')
+    parser.add_argument('-l', '--log',
+                        help='log to move finished months out of, e.g. /home/pgc/mound_controller.log')
+    parser.add_argument('-s', '--segment-directory', default=DEFAULT_SEGMENT_DIRECTORY,
+                        help='where the segments are kept (default {})'.format(DEFAULT_SEGMENT_DIRECTORY))
+    parser.add_argument('-p', '--policy', default=DEFAULT_POLICY,
+                        help='tiers and the age to keep each for (default {})'.format(DEFAULT_POLICY))
+    parser.add_argument('-n', '--now',
+                        help='act as if it were this yyyy.mm.dd_hh:mm:ss')
+    parser.add_argument('--check', action='store_true',
+                        help='check the segments against SHA256SUMS')
+    parser.add_argument('--list', choices=('raw', 'aggregates'),
+                        help='print the raw (or aggregate) segments to read for the months gone from the log')
+    args = parser.parse_args()
+
+    if args.check and args.list:
+        parser.error('only one of --check and --list can be used')
+    if args.log and (args.check or args.list):
+        parser.error('--log can not be used with --check or --list')
+
+    if args.list:
+        for filename in usable_segments(args.segment_directory, args.list):
+            print(filename)
+        sys.exit(0)
+    if args.check:
+        problems = check_segments(args.segment_directory)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        sys.exit(1 if problems else 0)
+
+    try:
+        policy = parse_policy(args.policy)
+        if args.now is None:
+            now = current_seconds()
+        elif LogParser.TIMESTAMP_RE.match(args.now):
+            now = LogParser.timestamp_to_seconds(args.now)
+        else:
+            raise ValueError('--now is not yyyy.mm.dd_hh:mm:ss')
+    except ValueError as e:
+        parser.error(str(e))
+
+    os.makedirs(args.segment_directory, exist_ok=True)
+    manifest = load_manifest(args.segment_directory)
+    remove_unsealed(args.segment_directory, manifest)
+    damage = LogParser.damage_report()
+    try:
+        if args.log:
+            moved = rotate_log(args.log, args.segment_directory, manifest,
+                               LogParser.format_timestamp(now, len('yyyy.mm')))
+            if DEBUG:
+                print('moved {} out of {}'.format(moved, args.log), file=sys.stderr)
+        done = compact(args.segment_directory, policy, now, manifest, damage)
+        if DEBUG:
+            print('made {}'.format(done), file=sys.stderr)
+    except SegmentError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    if damage:
+        print(damage.summary(), file=sys.stderr)
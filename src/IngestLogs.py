@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Turn the logs collected from the mound in to temp.log and event.log.
+
+This does the work of
+    cat ../mound/* | tr -d '\\000' | sort | sed -f SensorIdToName.sed > full.log
+    grep EVENT full.log > event.log
+    grep -v EVENT full.log > temp.log
+in one process without writing full.log and reading it twice more.
+
+Each log has one writer which appends to it so its lines are (almost) in
+time order already.  Rather than sorting everything the logs are read a
+chunk at a time, their NUL characters removed, and merged with heapq so
+only a few lines of each log are held in memory.  Lines are compared as
+bytes, like "LC_ALL=C sort".
+
+Lines are sometimes a little out of order in a log (lines with the same
+timestamp, or a short step back of the clock), so each log passes through
+a window of the next --window lines (4096 by default) and the smallest is
+taken from there.  A line which is further out of order than that can not
+be put in its place; it is written where it was found and counted.
+
+A torn write can glue two records together in one line, e.g.
+    2019.01.23_09:29:04 DS18B20 28.ff.ce.83.92.16.05.87 -1.872019.01.23_09:17:11 EVENT starting_controller
+(which grep put in event.log).  Lines with a timestamp after the start are
+split in to a line for each record (LogParser.split_records) before they
+are put in order, and counted.
+
+The merged lines are written out in one pass:  lines with EVENT as the
+second field go to event.log and the rest to temp.log.  In a sample line
+    timestamp type id value
+the type and id are replaced by the name SensorIdToName.sed gives the
+sensor, read from the .sed file (LogParser.sed_name), so the names are the
+ones of the published data.  A sensor the .sed does not know keeps its
+type and id, as the sed script left it.  There are only a few dozen
+sensors so the names are remembered rather than looked up for each line.
+Other lines are written with their fields separated by single spaces, as
+the sed script did.
+
+Logs can be .gz files or .zip archives, see LogParser.open_logs.
+
+usage:
+    IngestLogs.py [-t temp.log] [-e event.log] [-w window] log ...
+"""
+
+import argparse
+import heapq
+import sys
+
+import LogParser
+
+DEBUG = 0
+
+DEFAULT_TEMPERATURE_FILENAME = 'temp.log'
+DEFAULT_EVENT_FILENAME = 'event.log'
+
+# read this much of each log at a time
+READ_BYTES = 256 * 1024
+
+# write this many lines at a time
+WRITE_LINES = 4096
+
+# number of lines of each log which are held to put them in order
+DEFAULT_WINDOW = 4096
+
+
+class read_lines():
+    '''
+    Yield the lines (as bytes, without line endings) of filename with NUL
+    characters removed and glued records split apart.
+
+    glued counts the lines which were split.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.glued = 0
+
+    def __iter__(self):
+        # a .zip file can hold more than one log
+        for f in LogParser.open_logs([self.filename]):
+            rest = b''
+            while True:
+                data = f.read(READ_BYTES)
+                if not data:
+                    break
+                lines = (rest + data.replace(b'\0', b'')).split(b'\n')  # remove null characters
+                rest = lines.pop()
+                yield from self.split_glued(lines)
+            if rest:
+                yield from self.split_glued([rest])
+
+    def split_glued(self, lines):
+        for line in lines:
+            # a timestamp has two colons, only look closer at lines with more
+            if line.count(b':') > 2:
+                pieces = LogParser.split_records(line)
+                if len(pieces) > 1:
+                    self.glued += 1
+                    yield from pieces
+                    continue
+            yield line
+
+
+class window_sort():
+    '''
+    Yield the lines from an iterator of lines which are almost in order
+    in order, as long as no line is more than window lines from its place.
+
+    late counts the lines which were too far out of order, which are
+    yielded as soon as they are seen.
+    '''
+    def __init__(self, lines, window=DEFAULT_WINDOW):
+        self.lines = lines
+        self.window = window
+        self.late = 0
+
+    def __iter__(self):
+        held = []
+        last = None
+        for line in self.lines:
+            if last is not None and line < last:
+                self.late += 1
+                yield line
+                continue
+            if len(held) < self.window:
+                heapq.heappush(held, line)
+                continue
+            last = heapq.heappushpop(held, line)
+            yield last
+        while held:
+            yield heapq.heappop(held)
+
+
+def convert_line(line):
+    '''
+    return (is_event, text) for a line of bytes.  text has the sensor name
+    in place of the type and id and ends with a newline.
+    '''
+    # surrogateescape lets bytes which are not UTF-8 go back out unchanged
+    fields = line.decode('UTF-8', errors='surrogateescape').split(' ')
+    fields = [f for f in fields if f]
+    if len(fields) > 1 and 'EVENT' == fields[1]:
+        return True, ' '.join(fields) + '\n'
+    if 4 == len(fields):
+        name = LogParser.sed_name(fields[1], fields[2])
+        if name is not None:
+            fields[1:3] = [name]
+    return False, ' '.join(fields) + '\n'
+
+
+def ingest(filenames, temperature_file, event_file, window=DEFAULT_WINDOW):
+    '''
+    merge the lines of filenames and write them to temperature_file and
+    event_file, which are opened for writing bytes.
+
+    return (number of temperature lines, number of event lines, number of
+    lines which could not be put in order, number of glued lines split)
+    '''
+    readers = [read_lines(f) for f in filenames]
+    logs = [window_sort(r, window) for r in readers]
+    lines = heapq.merge(*logs)
+    counts = [0, 0]
+    output = ([], [])
+    files = (temperature_file, event_file)
+    for line in lines:
+        if not line:
+            continue
+        is_event, text = convert_line(line)
+        output[is_event].append(text)
+        counts[is_event] += 1
+        if len(output[is_event]) == WRITE_LINES:
+            files[is_event].write(''.join(output[is_event]).encode('UTF-8', errors='surrogateescape'))
+            output[is_event].clear()
+    for text, f in zip(output, files):
+        f.write(''.join(text).encode('UTF-8', errors='surrogateescape'))
+    return (counts[0], counts[1], sum(log.late for log in logs),
+            sum(r.glued for r in readers))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='sort the mound logs and split them in to temp.log and event.log')
+    parser.add_argument('-t', '--temperatures', default=DEFAULT_TEMPERATURE_FILENAME,
+                        help='where to write the sensor samples')
+    parser.add_argument('-e', '--events', default=DEFAULT_EVENT_FILENAME,
+                        help='where to write the events')
+    parser.add_argument('-w', '--window', type=int, default=DEFAULT_WINDOW,
+                        help='number of lines of each log held to put them in order')
+    parser.add_argument('logs', nargs='+',
+                        help='logs written by MoundController.py')
+    args = parser.parse_args()
+
+    with open(args.temperatures, 'wb') as temperature_file, \
+         open(args.events, 'wb') as event_file:
+        temperatures, events, late, glued = ingest(args.logs, temperature_file,
+                                                   event_file, args.window)
+
+    if glued:
+        print('{} lines held glued records and were split'.format(glued),
+              file=sys.stderr)
+    if late:
+        print('{} lines were more than {} lines out of order and were written where they were found'.format(late, args.window),
+              file=sys.stderr)
+    if DEBUG:
+        print('{} samples and {} events'.format(temperatures, events),
+              file=sys.stderr)
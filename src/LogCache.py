@@ -0,0 +1,418 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Parse a log once and keep the records so later runs do not parse it again.
+
+The records of temp.log (see LogParser.py) are kept in a directory of
+their own, temp.log.<hash of the path of the log>.cache/ under
+~/.cache/MoundController/ (or $XDG_CACHE_HOME/MoundController/, or the
+cache_root given), so nothing is added to the directories of the logs,
+which collect_data.sh commits.  The cache is three columns, one file each,
+in the byte order of the machine:
+    seconds     int64    timestamp as seconds since 1970
+    sensors     uint16   index in to the list of names
+    values      float64  the value
+along with meta.json, which holds the names, the number of rows, how much
+of the log was parsed (with a hash of all the bytes before that point, see
+LogParser.log_hash) and the size and modification time of the log
+when it was parsed, and fragments, the pieces of lines which could not be
+used (so they are counted and quarantined the same way on every run).
+
+The log is parsed with numpy in large chunks (BinDataNumpy.parse_chunk)
+when numpy is there, which is much faster, otherwise a line at a time by
+LogParser.  Both give the same records.
+
+When the log has the size and modification time in meta.json the columns
+are used as they are, which costs only a memory map.  If it is different
+but the bytes which were parsed have not changed (the log only grew, which
+costs reading but not parsing them to check) just the new lines are parsed and added to the end of the columns.  Otherwise
+the cache is made again.  meta.json is written last, and only its number
+of rows is used, so a run which stops part way leaves a cache which is
+still good.
+
+Only complete lines are cached.  A partial last line (one still being
+written) is handed back as it is (log_cache.rest) for each run to parse,
+and is cached when it is finished.  stdin and .gz / .zip files can not be
+cached, read_records() parses them as before, and so it does when the
+cache can not be made or written (the cache root can not be written or is
+full).
+
+    names, seconds, sensors, values = LogCache.log_cache('temp.log').columns()
+
+gives the columns as memoryviews, np.frombuffer() turns them in to numpy
+arrays without a copy.
+
+usage:
+    LogCache.py [-c cache_root] log ...
+to bring the caches up to date (and time them).
+"""
+
+import argparse
+import array
+import hashlib
+import json
+import mmap
+import os
+import sys
+
+import LogParser
+
+DEBUG = 0
+
+CACHE_VERSION = 2
+DEFAULT_CACHE_ROOT = os.path.join(os.environ.get('XDG_CACHE_HOME')
+                                  or os.path.expanduser('~/.cache'),
+                                  'MoundController')
+# name of the log and the start of a hash of its absolute path
+CACHE_DIRECTORY_FORMAT = '{}.{}.cache'
+META_FILENAME = 'meta.json'
+FRAGMENTS_FILENAME = 'fragments'
+
+# (name, array type code) of each column
+COLUMNS = (
+    ('seconds', 'q'),
+    ('sensors', 'H'),
+    ('values', 'd'),
+    )
+
+# the sensor index is a uint16
+MAX_SENSORS = 1 << 16
+
+# write the columns after this many records
+WRITE_RECORDS = 1024 * 1024
+
+
+def can_cache(filename):
+    '''
+    return True if the log filename can be cached (it is not stdin or
+    compressed)
+    '''
+    return '-' != filename and not LogParser.is_archive(filename)
+
+
+def cache_directory_for(log_filename, cache_root=None):
+    '''
+    return the directory the cache of log_filename is kept in under
+    cache_root (DEFAULT_CACHE_ROOT if None)
+    '''
+    if cache_root is None:
+        cache_root = DEFAULT_CACHE_ROOT
+    path = os.path.abspath(log_filename)
+    digest = hashlib.sha1(path.encode('UTF-8', 'surrogateescape')).hexdigest()
+    return os.path.join(cache_root,
+                        CACHE_DIRECTORY_FORMAT.format(os.path.basename(path),
+                                                      digest[:16]))
+
+
+class log_cache():
+    '''
+    The records of one log kept as columns in a directory under cache_root.
+    '''
+    def __init__(self, log_filename, cache_root=None):
+        self.log_filename = log_filename
+        self.cache_directory = cache_directory_for(log_filename, cache_root)
+        self.meta = None
+
+    def path(self, name):
+        return os.path.join(self.cache_directory, name)
+
+    def empty_meta(self):
+        return { 'version' : CACHE_VERSION,
+                 'byteorder' : sys.byteorder,
+                 'path' : os.path.abspath(self.log_filename),
+                 'size' : 0,
+                 'mtime' : 0,
+                 'offset' : 0,
+                 'hash' : LogParser.log_hash(self.log_filename, 0).hexdigest(),
+                 'rows' : 0,
+                 'names' : [],
+                 'recovered' : 0,
+                 'fragments' : 0,
+                 'fragments_size' : 0 }
+
+    def load_meta(self):
+        '''
+        return the saved meta.json or None if there is none that can be used
+        '''
+        try:
+            with open(self.path(META_FILENAME)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if meta.get('version') != CACHE_VERSION or meta['byteorder'] != sys.byteorder:
+            return None
+        if meta['path'] != os.path.abspath(self.log_filename):
+            return None
+        return meta
+
+    def save_meta(self):
+        # write a new file and rename it so a crash can not leave half of it
+        temp_filename = self.path(META_FILENAME) + '.new'
+        with open(temp_filename, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(temp_filename, self.path(META_FILENAME))
+
+    def update(self):
+        '''
+        parse the lines of the log which are not in the cache yet (all of
+        them if the cache can not be used)
+
+        return the number of bytes of the log parsed
+        '''
+        status = os.stat(self.log_filename)
+        self.meta = self.load_meta()
+        hasher = None
+        if self.meta is not None:
+            if status.st_size == self.meta['size'] and status.st_mtime_ns == self.meta['mtime']:
+                return 0
+            if status.st_size < self.meta['offset']:
+                self.meta = None  # not just appended to
+            else:
+                hasher = LogParser.log_hash(self.log_filename, self.meta['offset'])
+                if hasher.hexdigest() != self.meta['hash']:
+                    self.meta = None  # changed before the offset
+                    hasher = None
+        if self.meta is None:
+            if DEBUG:
+                print('making {}'.format(self.cache_directory), file=sys.stderr)
+            os.makedirs(self.cache_directory, exist_ok=True)
+            self.meta = self.empty_meta()
+
+        start = self.meta['offset']
+        self.append(start)
+        self.meta['size'] = status.st_size
+        self.meta['mtime'] = status.st_mtime_ns
+        hasher = LogParser.log_hash(self.log_filename, self.meta['offset'],
+                                    start, hasher)
+        self.meta['hash'] = hasher.hexdigest()
+        self.save_meta()
+        return self.meta['offset'] - start
+
+    def append(self, offset):
+        '''
+        parse the log from offset and add the records to the columns
+        '''
+        rows = self.meta['rows']
+        files = []
+        try:
+            for name, code in COLUMNS:
+                f = open(self.path(name), 'ab')
+                # drop what a run which stopped part way added
+                f.truncate(rows * array.array(code).itemsize)
+                files.append(f)
+            fragments = open(self.path(FRAGMENTS_FILENAME), 'a', encoding='UTF-8')
+            files.append(fragments)
+            fragments.truncate(self.meta['fragments_size'])
+
+            damage = LogParser.damage_report(fragments)
+            try:
+                import BinDataNumpy  # only if numpy is there
+            except ImportError:
+                BinDataNumpy = None
+            with open(self.log_filename, 'rb') as ifile:
+                data = LogParser.map_log(ifile)
+                if BinDataNumpy is None:
+                    end = self.append_records(data, offset, files, damage)
+                else:
+                    end = self.append_chunks(BinDataNumpy, data, offset, files,
+                                             damage)
+
+            self.meta['offset'] = end
+            self.meta['recovered'] += damage.recovered
+            self.meta['fragments'] += damage.fragments
+            self.meta['fragments_size'] = fragments.tell()
+        finally:
+            for f in files:
+                f.close()
+
+    def append_records(self, data, offset, files, damage):
+        '''
+        parse data from offset a line at a time with LogParser and write
+        the records to the column files
+
+        return the offset after the last line
+        '''
+        names = self.meta['names']
+        index = { n : i for i, n in enumerate(names) }
+        columns = [array.array(code) for name, code in COLUMNS]
+        seconds, sensors, values = columns
+        records = LogParser.log_records(data, offset, damage=damage)
+        for s, n, v in records:
+            i = index.get(n)
+            if i is None:
+                if len(names) == MAX_SENSORS:
+                    raise ValueError('more than {} sensor names'.format(MAX_SENSORS))
+                i = index[n] = len(names)
+                names.append(n)
+            seconds.append(s)
+            sensors.append(i)
+            values.append(v)
+            if len(seconds) == WRITE_RECORDS:
+                self.write_columns(files, columns)
+        self.write_columns(files, columns)
+        return records.offset
+
+    def append_chunks(self, BinDataNumpy, data, offset, files, damage):
+        '''
+        parse data from offset in large chunks with numpy (the module
+        BinDataNumpy, see parse_chunk there), which is much faster, and
+        write the columns to the column files
+
+        return the offset after the last line
+        '''
+        names = BinDataNumpy.name_table()
+        for n in self.meta['names']:
+            names.index[n.encode('UTF-8')] = len(names.names)
+            names.names.append(n.encode('UTF-8'))
+        end = data.rfind(b'\n', offset) + 1  # only complete lines
+        start = offset
+        while start < end:
+            stop = data.rfind(b'\n', start, min(start + BinDataNumpy.CHUNK_BYTES, end)) + 1
+            if stop <= start:  # a line longer than a chunk
+                stop = data.find(b'\n', start) + 1
+            seconds, sensors, values = BinDataNumpy.parse_chunk(data[start:stop],
+                                                                names, damage)
+            for f, column, (name, code) in zip(files, (seconds, sensors, values), COLUMNS):
+                f.write(column.astype(code).tobytes())
+            self.meta['rows'] += len(seconds)
+            start = stop
+        self.meta['names'] = [n.decode('UTF-8', errors='replace') for n in names.names]
+        return max(end, offset)
+
+    def write_columns(self, files, columns):
+        for f, column in zip(files, columns):
+            column.tofile(f)
+        self.meta['rows'] += len(columns[0])
+        for column in columns:
+            del column[:]
+
+    def replay_damage(self, damage):
+        '''
+        count the damage found when the log was parsed in damage, a
+        LogParser.damage_report
+        '''
+        if damage is None:
+            return
+        damage.recovered += self.meta['recovered']
+        if self.meta['fragments']:
+            with open(self.path(FRAGMENTS_FILENAME), encoding='UTF-8') as f:
+                for line in f:
+                    damage.fragment(line.rstrip('\n'))
+
+    def columns(self, damage=None):
+        '''
+        bring the cache up to date and return (names, seconds, sensors,
+        values).  The columns are read only memoryviews of memory maps of
+        the cache.  The damage found in the log is counted in damage.
+
+        raise OSError if the cache can not be made or written, before
+        anything is counted in damage
+        '''
+        self.update()
+        rows = self.meta['rows']
+        columns = []
+        for name, code in COLUMNS:
+            if 0 == rows:
+                columns.append(memoryview(array.array(code)))
+                continue
+            with open(self.path(name), 'rb') as f:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            column = memoryview(m).cast(code)
+            columns.append(column[:rows])
+        self.replay_damage(damage)
+        return (list(self.meta['names']), *columns)
+
+    def rest(self):
+        '''
+        return the bytes of the log after the lines in the cache (a partial
+        last line, b'' if there is none)
+        '''
+        with open(self.log_filename, 'rb') as f:
+            f.seek(self.meta['offset'])
+            return f.read()
+
+    def records(self, damage=None):
+        '''
+        yield (seconds, name, value) for the records of the log, as
+        LogParser.log_records does with partial
+        '''
+        names, seconds, sensors, values = self.columns(damage)
+        yield from zip(seconds, map(names.__getitem__, sensors), values)
+        yield from LogParser.log_records(self.rest(), damage=damage, partial=True)
+
+
+def cached_columns(filename, damage=None, cache_root=None):
+    '''
+    return (names, seconds, sensors, values, rest) for filename, the
+    columns from its cache as log_cache.columns gives them and the bytes
+    after them (see log_cache.rest), or None if it can not be cached or
+    the cache can not be made or written, when the log should be parsed
+    as it is
+    '''
+    if not can_cache(filename):
+        return None
+    try:
+        cache = log_cache(filename, cache_root)
+        return (*cache.columns(damage), cache.rest())
+    except OSError as e:
+        if DEBUG:
+            print('not caching {}: {}'.format(filename, e), file=sys.stderr)
+        return None
+
+
+def read_records(filenames, damage=None, cache_root=None):
+    '''
+    yield (seconds, name, value) for the records of each of filenames in
+    turn, from their caches where they can be cached
+    '''
+    for filename in filenames:
+        columns = cached_columns(filename, damage, cache_root)
+        if columns is None:
+            yield from LogParser.read_logs([filename], damage)
+        else:
+            names, seconds, sensors, values, rest = columns
+            yield from zip(seconds, map(names.__getitem__, sensors), values)
+            yield from LogParser.log_records(rest, damage=damage, partial=True)
+
+
+if __name__ == "__main__":
+    import time
+
+    parser = argparse.ArgumentParser(description='bring the caches of logs up to date')
+    parser.add_argument('-c', '--cache-root', default=DEFAULT_CACHE_ROOT,
+                        help='where the caches are kept (default {})'.format(DEFAULT_CACHE_ROOT))
+    parser.add_argument('logs', nargs='+')
+    args = parser.parse_args()
+
+    for filename in args.logs:
+        start = time.perf_counter()
+        cache = log_cache(filename, args.cache_root)
+        parsed = cache.update()
+        print('{}: {} records, {} bytes parsed in {:.3f} seconds'.format(filename,
+                                                                        cache.meta['rows'],
+                                                                        parsed,
+                                                                        time.perf_counter() - start))
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Pull a range of time out of a sorted log (temp.log, event.log) quickly.
+
+Rather than
+    grep '^2018.06' full.log
+which reads the whole log, an index is kept next to the log (temp.log.index)
+with the byte offset of the first line of each hour:
+    yyyy.mm.dd_hh -> offset
+To get the lines from a time on, the index gives the offset of that hour,
+the log is read from there and stops at the first line at or after the
+end of the range, so only the lines asked for (and part of an hour before
+them) are read.
+
+The index is brought up to date before each query.  Like the checkpoint of
+BinData.py it holds how much of the log has been indexed and a hash of the
+bytes before that point:  if the log only grew just the new lines are
+read, otherwise the index is made again.
+
+Times are any leading part of a yyyy.mm.dd_hh:mm:ss timestamp and are
+compared as strings, so
+    -f 2018.06.01_13 -t 2018.06.01_18
+is from 13:00:00 up to (not including) 18:00:00 and
+    -f 2018.06 -t 2018.07
+is all of June 2018.  Lines can also be limited to some sensor names.
+
+The log must be in time order (as IngestLogs.py writes it).  Lines which
+do not start with a timestamp are not indexed and are skipped by queries.
+
+usage:
+    LogIndex.py [-f from] [-t to] [-n name,...] [-x index_file] log
+"""
+
+import argparse
+import bisect
+import json
+import os
+import sys
+
+import LogParser
+
+DEBUG = 0
+
+INDEX_VERSION = 1
+INDEX_FILENAME_FORMAT = '{}.index'
+
+# read this much of the log at a time
+READ_BYTES = 1024 * 1024
+
+# characters of a timestamp which make up the hour, yyyy.mm.dd_hh
+HOUR_WIDTH = 13
+TIMESTAMP_WIDTH = 19
+
+
+class log_index():
+    '''
+    The offset in a log of the first line of each hour.
+
+    hours and offsets are lists in time order, size is how much of the
+    log has been indexed (always the end of a line).
+    '''
+    def __init__(self, log_filename, index_filename=None):
+        self.log_filename = log_filename
+        if index_filename is None:
+            index_filename = INDEX_FILENAME_FORMAT.format(log_filename)
+        self.index_filename = index_filename
+        self.clear()
+
+    def clear(self):
+        self.hours = []
+        self.offsets = []
+        self.size = 0
+
+    def load(self):
+        '''
+        read the saved index, return False if there is none that fits the log
+        '''
+        try:
+            with open(self.index_filename) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return False
+        if saved.get('version') != INDEX_VERSION:
+            return False
+        if os.path.getsize(self.log_filename) < saved['size']:
+            return False
+        if LogParser.log_signature(self.log_filename, saved['size']) != saved['signature']:
+            return False
+        self.hours = saved['hours']
+        self.offsets = saved['offsets']
+        self.size = saved['size']
+        return True
+
+    def save(self):
+        saved = { 'version' : INDEX_VERSION,
+                  'size' : self.size,
+                  'signature' : LogParser.log_signature(self.log_filename, self.size),
+                  'hours' : self.hours,
+                  'offsets' : self.offsets }
+        # write a new file and rename it so a crash can not leave half an index
+        temp_filename = self.index_filename + '.new'
+        with open(temp_filename, 'w') as f:
+            json.dump(saved, f)
+        os.replace(temp_filename, self.index_filename)
+
+    def update(self):
+        '''
+        load the index and add the lines written to the log since it was
+        saved (or index the whole log), saving it if anything changed
+
+        return the number of bytes of the log read
+        '''
+        if not self.load():
+            self.clear()
+        start = self.size
+        last_hour = self.hours[-1].encode('UTF-8') if self.hours else b''
+        with open(self.log_filename, 'rb') as f:
+            f.seek(self.size)
+            offset = self.size
+            rest = b''
+            while True:
+                data = f.read(READ_BYTES)
+                if not data:
+                    break
+                lines = (rest + data).split(b'\n')
+                rest = lines.pop()
+                for line in lines:
+                    hour = line[0:HOUR_WIDTH]
+                    # only look closer when the hour changes
+                    if hour > last_hour and is_timestamp(line[0:TIMESTAMP_WIDTH]):
+                        last_hour = hour
+                        self.hours.append(hour.decode('UTF-8'))
+                        self.offsets.append(offset)
+                    offset += len(line) + 1
+        self.size = offset  # a partial last line is indexed next time
+        if self.size != start or not os.path.exists(self.index_filename):
+            self.save()
+        return self.size - start
+
+    def offset_of(self, when):
+        '''
+        return the offset of the first hour which could have lines at or
+        after when (a leading part of a timestamp)
+        '''
+        i = bisect.bisect_left(self.hours, when[0:HOUR_WIDTH])
+        if i == len(self.hours):
+            return self.size  # after everything indexed
+        return self.offsets[i]
+
+
+def is_timestamp(text):
+    try:
+        return bool(LogParser.TIMESTAMP_RE.match(text.decode('UTF-8')))
+    except UnicodeDecodeError:
+        return False
+
+
+def query(index, first=None, last=None, names=None):
+    '''
+    yield the lines (bytes, with their line ending) of the log of index
+    with timestamps from first up to (not including) last, both leading
+    parts of timestamps (or None for no limit).  With names only lines
+    for those sensors are given.
+    '''
+    offset = 0 if first is None else index.offset_of(first)
+    first = None if first is None else first.encode('UTF-8')
+    last = None if last is None else last.encode('UTF-8')
+    names = None if names is None else { n.encode('UTF-8') for n in names }
+    with open(index.log_filename, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            when = line[0:TIMESTAMP_WIDTH]
+            if not is_timestamp(when):
+                continue
+            if last is not None and when >= last:
+                break
+            if first is not None and when < first:
+                continue
+            if names is not None:
+                sl = line.split()
+                if len(sl) < 2 or sl[1] not in names:
+                    continue
+            yield line
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='pull a range of time out of a sorted log using an index of hours')
+    parser.add_argument('-f', '--from', dest='first',
+                        help='first time, e.g. 2018.06.01_13 (default the start of the log)')
+    parser.add_argument('-t', '--to', dest='last',
+                        help='stop before this time, e.g. 2018.06.01_18 (default the end of the log)')
+    parser.add_argument('-n', '--names',
+                        help='comma separated list of sensor names to give lines for')
+    parser.add_argument('-x', '--index',
+                        help='index file (default log.index)')
+    parser.add_argument('log',
+                        help='log in time order, e.g. temp.log or event.log')
+    args = parser.parse_args()
+
+    index = log_index(args.log, args.index)
+    indexed = index.update()
+    if DEBUG:
+        print('indexed {} bytes, {} hours'.format(indexed, len(index.hours)),
+              file=sys.stderr)
+    if args.first is None and args.last is None and args.names is None:
+        sys.exit(0)  # just bring the index up to date
+
+    out = sys.stdout.buffer
+    try:
+        names = None if args.names is None else args.names.split(',')
+        for line in query(index, args.first, args.last, names):
+            out.write(line)
+        out.flush()
+    except BrokenPipeError:
+        # e.g. piped in to head
+        sys.stderr.close()
@@ -0,0 +1,478 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Parse "timestamp name value" logs (temp.log) quickly.
+
+The log is memory mapped and handled in large chunks which end at the end
+of a line.  For each chunk the NUL characters are removed and the bytes
+are decoded with one call each, rather than once per line.  Each line is
+then split and is good if it has three fields, the first looks like a
+timestamp:
+    yyyy.mm.dd_hh:mm:ss
+and the last is a number.  Checking the shape of the timestamp rather
+than the year means data from 2020 on is not dropped.
+
+The phase 1 logs (RawData.phase1) have the type and id of the sensor
+rather than its name:
+    timestamp DS18B20 id value
+so lines with four fields get the name SensorIdToName.sed gives them, as
+the published data has, or from SensorIdToName.py when the .sed does not
+know the sensor (see sensor_name()).  Lines which
+are events (EVENT as the second field) are counted and skipped.  Logs can
+be read straight from .gz files and .zip archives (every member is a log)
+with open_logs() and read_logs(), so phase 1 and phase 2 data can be read
+in one go without unpacking anything.
+
+The timestamp is turned in to integer seconds since 1970 here, once, so
+binning can use integer division rather than cutting and hashing strings.
+The local time in the log is treated as if it were UTC so there are no
+daylight saving gaps or repeats.  Consecutive lines almost always share
+the same minute so only the seconds are converted for most lines.
+
+A line which is not good may be two (or more) records glued together by
+a torn write, e.g.
+    2019.01.23_09:29:04 sensor_O -1.872019.01.23_09:17:11 EVENT starting_controller
+or a record which lost its end and ran in to the next when NULs were
+removed.  Such lines are split before each timestamp in them and each
+piece is parsed on its own.  The pieces which still make no sense are
+counted by a damage_report and written to its quarantine file (if there
+is one) rather than printed one at a time.
+
+Run as a program it compares the time taken by this and by the loop the
+BinBy*New.py programs use:
+    LogParser.py temp.log
+"""
+
+import calendar
+import datetime
+import functools
+import gzip
+import hashlib
+import mmap
+import os
+import re
+import sys
+import time
+import zipfile
+
+import SensorIdToName
+
+# handle this much of the log at a time
+CHUNK_BYTES = 8 * 1024 * 1024
+
+TIMESTAMP_RE = re.compile(r'\d{4}\.\d\d\.\d\d_\d\d:\d\d:\d\d\Z')
+# a timestamp anywhere in a line, as text or bytes
+TIMESTAMP_SEARCH_RE = re.compile(r'\d{4}\.\d\d\.\d\d_\d\d:\d\d:\d\d')
+TIMESTAMP_SEARCH_BYTES_RE = re.compile(rb'\d{4}\.\d\d\.\d\d_\d\d:\d\d:\d\d')
+TIMESTAMP_FORMAT = '%Y.%m.%d_%H:%M:%S'
+
+# the sed script which named the sensors of the published data
+SED_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'SensorIdToName.sed')
+# e.g.          s/DS18B20 28.ff.1d.8c.50.16.04.4f/sensor_A/
+SED_NAME_RE = re.compile(r'\s*s/(\S+) (\S+)/([^/]*)/')
+
+
+@functools.lru_cache(maxsize=None)
+def read_sed_names(filename=SED_FILENAME):
+    '''
+    return a dict of the name for each (type, id) SensorIdToName.sed
+    renames, read once
+    '''
+    names = dict()
+    with open(filename) as f:
+        for line in f:
+            m = SED_NAME_RE.match(line)
+            if m:
+                names.setdefault((m.group(1), m.group(2)), m.group(3))
+    return names
+
+
+@functools.lru_cache(maxsize=None)
+def sed_name(type, id):
+    '''
+    return the name SensorIdToName.sed gives the sensor of the type / id
+    pair or None if it leaves it alone
+    '''
+    return read_sed_names().get((type, id))
+
+
+@functools.lru_cache(maxsize=None)
+def sensor_name(type, id):
+    '''
+    return the name of the sensor of the type / id pair.  The .sed named
+    the published data and where SensorIdToName.py differs (the TBD_ names)
+    it wins, otherwise the name (or the no_name_for_ name) from
+    SensorIdToName.py is used.
+    '''
+    name = sed_name(type, id)
+    if name is None:
+        name = SensorIdToName.name_from_type_and_id(type, id)
+    return name
+
+
+# how much of a log before an offset is used to make sure it has not changed
+SIGNATURE_BYTES = 4096
+
+# read this much of a log at a time to hash it
+HASH_BYTES = 1024 * 1024
+
+
+def log_hash(filename, end, start=0, hasher=None):
+    '''
+    return a sha1 hasher of the bytes of filename before end, carrying on
+    hasher (a sha1 of the bytes before start) if it is given
+    '''
+    if hasher is None:
+        hasher = hashlib.sha1()
+        start = 0
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        while start < end:
+            data = f.read(min(HASH_BYTES, end - start))
+            if not data:
+                break
+            hasher.update(data)
+            start += len(data)
+    return hasher
+
+
+def timestamp_to_seconds(timestamp):
+    '''
+    return the seconds since 1970 for a yyyy.mm.dd_hh:mm:ss timestamp
+    (or just the yyyy.mm.dd_hh:mm part)
+
+    raise ValueError if it is not a real date and time
+    '''
+    second = int(timestamp[17:19]) if len(timestamp) > 17 else 0
+    # datetime checks the fields make sense
+    when = datetime.datetime(int(timestamp[0:4]), int(timestamp[5:7]),
+                             int(timestamp[8:10]), int(timestamp[11:13]),
+                             int(timestamp[14:16]), second)
+    return calendar.timegm(when.timetuple())
+
+
+def format_timestamp(seconds, width=len('yyyy.mm.dd_hh:mm:ss')):
+    '''
+    return the yyyy.mm.dd_hh:mm:ss timestamp for seconds since 1970 cut
+    to width characters
+    '''
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(seconds))[0:width]
+
+
+def log_signature(filename, offset):
+    '''
+    return a hash of the SIGNATURE_BYTES just before offset in filename, a
+    quick check the log has only been added to since offset was saved
+    (changes further back are only seen by log_hash)
+    '''
+    start = max(0, offset - SIGNATURE_BYTES)
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        return hashlib.sha1(f.read(offset - start)).hexdigest()
+
+
+def split_records(line):
+    '''
+    return the pieces of line (text or bytes) split before each timestamp
+    in it.  Anything before the first timestamp is a piece of its own.
+    '''
+    if isinstance(line, str):
+        search = TIMESTAMP_SEARCH_RE
+    else:
+        search = TIMESTAMP_SEARCH_BYTES_RE
+    starts = [m.start() for m in search.finditer(line)]
+    if not starts or 0 != starts[0]:
+        starts.insert(0, 0)
+    starts.append(len(line))
+    return [line[a:b] for a, b in zip(starts, starts[1:])]
+
+
+class damage_report():
+    '''
+    Count the records which were split out of glued lines (recovered) and
+    the pieces of lines which could not be used (fragments).
+
+    The fragments are written, one per line, to quarantine (a text file)
+    if it is given, or kept in the list held if keep is True (so a worker
+    process can hand them back).
+    '''
+    def __init__(self, quarantine=None, keep=False):
+        self.quarantine = quarantine
+        self.keep = keep
+        self.held = []
+        self.recovered = 0
+        self.fragments = 0
+
+    def fragment(self, text):
+        self.fragments += 1
+        if self.quarantine is not None:
+            self.quarantine.write(text + '\n')
+        elif self.keep:
+            self.held.append(text)
+
+    def merge(self, other):
+        '''
+        add the counts (and held fragments) of another report to this one
+        '''
+        self.recovered += other.recovered
+        for text in other.held:
+            self.fragment(text)
+        # the fragments of other were counted as they were added
+        self.fragments += other.fragments - len(other.held)
+
+    def summary(self):
+        text = '{} records recovered from glued lines, {} unusable pieces'.format(self.recovered,
+                                                                                 self.fragments)
+        if self.quarantine is not None and self.fragments:
+            text += ' written to {}'.format(self.quarantine.name)
+        return text
+
+    def __bool__(self):
+        return bool(self.recovered or self.fragments)
+
+
+def map_log(f):
+    '''
+    return a read only memory map of the open (binary) file f, or an empty
+    bytes if the file is empty (which can not be mapped)
+    '''
+    f.seek(0, 2)
+    if 0 == f.tell():
+        return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class log_records():
+    '''
+    Iterate over (seconds, name, value) for the good lines of data (bytes
+    or a memory map) from start up to (not including) end.  seconds is
+    the timestamp as seconds since 1970.
+
+    offset is moved past each chunk of lines as they are used so when done
+    it is where the next run should start.  A line starting before end is
+    used even if it finishes after end.  A partial line at the end of data
+    (one still being written) is used only if partial is True, otherwise
+    offset stops before it so it is used when it is finished.
+
+    entries counts the records found and events the event lines skipped.
+    Glued lines and pieces which can not be used are counted by damage (a
+    damage_report).
+    '''
+    def __init__(self, data, start=0, end=None, damage=None, partial=False):
+        self.data = data
+        self.offset = start
+        self.end = len(data) if end is None else min(end, len(data))
+        self.partial = partial
+        self.damage = damage_report() if damage is None else damage
+        self.entries = 0
+        self.events = 0
+        # the yyyy.mm.dd_hh:mm of the last line and its seconds since 1970
+        self.minute = None
+        self.minute_seconds = 0
+
+    def __iter__(self):
+        data = self.data
+        size = len(data)
+        while self.offset < self.end:
+            stop = min(self.offset + CHUNK_BYTES, self.end)
+            # finish the chunk at the end of the line holding byte stop - 1
+            newline = data.find(b'\n', stop - 1, size)
+            if -1 == newline:
+                if self.partial:
+                    newline = size - 1  # use the partial line as well
+                else:
+                    # the log ends with a partial line, use the lines before it
+                    newline = data.rfind(b'\n', self.offset, size)
+                    if -1 == newline:
+                        break  # only a partial line is left
+            chunk = data[self.offset:newline + 1]
+            yield from self.parse_chunk(chunk)
+            self.offset = newline + 1
+
+    def parse_chunk(self, chunk):
+        '''
+        return a list of (seconds, name, value) for the good lines of chunk
+        '''
+        if b'\0' in chunk:
+            chunk = chunk.replace(b'\0', b'')  # remove null characters
+        records = []
+        append = records.append
+        match = TIMESTAMP_RE.match
+        for line in chunk.decode('UTF-8', errors='replace').split('\n'):
+            # the same as parse_record() but this is done for every line
+            sl = line.split()
+            if len(sl) == 4 and match(sl[0]):
+                # phase 1 "timestamp type id value"
+                sl = [sl[0], sensor_name(sl[1], sl[2]), sl[3]]
+            if len(sl) == 3 and match(sl[0]):
+                try:
+                    timestamp = sl[0]
+                    if timestamp[0:16] != self.minute:
+                        self.minute_seconds = timestamp_to_seconds(timestamp[0:16])
+                        self.minute = timestamp[0:16]
+                    second = int(timestamp[17:19])
+                    if second > 59:
+                        raise ValueError('bad second')
+                    append((self.minute_seconds + second, sl[1], float(sl[2])))
+                    continue
+                except ValueError:
+                    pass
+            if sl:  # blank lines are not damage
+                self.recover(line, append)
+        self.entries += len(records)
+        return records
+
+    def parse_record(self, text):
+        '''
+        return (seconds, name, value) for a line of text or None if it is
+        not a good record
+        '''
+        sl = text.split()
+        if len(sl) == 4:
+            sl = [sl[0], sensor_name(sl[1], sl[2]), sl[3]]
+        if len(sl) != 3 or not TIMESTAMP_RE.match(sl[0]):
+            return None
+        try:
+            return timestamp_to_seconds(sl[0]), sl[1], float(sl[2])
+        except ValueError:
+            return None
+
+    def recover(self, line, append):
+        '''
+        append the records in a line which is not a good record to the list
+        with append, and hand the pieces which are not records to damage
+        '''
+        pieces = split_records(line)
+        for piece in pieces:
+            sl = piece.split()
+            if len(sl) > 1 and 'EVENT' == sl[1]:
+                self.events += 1
+                continue
+            record = self.parse_record(piece)
+            if record is None:
+                if piece.strip():
+                    self.damage.fragment(piece.strip())
+            else:
+                append(record)
+                self.damage.recovered += 1
+
+
+def file_records(f, damage=None):
+    '''
+    yield (seconds, name, value) for the good lines of a binary file
+    which can not be memory mapped (e.g. stdin).  A partial last line is
+    used.
+    '''
+    parser = log_records(b'', damage=damage)
+    rest = b''
+    while True:
+        data = f.read(CHUNK_BYTES)
+        if not data:
+            break
+        data = rest + data
+        end = data.rfind(b'\n') + 1
+        rest = data[end:]
+        yield from parser.parse_chunk(data[:end])
+    if rest:
+        yield from parser.parse_chunk(rest)
+
+
+def is_archive(filename):
+    '''
+    return True for the names of logs which are compressed
+    '''
+    return filename.endswith(('.gz', '.zip'))
+
+
+def open_logs(filenames):
+    '''
+    yield an open binary file for each log in filenames.  A .gz file is
+    uncompressed as it is read and each member of a .zip file is a log of
+    its own.  "-" is stdin.
+    '''
+    for filename in filenames:
+        if '-' == filename:
+            yield sys.stdin.buffer
+        elif filename.endswith('.gz'):
+            with gzip.open(filename, 'rb') as f:
+                yield f
+        elif filename.endswith('.zip'):
+            with zipfile.ZipFile(filename) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir():
+                        with archive.open(member) as f:
+                            yield f
+        else:
+            with open(filename, 'rb') as f:
+                yield f
+
+
+def read_logs(filenames, damage=None):
+    '''
+    yield (seconds, name, value) for the good lines of each of filenames
+    (see open_logs) in turn
+    '''
+    for f in open_logs(filenames):
+        yield from file_records(f, damage)
+
+
+def old_loop(filename):
+    '''
+    the loop used by the BinBy*New.py programs, for comparison
+    '''
+    entries = 0
+    with open(filename) as ifile:
+        for line in ifile:
+            line = line.translate(dict.fromkeys([0]))  # remove null characters
+            sl = line.split()
+            if len(sl) != 3:
+                continue
+            if not sl[0].startswith( ('2017', '2018', '2019') ):
+                continue
+            value = float(sl[2])
+            entries+=1
+    return entries
+
+
+def new_loop(filename):
+    entries = 0
+    with open(filename, 'rb') as f:
+        for seconds, name, value in log_records(map_log(f), partial=True):
+            entries+=1
+    return entries
+
+
+if __name__ == "__main__":
+    for filename in sys.argv[1:]:
+        for loop in (old_loop, new_loop):
+            start = time.perf_counter()
+            entries = loop(filename)
+            print('{}: {} {} entries in {:.3f} seconds'.format(filename,
+                                                              loop.__name__,
+                                                              entries,
+                                                              time.perf_counter() - start))
@@ -0,0 +1,258 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Write the samples and events of MoundController.py to its log in groups.
+
+MoundController.py used to write and flush each line on its own, taken
+from a queue.Queue(30), so when the SD card stalled the queue filled and
+the threads sampling the ports stopped in put().  Here:
+
+log_queue holds what is waiting to be written.  put() never waits:  up to
+capacity records are kept in memory and when there are more (the storage
+has stalled for a long time) the oldest are dropped and counted, so
+sampling carries on at its own rate.
+
+log_writer takes everything waiting at once.  It waits up to latency
+seconds after the first record of a group for more to arrive (or until
+size bytes are waiting), then writes them all with one os.write() to the
+file descriptor, so nothing sits in a buffer of the file, and os.fsync()s
+it if sync is set.  A write which fails is tried again every
+RETRY_SECONDS from where it stopped while new records wait in the queue.
+Each group is written holding a lock (flock) on the log so CompactLogs.py
+can move old lines out of it without losing any, and when CompactLogs.py
+has replaced the log the new one is opened.
+
+What happened is counted as it runs:
+    log_queue.depth(), largest      records waiting now and at most
+    log_queue.dropped               records dropped when the queue was full
+    log_writer.records, .bytes      records and bytes in each group written
+    log_writer.seconds              time to write (and sync) each group
+and summary() of each gives them as text.
+
+usage (as MoundController.py does):
+    write_queue = LogWriter.log_queue()
+    writer = LogWriter.log_writer(open(filename, 'a'), write_queue)
+    writer.start()
+    write_queue.put('a line\n')
+"""
+
+import collections
+import fcntl
+import os
+import sys
+import threading
+import time
+import traceback
+
+DEBUG = 0
+
+# records kept waiting before the oldest are dropped, a record is the
+# answer of a port so this is hours of pumping and days of base sampling
+DEFAULT_CAPACITY = 20000
+
+# how long the first record of a group waits for more before it is written
+DEFAULT_LATENCY_IN_SECONDS = 1.0
+
+# write sooner when this many bytes are waiting
+DEFAULT_SIZE = 64 * 1024
+
+# wait this long to try again when writing fails
+RETRY_SECONDS = 10
+
+
+class tally():
+    '''
+    Count, mean and largest of some quantity
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.largest = 0
+
+    def add(self, amount):
+        self.count += 1
+        self.total += amount
+        if amount > self.largest:
+            self.largest = amount
+
+    def mean(self):
+        if not self.count:
+            return 0
+        return self.total / self.count
+
+
+class log_queue():
+    '''
+    Records (text) waiting to be written to the log.  put() never waits,
+    the oldest records are dropped when more than capacity are waiting.
+    '''
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        # only use the rest when the condition is held
+        self.condition = threading.Condition()
+        self.records = collections.deque()
+        self.waiting_bytes = 0
+        self.unfinished = 0
+        self.largest = 0
+        self.dropped = 0
+
+    def put(self, record):
+        with self.condition:
+            if len(self.records) == self.capacity:
+                self.waiting_bytes -= len(self.records.popleft())
+                self.unfinished -= 1
+                self.dropped += 1
+            self.records.append(record)
+            self.waiting_bytes += len(record)
+            self.unfinished += 1
+            if len(self.records) > self.largest:
+                self.largest = len(self.records)
+            self.condition.notify_all()
+
+    def depth(self):
+        with self.condition:
+            return len(self.records)
+
+    def take(self, latency, size):
+        '''
+        wait for a record, then up to latency seconds more or until size
+        bytes are waiting
+
+        return a list of all of the records waiting
+        '''
+        with self.condition:
+            while not self.records:
+                self.condition.wait()
+            deadline = time.monotonic() + latency
+            while self.waiting_bytes < size:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                self.condition.wait(left)
+            records = list(self.records)
+            self.records.clear()
+            self.waiting_bytes = 0
+            return records
+
+    def task_done(self, count=1):
+        '''
+        count records taken were written
+        '''
+        with self.condition:
+            self.unfinished -= count
+            self.condition.notify_all()
+
+    def join(self):
+        '''
+        wait until everything put was written (or dropped)
+        '''
+        with self.condition:
+            while self.unfinished > 0:
+                self.condition.wait()
+
+    def summary(self):
+        with self.condition:
+            return '{} waiting, {} at most, {} dropped'.format(len(self.records),
+                                                               self.largest,
+                                                               self.dropped)
+
+
+class log_writer(threading.Thread):
+    '''
+    Take what is waiting on queue (a log_queue) and write it to where (a
+    file opened to append) in groups
+
+    Mark ourself as a daemon as we don't have a job when everything else is done
+    '''
+    def __init__(self, where, queue, latency=DEFAULT_LATENCY_IN_SECONDS,
+                 size=DEFAULT_SIZE, sync=False):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.where = where
+        self.queue = queue
+        self.latency = latency
+        self.size = size
+        self.sync = sync
+        self.records = tally()
+        self.bytes = tally()
+        self.seconds = tally()
+
+    def lock(self):
+        '''
+        lock the file, opening it again if it was replaced
+        '''
+        while True:
+            fcntl.flock(self.where, fcntl.LOCK_EX)
+            try:
+                if os.path.samestat(os.stat(self.where.name),
+                                    os.fstat(self.where.fileno())):
+                    return
+            except FileNotFoundError:
+                pass
+            fcntl.flock(self.where, fcntl.LOCK_UN)
+            self.where.close()
+            self.where = open(self.where.name, 'a')
+
+    def write(self, data):
+        '''
+        write all of data (bytes) to the log, trying again every
+        RETRY_SECONDS while that fails (e.g. the SD card is full)
+        '''
+        view = memoryview(data)
+        while True:
+            self.lock()
+            try:
+                while view:
+                    view = view[os.write(self.where.fileno(), view):]
+                if self.sync:
+                    os.fsync(self.where.fileno())
+                return
+            except OSError:
+                traceback.print_exc()
+            finally:
+                fcntl.flock(self.where, fcntl.LOCK_UN)
+            time.sleep(RETRY_SECONDS)
+
+    def run(self):
+        while True:
+            records = self.queue.take(self.latency, self.size)
+            data = ''.join(records).encode('UTF-8')
+            start = time.monotonic()
+            self.write(data)
+            self.seconds.add(time.monotonic() - start)
+            self.records.add(len(records))
+            self.bytes.add(len(data))
+            self.queue.task_done(len(records))
+            if DEBUG:
+                print('log_writer: {}, {}'.format(self.summary(), self.queue.summary()),
+                      file=sys.stderr, flush=True)
+
+    def summary(self):
+        return '{} groups of {:.1f} records ({} at most) {:.0f} bytes ({} at most) written in {:.3f} ms ({:.3f} ms at most)'.format(
+            self.records.count, self.records.mean(), self.records.largest,
+            self.bytes.mean(), self.bytes.largest,
+            self.seconds.mean() * 1000, self.seconds.largest * 1000)
@@ -60,7 +60,6 @@ The sensors are segregated in to two groups:
 
 import datetime
 import glob
-import queue
 import serial
 import sys
 import threading
@@ -68,6 +67,9 @@ import time
 
 import RPi.GPIO as GPIO
 
+import LogWriter
+import PortSampler
+
 DEBUG = 0
 SMS = 0
 
@@ -77,7 +79,7 @@ if SMS:
 # sample sensors a bit more often than once a minute
 BASE_SAMPLE_INTERVAL_IN_SECONDS = 58
 # sample this often when running pump
-PUMPING_SAMPLE_INTERVAL_IN_SECONDS = 4 # NOTE: Could be hard of > 2 ports
+PUMPING_SAMPLE_INTERVAL_IN_SECONDS = 4 # all ports are read at once
 # how long to wait after changing sample rate
 START_STOP_SECONDS = 2 * PUMPING_SAMPLE_INTERVAL_IN_SECONDS
 
@@ -97,12 +99,16 @@ PUMP_THRESHOLD_TEMPERATURE = 45 # typical hot water in a home
 
 DATETIME_FORMAT = '%Y.%m.%d_%H:%M:%S'
 RESULT_FILENAME = '/home/pgc/mound_controller.log'
+# write what is waiting to the log at least this often (see LogWriter.py)
+LOG_LATENCY_IN_SECONDS = 1
+# fsync the log after each write, slow on an SD card
+LOG_SYNC = False
+# look this often that the sensors are still being sampled
+CHECK_INTERVAL_IN_SECONDS = 60
 
 SERIAL_FILENAME_GLOBS = ('/dev/ttyUSB*', '/dev/ttyACM*')
 PORT_SPEED = 115200
 
-NL = '\n'.encode('UTF-8')
-
 PIPE_INLET_SENSOR_ID = '28.ff.0b.f1.92.16.04.86' # Y
 PIPE_OUTLET_SENSOR_ID = '28.ff.b5.45.92.16.05.aa' # W
 
@@ -150,27 +156,6 @@ def release_pump():
 # these routines handle output of data and events
 #    
 
-class writer_thread (threading.Thread):
-    '''
-    Wait on queue and write/flush each entry that arrives
-
-    Mark ourself as a daemon as we don't have a job when everything else is done
-    '''
-    def __init__(self, where, queue):
-        threading.Thread.__init__(self)
-        self.daemon = True
-        self.where = where
-        self.queue = queue
-        
-    def run(self):
-        while True:
-            data = self.queue.get()
-            if data:
-                self.where.write(data)
-                self.where.flush()
-            self.queue.task_done()
-
-
 def timestamped_event_to_queue(queue, event_text):
     '''
     Put a line of output on the queue to be written to the log
@@ -183,120 +168,58 @@ def timestamped_event_to_queue(queue, event_text):
 # these routines get the data from the sensors
 #
 
-def process_sensor_reading(line):
+def process_sensor_readings(readings, when):
     '''
-    Pick apart the data and create a new result to be written.
+    Make the lines to be written for the readings (type, id, value) of a
+    port which were asked for at when (time.time()), all with the same
+    timestamp.
     
-    If this is the sensor we are watching, save a copy of the value for
-    others to retrieve.
+    If the sensor we are watching is among them, save a copy of the value
+    for others to retrieve.
     '''
     # make sure we update the global value
     global WATCHED_SENSOR_SAMPLE
     
-    if len(line.split()) == 3:
-        when = datetime.datetime.now().strftime(DATETIME_FORMAT)
-        items = line.split()
-        result = '{} {} {} {}\n'.format(when, items[0], items[1], items[2])
+    timestamp = datetime.datetime.fromtimestamp(when).strftime(DATETIME_FORMAT)
+    results = []
+    for kind, sensor_id, value in readings:
+        results.append('{} {} {} {}\n'.format(timestamp, kind, sensor_id, value))
 
         # if this is the sensor we are watching, keep a copy others can see
-        if items[1] == SENSOR_TO_WATCH_ID:
+        if sensor_id == SENSOR_TO_WATCH_ID:
             if DEBUG:
-                print('found ID of "{}" with value of "{}"'.format(items[1], items[2]),
+                print('found ID of "{}" with value of "{}"'.format(sensor_id, value),
                       file=sys.stderr, flush=True)
             with WATCHED_SENSOR_SAMPLE_LOCK:
-                WATCHED_SENSOR_SAMPLE = float(items[2])
+                WATCHED_SENSOR_SAMPLE = float(value)
             # we can be sure the lock is released here
-        return result
-    else:
-        return None
+    return ''.join(results)
     
 def get_readings_from_port(port):
     '''
+    Ask port for samples and return the lines to be written for them
     '''
-    results = []
     if DEBUG:
         start_time = time.time()
-    port.write(NL)  # ask for samples
-    
-    # read first line returned
-    l = port.readline().decode('UTF-8').strip()
-    if DEBUG:
-        print('line: "{}"'.format(l),
-              file=sys.stderr, flush=True)  # don't need a \n
-    # process till a blank line is returned
-    while len(l.split()) > 0:
-        results.append(process_sensor_reading(l))
-        l = port.readline().decode('UTF-8')
-        if DEBUG:
-            print('line:  "{}"'.format(l),
-                  file=sys.stderr, flush=True)  # don't need a \n
+    answer = PortSampler.read_answer(port)
     if DEBUG:
+        print('answer: "{}"'.format(answer.data),
+              file=sys.stderr, flush=True)
         print('sample time = {} seconds'.format(time.time() - start_time),
               file=sys.stderr, flush=True)
 
-    return results
+    return process_sensor_readings(answer.readings(),
+                                   answer.asked).splitlines(keepends=True)
 
 
-class port_reader_thread(threading.Thread):
-    '''
-    Sample the sensors on a serial port and queue up the 
-    results to be written to a persistent place.
-    '''
-    def __init__(self, queue, port):
-        threading.Thread.__init__(self)
-        self.daemon = False
-        self.queue = queue
-        self.port = port
-        
-    def run(self):
-        results = get_readings_from_port(self.port)
-        for r in results:
-            if r:  # might have a None in the list, if so ignore it
-                self.queue.put(r)
-
-class ports_reader_thread(threading.Thread):
-    '''
-    Periodically sample the sensors on a collection of serial ports and
-    queue up the results to be written to a persistent place
-    '''
-    def __init__(self, queue, ports, interval_in_seconds):
-        threading.Thread.__init__(self)
-        self.daemon = True
-        self.queue = queue
-        self.ports = ports
-        self.interval_in_seconds = interval_in_seconds
-        self.keep_running = True
-        
-    def stop(self):
-        self.keep_running = False
-        
-    def run(self):
-        next_sample_time = time.time()
-        while self.keep_running:
-            threads = []
-            for port in self.ports:
-                srt = port_reader_thread(write_queue, port)
-                threads.append(srt)
-                srt.start()
-            # wait for everything to complete
-            for t in threads:
-                t.join()
-        
-            next_sample_time = next_sample_time + self.interval_in_seconds
-            delay_time = next_sample_time - time.time()
-            if DEBUG:
-                print('ports_reader_thread: delay_time = {}\n'.format(delay_time),
-                      file=sys.stderr, flush=True)
-        
-            if 0 < delay_time:  # don't sleep if already next sample time
-                time.sleep(delay_time)
-
 #
 # determine whan and how to run pump
 #
 
-def pump_controller(write_queue, ports, base_interval, pumping_interval):
+def pump_controller(scheduler, write_queue, ports, base_interval, pumping_interval):
     '''
+    scheduler is the PortSampler.sampling_scheduler which samples the ports
+
     write_queue is where to send output
     
     ports are the port(s) to monitor more frequently when the pump is running
@@ -319,14 +242,13 @@ def pump_controller(write_queue, ports, base_interval, pumping_interval):
         Wait REHEAT_TIME_IN_SECONDS
       Loop back to the top of this sequence 
 
+    The sampling rate changes as soon as it is set, nothing is stopped or
+    started to change it.
     '''
     while True:
         # increase sample rate on watched sensors
         timestamped_event_to_queue(write_queue, 'increase_sensor_sampling_rate')
-        sensor_thread = ports_reader_thread(write_queue,
-                                            ports,
-                                            pumping_interval)
-        sensor_thread.start() # wait to get some samples
+        scheduler.set_interval(ports, pumping_interval)
 
         # get some samples before proceeding
         time.sleep(START_STOP_SECONDS)
@@ -359,19 +281,12 @@ def pump_controller(write_queue, ports, base_interval, pumping_interval):
         turn_off_pump()
 
         time.sleep(START_STOP_SECONDS) # get some samples before proceeding
-        sensor_thread.stop()  # stop the fast sampling
-        sensor_thread.join()  # wait for fast sampling to end
 
         # back to base sample rate while we wait to let the pile re-heat
         timestamped_event_to_queue(write_queue, 'base_sensor_sampling_rate')
-        sensor_thread = ports_reader_thread(write_queue,
-                                            ports,
-                                            base_interval)
-        sensor_thread.start()
+        scheduler.set_interval(ports, base_interval)
         timestamped_event_to_queue(write_queue, 'waiting_{}_seconds'.format(REHEAT_TIME_IN_SECONDS))
         time.sleep(REHEAT_TIME_IN_SECONDS)
-        sensor_thread.stop()  # stop the base sampling
-        sensor_thread.join()  # wait for base sampling to end
 
         # end of process, run the pump again
 
@@ -438,8 +353,10 @@ if __name__ == "__main__":
     data_file_name = RESULT_FILENAME
     with open(data_file_name, 'a') as output_file:
         # set up queue to handle output to single place between many threads
-        write_queue = queue.Queue(30)
-        writer = writer_thread(output_file, write_queue)
+        write_queue = LogWriter.log_queue()
+        writer = LogWriter.log_writer(output_file, write_queue,
+                                      latency=LOG_LATENCY_IN_SECONDS,
+                                      sync=LOG_SYNC)
         writer.start()
 
         # set up the GPIO port and turn off the pump
@@ -455,10 +372,11 @@ if __name__ == "__main__":
         if DEBUG:
             print('starting backgroud sensors\n',
                   file=sys.stderr, flush=True)
-        background_sensor_thread = ports_reader_thread(write_queue,
-                                                       monitored_ports,
-                                                       BASE_SAMPLE_INTERVAL_IN_SECONDS)
-        background_sensor_thread.start()
+        sensor_scheduler = PortSampler.sampling_scheduler(write_queue,
+                                                          process_sensor_readings)
+        sensor_scheduler.start()
+        sensor_scheduler.set_interval(monitored_ports,
+                                      BASE_SAMPLE_INTERVAL_IN_SECONDS)
 
 #         if DEBUG:
 #             print('waiting to let monitors get started ...\n',
@@ -469,7 +387,7 @@ if __name__ == "__main__":
 #             print('starting pump controller\n',
 #                   file=sys.stderr, flush=True)
 #         
-#         pump_controller(write_queue, watched_ports, 
+#         pump_controller(sensor_scheduler, write_queue, watched_ports, 
 #                         BASE_SAMPLE_INTERVAL_IN_SECONDS, 
 #                         PUMPING_SAMPLE_INTERVAL_IN_SECONDS)
 #         if DEBUG:
@@ -477,11 +395,26 @@ if __name__ == "__main__":
 #                   file=sys.stderr, flush=True)
         
         # just sit here an allow monitors to run
+        dropped = 0
         while True:
-            time.sleep(1000)
+            time.sleep(CHECK_INTERVAL_IN_SECONDS)
+            if not sensor_scheduler.is_alive():
+                # a port failing only stops that port, this is something
+                # else so sample with a new scheduler rather than not at all
+                timestamped_event_to_queue(write_queue, 'restarting_sensor_sampling')
+                sensor_scheduler = sensor_scheduler.replacement()
+                sensor_scheduler.start()
+            # note in the log when the storage stalled long enough to lose some
+            if write_queue.dropped != dropped:
+                m = 'dropped_{}_log_records'.format(write_queue.dropped - dropped)
+                timestamped_event_to_queue(write_queue, m)
+                dropped = write_queue.dropped
+            if DEBUG:
+                print('{}, {}\n'.format(writer.summary(), write_queue.summary()),
+                      file=sys.stderr, flush=True)
             
         # clean up if we ever get here
-        background_sensor_thread.stop()
+        sensor_scheduler.stop()
         # ensure any remaining data has been written after stop
         write_queue.join()
         # leave pump turned off
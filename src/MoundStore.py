@@ -0,0 +1,325 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Keep the samples and events in a SQLite database (mound.db) so questions
+which cut across the logs and the CSVs can be asked with SQL, e.g. the
+pipe_outlet readings above 45 C while the pump was running:
+
+    SELECT timestamp(ts), value FROM samples
+        JOIN sensors ON sensor = sensors.id
+        JOIN pump_runs ON ts >= start AND ts < stop
+        WHERE name = 'pipe_outlet' AND value > 45
+
+SQLite is part of python and the database is a local file so nothing
+else is needed.  The tables are:
+
+    sensors(id, name)
+    samples(ts, sensor, value)      ts is seconds since 1970 (the local
+                                    time of the log as if it were UTC, as
+                                    LogParser.py does), sensor is sensors.id
+    events(ts, text)                the text after EVENT in event.log
+    logs(kind, path, offset, signature)
+                                    how much of temp.log and event.log is in
+                                    the database
+
+and the view pump_runs(start, stop) pairs each turned_on_pump event with
+the turning_off_pump event which follows it.  The SQL function
+timestamp(ts) gives the yyyy.mm.dd_hh:mm:ss form of ts.
+
+samples has an index on (sensor, ts, value) which holds everything a
+query of one sensor over a range of time needs, so those queries (and
+binning, see time_slices) read only the index.
+
+The logs are read as BinData.py does with a checkpoint:  the offset of
+each log reached and a hash of the bytes before it are kept in the logs
+table, so each run only adds the new lines.  If a log changed other than
+by growing its rows are deleted and it is read again.  The rows of a run
+are added with executemany() in batches in one transaction (along with
+the new offset) so a run which fails adds nothing.  The database is in
+WAL mode so queries can run while rows are being added.
+
+usage:
+    MoundStore.py [-d mound.db] [-t temp.log] [-e event.log] [-q SQL]
+
+Without -q the logs are just added to the database.  With -q the rows of
+the query are printed as CSV.  BinData.py -d mound.db makes the temp_*.csv
+files from the database.
+"""
+
+import argparse
+import csv
+import sqlite3
+import sys
+
+import LogParser
+
+DEBUG = 0
+
+DEFAULT_DATABASE_FILENAME = '../Data/mound.db'
+
+# rows given to each executemany()
+BATCH_ROWS = 10000
+
+# read this much of event.log at a time
+READ_BYTES = 1024 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sensors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS samples (
+    ts INTEGER NOT NULL,
+    sensor INTEGER NOT NULL REFERENCES sensors(id),
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    ts INTEGER NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE TABLE IF NOT EXISTS logs (
+    kind TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    signature TEXT NOT NULL
+);
+CREATE VIEW IF NOT EXISTS pump_runs AS
+    SELECT ts AS start, next_ts AS stop FROM (
+        SELECT ts, text,
+               LEAD(ts) OVER (ORDER BY ts) AS next_ts,
+               LEAD(text) OVER (ORDER BY ts) AS next_text
+            FROM events
+            WHERE text IN ('turned_on_pump', 'turning_off_pump', 'starting_controller'))
+        WHERE text = 'turned_on_pump' AND next_text = 'turning_off_pump';
+'''
+
+# made after a whole log is added, which is faster than keeping it up to date
+SAMPLES_INDEX = 'CREATE INDEX IF NOT EXISTS samples_sensor_ts ON samples (sensor, ts, value)'
+
+
+def connect(database_filename):
+    '''
+    return a connection to the database, made if needed
+    '''
+    connection = sqlite3.connect(database_filename)
+    connection.execute('PRAGMA journal_mode=WAL')
+    # with WAL this can only lose the last transactions if the power fails,
+    # it can not corrupt the database
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.executescript(SCHEMA)
+    connection.execute(SAMPLES_INDEX)
+    connection.create_function('timestamp', 1, LogParser.format_timestamp,
+                               deterministic=True)
+    return connection
+
+
+def batches(rows):
+    '''
+    yield lists of up to BATCH_ROWS of rows
+    '''
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_ROWS:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def log_offset(connection, kind, log_filename):
+    '''
+    return the offset in log_filename to carry on from for kind ('temp' or
+    'event') of log, 0 if it must all be read (after deleting what was
+    read from it before)
+    '''
+    row = connection.execute('SELECT offset, signature FROM logs WHERE kind = ?',
+                             (kind,)).fetchone()
+    if row is not None:
+        offset, signature = row
+        try:
+            if LogParser.log_signature(log_filename, offset) == signature:
+                return offset
+        except OSError:
+            pass
+    if DEBUG:
+        print('reading all of {}'.format(log_filename), file=sys.stderr)
+    if 'temp' == kind:
+        connection.execute('DELETE FROM samples')
+    else:
+        connection.execute('DELETE FROM events')
+    return 0
+
+
+def save_offset(connection, kind, log_filename, offset):
+    connection.execute('INSERT OR REPLACE INTO logs VALUES (?, ?, ?, ?)',
+                       (kind, log_filename, offset,
+                        LogParser.log_signature(log_filename, offset)))
+
+
+def add_temperatures(connection, log_filename, damage=None):
+    '''
+    add the samples in log_filename which are not in the database yet.
+    Bad lines are counted in damage (a LogParser.damage_report).
+
+    return the number of samples added
+    '''
+    with connection:
+        offset = log_offset(connection, 'temp', log_filename)
+        if 0 == offset:
+            connection.execute('DROP INDEX IF EXISTS samples_sensor_ts')
+        sensor_ids = dict(connection.execute('SELECT name, id FROM sensors'))
+
+        def sensor_id(name):
+            i = sensor_ids.get(name)
+            if i is None:
+                i = connection.execute('INSERT INTO sensors (name) VALUES (?)',
+                                       (name,)).lastrowid
+                sensor_ids[name] = i
+            return i
+
+        with open(log_filename, 'rb') as ifile:
+            records = LogParser.log_records(LogParser.map_log(ifile), offset,
+                                            damage=damage)
+            rows = ((seconds, sensor_id(name), value) for seconds, name, value in records)
+            for batch in batches(rows):
+                connection.executemany('INSERT INTO samples VALUES (?, ?, ?)', batch)
+        connection.execute(SAMPLES_INDEX)
+        save_offset(connection, 'temp', log_filename, records.offset)
+    return records.entries
+
+
+def event_lines(log_filename, offset):
+    '''
+    yield (offset after the line, line) for the complete lines of
+    log_filename from offset
+    '''
+    with open(log_filename, 'rb') as f:
+        f.seek(offset)
+        rest = b''
+        while True:
+            data = f.read(READ_BYTES)
+            if not data:
+                break
+            lines = (rest + data).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                offset += len(line) + 1
+                yield offset, line
+
+
+def add_events(connection, log_filename):
+    '''
+    add the events in log_filename which are not in the database yet
+
+    return the number of events added
+    '''
+    added = 0
+    with connection:
+        offset = log_offset(connection, 'event', log_filename)
+
+        def rows():
+            nonlocal added, offset
+            for offset, line in event_lines(log_filename, offset):
+                sl = line.decode('UTF-8', errors='replace').split(None, 2)
+                if len(sl) != 3 or 'EVENT' != sl[1] or not LogParser.TIMESTAMP_RE.match(sl[0]):
+                    continue
+                try:
+                    seconds = LogParser.timestamp_to_seconds(sl[0])
+                except ValueError:
+                    continue
+                added += 1
+                yield seconds, sl[2].strip()
+
+        for batch in batches(rows()):
+            connection.executemany('INSERT INTO events VALUES (?, ?)', batch)
+        save_offset(connection, 'event', log_filename, offset)
+    return added
+
+
+def time_slices(connection, seconds):
+    '''
+    yield (key, name, sum, count) for each (time slice, sensor) with
+    samples.  The key of a time slice is (ts // seconds), as BinData.py
+    uses.  The sums are made by SQLite from the (sensor, ts, value) index.
+    '''
+    # ts is never negative so the integer division of SQLite is the same
+    # as // in python
+    yield from connection.execute('''
+        SELECT slice, name, total, n FROM (
+            SELECT sensor, ts / ? AS slice, SUM(value) AS total, COUNT(*) AS n
+                FROM samples
+                GROUP BY sensor, slice)
+            JOIN sensors ON sensor = sensors.id''', (seconds,))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='keep the samples and events in a SQLite database')
+    parser.add_argument('-d', '--database', default=DEFAULT_DATABASE_FILENAME,
+                        help='database file (default {})'.format(DEFAULT_DATABASE_FILENAME))
+    parser.add_argument('-t', '--temperatures',
+                        help='add the new lines of this log of samples, e.g. temp.log')
+    parser.add_argument('-e', '--events',
+                        help='add the new lines of this log of events, e.g. event.log')
+    parser.add_argument('-q', '--query',
+                        help='SQL query to print the rows of as CSV')
+    args = parser.parse_args()
+
+    connection = connect(args.database)
+    damage = LogParser.damage_report()
+    if args.temperatures:
+        added = add_temperatures(connection, args.temperatures, damage)
+        if DEBUG:
+            print('{} samples added'.format(added), file=sys.stderr)
+    if args.events:
+        added = add_events(connection, args.events)
+        if DEBUG:
+            print('{} events added'.format(added), file=sys.stderr)
+    if damage:
+        print(damage.summary(), file=sys.stderr)
+
+    if args.query:
+        try:
+            cursor = connection.execute(args.query)
+        except sqlite3.Error as e:
+            print('bad query: {}'.format(e), file=sys.stderr)
+            sys.exit(1)
+        if cursor.description is None:
+            connection.commit()  # not a query, e.g. DELETE
+            sys.exit(0)
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        try:
+            writer.writerow([d[0] for d in cursor.description])
+            for row in cursor:
+                writer.writerow(row)
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # e.g. piped in to head
+            sys.stderr.close()
+    connection.close()
@@ -0,0 +1,449 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Sample the sensors on a collection of serial ports, each at its own interval.
+
+MoundController.py used to start a thread for each port on every tick
+(every 4 seconds while the pump runs) and join them all, each thread
+blocking in readline(), and changed the rate by stopping one such loop
+and starting another.
+
+sampling_scheduler (used by MoundController.py) reads every port from
+one thread.  Each port has an interval and a deadline for its next
+sample, on time.monotonic() so setting the clock (e.g. by NTP when the
+Raspberry Pi starts, it has no clock of its own) moves nothing.  When
+deadlines come due it writes the NL asking for samples to all of those
+ports at once.  It waits with a selector on the file descriptors of the
+ports and the next deadline together, adding whatever has arrived to a
+buffer per port until the port has sent its empty line.  Then the whole
+answer is parsed in one go (parse_answer) and all of its readings get one
+timestamp, the time they were asked for (the Arduino starts the
+conversion when asked), rather than a clock read for each line.  How long
+the answers take is kept in answer_time.  Nothing blocks on a single
+port, so one slow Arduino holds up no other (nor a port due while it
+answers) and 6 to 8 of them can be sampled every 4 seconds.  A port which
+has not finished within its interval (at most SAMPLE_TIMEOUT_IN_SECONDS)
+is reported and what it sent is kept, what is left of its answer is
+thrown away.
+
+set_interval() changes the interval of ports while the scheduler runs:
+a port is next sampled an interval after it was last asked, or straight
+away if that has passed, so there is no gap or extra sample when the
+pump starts or stops.  A port which falls a whole interval or more
+behind (e.g. a slow answer) is sampled once and carries on from the next
+deadline still to come (SKIP, counted in skipped) or is sampled for each
+deadline it missed, one after the other (CATCH_UP).  A port still
+answering when it comes due is asked again when it finishes.  Intervals
+are per port as an Arduino answers with all of its sensors.
+
+How late the ports are asked for samples is kept in tick_late as it
+runs.  BenchmarkSampling.py compares it against a thread per port per
+tick.
+
+Nothing here needs the hardware, the function which turns the readings
+in to the text to write is given to the scheduler by MoundController.py
+and read_answer() asks a single port (e.g. to find its sensors).
+"""
+
+import os
+import re
+import selectors
+import sys
+import threading
+import time
+import traceback
+
+DEBUG = 0
+
+NL = '\n'.encode('UTF-8')
+
+# give up on a port which has not finished answering after this long
+SAMPLE_TIMEOUT_IN_SECONDS = 10
+
+# read up to this much from a port at a time
+READ_BYTES = 4096
+
+# the empty line at the end of an answer
+ANSWER_END_RE = re.compile(rb'(?:^|\n)[ \t\r]*\n')
+
+# epoll waits whole milliseconds, see sampling_scheduler.run()
+SELECT_RESOLUTION_IN_SECONDS = 0.001
+
+# Linux lets a wait run over by this much (timer_slack_ns) or 0.1% of it
+TIMER_SLACK_IN_SECONDS = 0.00005
+
+# what sampling_scheduler does when a port falls a whole interval or more
+# behind:  sample it once and carry on from the next deadline still to
+# come, or sample it for each deadline missed, one after the other
+SKIP = 'skip'
+CATCH_UP = 'catch_up'
+
+
+class lateness():
+    '''
+    Count, mean and largest of how late (in seconds) something happened
+    '''
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.largest = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.largest:
+            self.largest = seconds
+
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+    def summary(self):
+        return '{} late by {:.3f} ms on average, {:.3f} ms at most'.format(self.count,
+                                                                          self.mean() * 1000,
+                                                                          self.largest * 1000)
+
+
+def drain(fd):
+    '''
+    throw away anything waiting to be read from fd (which is non-blocking)
+
+    return False if fd was closed at the other end
+    '''
+    while True:
+        try:
+            if not os.read(fd, READ_BYTES):
+                return False
+        except BlockingIOError:
+            return True
+
+
+def parse_answer(data):
+    '''
+    return the readings [(type, id, value)] in data, the bytes of an answer
+    before the empty line at the end.  Lines which are not three words are
+    left out.
+    '''
+    readings = []
+    for line in data.decode('UTF-8', errors='replace').splitlines():
+        words = line.split()
+        if 3 == len(words):
+            readings.append(tuple(words))
+    return readings
+
+
+class port_answer():
+    '''
+    The answer of a port as it arrives, asked for at asked (time.time())
+    '''
+    def __init__(self, asked, give_up):
+        self.asked = asked
+        self.give_up = give_up
+        self.data = b''
+        self.complete = False
+
+    def add(self, data):
+        '''
+        add data read from the port
+
+        return True when the empty line at the end has arrived
+        '''
+        self.data += data
+        end = ANSWER_END_RE.search(self.data)
+        if end:
+            self.data = self.data[:end.start()]
+            self.complete = True
+        return self.complete
+
+    def readings(self):
+        '''
+        return the readings of the answer, only the complete lines if the
+        end never arrived
+        '''
+        if self.complete:
+            return parse_answer(self.data)
+        return parse_answer(self.data[:self.data.rfind(b'\n') + 1])
+
+
+def read_answer(port, timeout=SAMPLE_TIMEOUT_IN_SECONDS):
+    '''
+    ask port for samples and wait up to timeout seconds for the answer
+
+    return the port_answer
+    '''
+    answer = port_answer(time.time(), time.monotonic() + timeout)
+    port.write(NL)
+    with selectors.DefaultSelector() as selector:
+        selector.register(port.fileno(), selectors.EVENT_READ)
+        while not answer.complete:
+            left = answer.give_up - time.monotonic()
+            if left <= 0 or not selector.select(left):
+                print('{} did not finish answering in time'.format(getattr(port, 'name', port)),
+                      file=sys.stderr, flush=True)
+                break
+            try:
+                data = os.read(port.fileno(), READ_BYTES)
+            except BlockingIOError:
+                continue
+            if not data:
+                break
+            answer.add(data)
+    return answer
+
+
+class sampling_scheduler(threading.Thread):
+    '''
+    Sample each of a collection of serial ports at its own interval, which
+    can be changed at any time, from one thread and queue up the text
+    process(readings, when) makes of the readings of each answer (see
+    parse_answer) to be written to a persistent place.  when is the
+    time.time() the answer was asked for.  A port is anything with
+    write() and fileno(), e.g. a serial.Serial.  A port which fails (an
+    OSError, e.g. the Arduino was unplugged) or is closed is reported and
+    no longer sampled, the others carry on.
+
+    Mark ourself as a daemon as we don't have a job when everything else is done
+    '''
+    def __init__(self, queue, process, missed=SKIP):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = queue
+        self.process = process
+        if missed not in (SKIP, CATCH_UP):
+            raise ValueError('missed must be {} or {}, not {}'.format(SKIP, CATCH_UP, missed))
+        self.missed = missed
+        self.keep_running = True
+        # only use intervals, deadlines and last when the lock is held
+        self.lock = threading.Lock()
+        self.intervals = dict()
+        self.deadlines = dict()
+        self.last = dict()
+        # the rest is only used by this thread
+        self.selector = selectors.DefaultSelector()
+        # the file descriptor of each port registered with the selector
+        self.ports = dict()
+        self.answers = dict()
+        # written to when there is something new to look at
+        self.wake_read, self.wake_write = os.pipe()
+        os.set_blocking(self.wake_read, False)
+        os.set_blocking(self.wake_write, False)
+        self.selector.register(self.wake_read, selectors.EVENT_READ, None)
+        self.tick_late = lateness()
+        self.answer_time = lateness()
+        self.skipped = 0
+
+    def wake(self):
+        try:
+            os.write(self.wake_write, b'!')
+        except BlockingIOError:
+            pass  # full, so it will wake anyway
+
+    def set_interval(self, ports, seconds):
+        '''
+        sample ports every seconds from now on, or no more if seconds is
+        None.  A port which was asked for samples less than seconds ago is
+        next sampled seconds after that, otherwise straight away.
+        '''
+        with self.lock:
+            now = time.monotonic()
+            for p in ports:
+                if seconds is None:
+                    self.intervals.pop(p, None)
+                    self.deadlines.pop(p, None)
+                    continue
+                self.intervals[p] = seconds
+                last = self.last.get(p)
+                if last is None:
+                    self.deadlines[p] = now
+                else:
+                    self.deadlines[p] = max(now, last + seconds)
+        self.wake()
+
+    def stop(self):
+        self.keep_running = False
+        self.wake()
+
+    def replacement(self):
+        '''
+        return a new scheduler (not started) which samples the same ports
+        at the same intervals, e.g. when this one died
+        '''
+        s = sampling_scheduler(self.queue, self.process, self.missed)
+        with self.lock:
+            for p, seconds in self.intervals.items():
+                s.set_interval([p], seconds)
+        return s
+
+    def forget(self, port, why):
+        '''
+        stop sampling port because of why, held by the lock and only by
+        this thread
+        '''
+        print('{} {}, no longer sampled'.format(getattr(port, 'name', port), why),
+              file=sys.stderr, flush=True)
+        self.intervals.pop(port, None)
+        self.deadlines.pop(port, None)
+        fd = self.ports.pop(port, None)
+        if fd is not None:
+            # a closed port is always ready to read
+            self.selector.unregister(fd)
+
+    def next_deadline(self, port, now):
+        '''
+        return the deadline of port after the one being sampled at now
+        '''
+        interval = self.intervals[port]
+        deadline = self.deadlines[port] + interval
+        if deadline <= now and SKIP == self.missed:
+            # missed some, carry on from the next one still to come
+            missed = int((now - deadline) // interval) + 1
+            self.skipped += missed
+            deadline += missed * interval
+        return deadline
+
+    def ask(self, now):
+        '''
+        ask the ports which are due (and not still answering) for samples,
+        held by the lock
+
+        return the time.monotonic() to look again by, None if nothing is due
+        '''
+        for p in [p for p in self.ports if p not in self.intervals and p not in self.answers]:
+            self.selector.unregister(self.ports.pop(p))
+        due = [p for p, d in self.deadlines.items() if d <= now and p not in self.answers]
+        if not self.keep_running:
+            due = []
+        if due:
+            self.tick_late.add(now - min(self.deadlines[p] for p in due))
+            asked = time.time()
+        for p in due:
+            try:
+                if p not in self.ports:
+                    fd = p.fileno()
+                    os.set_blocking(fd, False)
+                    self.selector.register(fd, selectors.EVENT_READ, p)
+                    self.ports[p] = fd
+                if not drain(self.ports[p]):  # anything left from before
+                    self.forget(p, 'was closed')
+                    continue
+                p.write(NL)
+            except OSError as e:
+                self.forget(p, 'failed ({})'.format(e))
+                continue
+            self.answers[p] = port_answer(asked, now + min(SAMPLE_TIMEOUT_IN_SECONDS,
+                                                           self.intervals[p]))
+            self.last[p] = now
+            self.deadlines[p] = self.next_deadline(p, now)
+        times = [d for p, d in self.deadlines.items() if p not in self.answers and self.keep_running]
+        times.extend(a.give_up for a in self.answers.values())
+        if times:
+            return min(times)
+        return None
+
+    def finish(self, port):
+        '''
+        queue up the results of what port answered
+        '''
+        answer = self.answers.pop(port)
+        self.answer_time.add(time.time() - answer.asked)
+        try:
+            r = self.process(answer.readings(), answer.asked)
+        except Exception:
+            # keep sampling the other ports
+            traceback.print_exc()
+            return
+        if r:
+            self.queue.put(r)
+
+    def read(self, port):
+        '''
+        read what has arrived from port
+        '''
+        answer = self.answers.get(port)
+        why = None
+        try:
+            if answer is None:
+                # not asked, e.g. the rest of a late answer
+                if not drain(self.ports[port]):
+                    why = 'was closed'
+            else:
+                data = os.read(self.ports[port], READ_BYTES)
+                if not data:
+                    why = 'was closed'
+                elif answer.add(data):
+                    self.finish(port)
+        except BlockingIOError:
+            pass
+        except OSError as e:
+            why = 'failed ({})'.format(e)
+        if why is not None:
+            with self.lock:
+                self.forget(port, why)
+            if port in self.answers:
+                self.finish(port)
+
+    def run(self):
+        # once stopped nothing more is asked for but the answers coming in
+        # are finished
+        while self.keep_running or self.answers:
+            with self.lock:
+                until = self.ask(time.monotonic())
+            timeout = None
+            if until is not None:
+                # python rounds the wait up to whole milliseconds for epoll
+                # and Linux lets it run over, so only wait the milliseconds
+                # which surely end before the deadline
+                left = until - time.monotonic()
+                left -= max(left / 1000, TIMER_SLACK_IN_SECONDS)
+                timeout = max(0, left // SELECT_RESOLUTION_IN_SECONDS * SELECT_RESOLUTION_IN_SECONDS)
+            ready = self.selector.select(timeout)
+            for key, events in ready:
+                if key.data is None:
+                    drain(self.wake_read)
+                else:
+                    self.read(key.data)
+            if not ready and 0 == timeout:
+                # less than a millisecond to the deadline, sleep waits
+                # that to within the timer slack (what arrives meanwhile
+                # waits in the port)
+                left = until - time.monotonic()
+                if left > 0:
+                    time.sleep(left)
+            now = time.monotonic()
+            for p in [p for p, a in self.answers.items() if a.give_up <= now]:
+                print('{} did not finish answering in time'.format(getattr(p, 'name', p)),
+                      file=sys.stderr, flush=True)
+                self.finish(p)
+        self.selector.close()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+        if DEBUG:
+            print('sampling_scheduler: ticks {}, {} skipped, answers {}\n'.format(self.tick_late.summary(),
+                                                                                  self.skipped,
+                                                                                  self.answer_time.summary()),
+                  file=sys.stderr, flush=True)
@@ -0,0 +1,164 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Make coarse tables by adding up finer ones rather than from the samples.
+
+The sum and count of a 10 minute time slice is the sum of the sums and
+counts of its ten 1 minute time slices, and so on up to days.  So of the
+tables BinData.py makes only the finest of each chain
+    1m -> 10m -> 1h -> 1d
+is made from the samples, each coarser table is made from the next finer
+one, which has far fewer cells than there are samples (1d is made from
+the 24 rows of each day of 1h).  rollup_plan() works out which tables are
+made from which, a table which is not a whole number of any finer table
+(e.g. 7m with 1m and 10m) is a base table made from the samples.
+
+The sums are exact (the values are multiples of 1/16 degree) so the CSVs
+are the same as adding every sample to every table.  The spread of a cell
+is not:  combining the means and squared differences of finer cells can
+round the last digit of a stddev differently, so tables with the
+statistics of BinData.py -x are always made from the samples.
+
+BinData.py -u also writes the exact sums and counts of each table to
+temp_1m.sums, ... (see BinaryTable.py).  Those are the base layer:  this
+program makes coarser tables from one of them without reading temp.log,
+so the old logs can be archived:
+
+    Rollup.py -i temp_1m.sums -r 10m,1h,1d
+
+usage:
+    Rollup.py -i sums_file [-f resolution] [-o output_directory]
+              [-r 10m,1h,1d,...] [-b] [-u]
+"""
+
+import argparse
+import sys
+
+import BinaryTable
+
+DEBUG = 0
+
+DEFAULT_RESOLUTIONS = ('10m', '1h', '1d')
+
+
+def rollup_plan(tables):
+    '''
+    return (base, steps) for tables (anything with seconds).  base is the
+    list of tables which must be made from the samples.  steps is a list
+    of (finer, coarser) tables in the order the coarser tables can be made
+    from the finer ones.
+    '''
+    base = []
+    steps = []
+    made = []
+    for t in sorted(tables, key=lambda t: t.seconds):
+        if getattr(t, 'statistics', False):
+            base.append(t)
+            continue
+        finer = [m for m in made if 0 == t.seconds % m.seconds]
+        if finer:
+            # the coarsest one has the fewest cells to add up
+            steps.append((max(finer, key=lambda m: m.seconds), t))
+        else:
+            base.append(t)
+        made.append(t)
+    return base, steps
+
+
+def roll_up(steps):
+    '''
+    make the coarser tables of steps (from rollup_plan) from the finer ones
+    '''
+    for finer, coarser in steps:
+        coarser.roll_up(finer)
+
+
+def load_sums(filename, table):
+    '''
+    add the cells of a sums file to table (a BinData.binned_table), the
+    resolution of which must fit a whole number of times in the rows
+
+    return the number of samples (or seconds with BinData.py -t) added
+    '''
+    names, is_sums, rows = BinaryTable.read_rows(filename)
+    if not is_sums:
+        raise ValueError('{} is not a sums table'.format(filename))
+    entries = 0
+    for start, sums, counts in rows:
+        if start % table.seconds:
+            raise ValueError('{} has a row starting at {} which is not a {} time slice'.format(filename,
+                                                                                             start,
+                                                                                             table.resolution))
+        key = start // table.seconds
+        for name, total, count in zip(names, sums, counts):
+            if count:
+                table.values.set(key, name, total, count)
+                entries += count
+    return entries
+
+
+if __name__ == "__main__":
+    import BinData
+
+    parser = argparse.ArgumentParser(description='make coarse tables from the sums of a finer one')
+    parser.add_argument('-i', '--input', required=True,
+                        help='sums file written by BinData.py -u, e.g. temp_1m.sums')
+    parser.add_argument('-f', '--finest', default='1m',
+                        help='resolution of the input (default 1m)')
+    parser.add_argument('-o', '--output-directory', default=BinData.DEFAULT_OUTPUT_DIRECTORY,
+                        help='where to write the temp_*.csv files')
+    parser.add_argument('-r', '--resolutions', default=','.join(DEFAULT_RESOLUTIONS),
+                        help='comma separated list of intervals to make, each a whole number of the input')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='also write the averages and counts to temp_*.bin for numpy')
+    parser.add_argument('-u', '--sums', action='store_true',
+                        help='also write the sums and counts to temp_*.sums')
+    args = parser.parse_args()
+
+    try:
+        finest = BinData.binned_table(args.finest)
+        tables = BinData.make_tables(args.resolutions.split(','), binary=args.binary,
+                                     sums=args.sums)
+    except ValueError as e:
+        parser.error(str(e))
+    for t in tables:
+        if t.seconds % finest.seconds:
+            parser.error('{} is not a whole number of {}'.format(t.resolution,
+                                                                 finest.resolution))
+
+    try:
+        entries = load_sums(args.input, finest)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    base, steps = rollup_plan([finest] + tables)
+    roll_up(steps)
+    BinData.write_tables(tables, args.output_directory)
+    if DEBUG:
+        print('{} entries in {} rows of {}'.format(entries, len(finest.values),
+                                                   args.input),
+              file=sys.stderr)
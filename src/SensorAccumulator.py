@@ -0,0 +1,446 @@
+#!/usr/bin/python3
+"""
+MIT License
+
+Copyright (c) 2017, 2019 Paul G Crumley
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+
+@author: pgcrumley@gmail.com
+
+
+Keep the sum and count of sensor values by key (time slice) and name.
+
+The BinBy*New.py programs keep a SensorValue object in a dict for every
+(time slice, sensor) cell.  With 1 minute time slices that is millions of
+objects.  Here each name and each key is given a small integer index and
+the sums and counts live in two flat arrays with one row of cells per key:
+
+    cell for (key, name) = key_index[key] * width + name_index[name]
+
+width grows (and the rows are copied) when there are more names than
+cells in a row, which only happens a few times.
+
+sensor_statistics also keeps the number of samples, the smallest and
+largest value and the running mean and sum of squared differences from
+the mean (Welford's method, which does not lose precision the way the
+sum of squares does) so the spread of each cell can be found in the same
+pass.  Two cells are combined with the formula of Chan et al. so tables
+made from pieces of the log can be merged.
+
+sensor_extremes keeps just the smallest and largest value besides the sum
+and count, which (unlike the spread) can be added up exactly from cells
+rather than samples, as CompactLogs.py does.
+"""
+
+import array
+import math
+
+INITIAL_WIDTH = 8
+
+# what sensor_statistics can give for each cell besides the average
+STATISTICS = ('count', 'min', 'max', 'stddev')
+
+
+class sensor_accumulator():
+    '''
+    Sum and count of the values for each (key, name) cell.
+    '''
+    # the array of cells and its type code for each thing kept
+    CELL_ARRAYS = (('sums', 'd'), ('counts', 'I'))
+
+    def __init__(self, width=INITIAL_WIDTH):
+        self.width = width
+        self.names = []
+        self.name_index = dict()
+        self.keys = []
+        self.key_index = dict()
+        for attribute, typecode in self.CELL_ARRAYS:
+            setattr(self, attribute, array.array(typecode))
+
+    def add_name(self, name):
+        if len(self.names) == self.width:
+            self.widen()
+        self.name_index[name] = len(self.names)
+        self.names.append(name)
+        return self.name_index[name]
+
+    def add_key(self, key):
+        self.key_index[key] = len(self.keys)
+        self.keys.append(key)
+        for attribute, typecode in self.CELL_ARRAYS:
+            a = getattr(self, attribute)
+            a.frombytes(bytes(a.itemsize * self.width))
+        return self.key_index[key]
+
+    def widen(self):
+        '''
+        double the number of cells in each row
+        '''
+        old_width = self.width
+        self.width = 2 * old_width
+        rows = len(self.keys)
+        for attribute, typecode in self.CELL_ARRAYS:
+            old = getattr(self, attribute)
+            new = array.array(typecode, bytes(old.itemsize * self.width * rows))
+            for k in range(rows):
+                new[k*self.width:k*self.width+old_width] = old[k*old_width:(k+1)*old_width]
+            setattr(self, attribute, new)
+
+    def cell(self, key, name):
+        '''
+        return the index of the (key, name) cell, making it if needed
+        '''
+        k = self.key_index.get(key)
+        if k is None:
+            k = self.add_key(key)
+        n = self.name_index.get(name)
+        if n is None:
+            n = self.add_name(name)
+        return k * self.width + n
+
+    def add(self, key, name, value):
+        '''
+        add a (float) value to the (key, name) cell
+        '''
+        # same as cell() but this is called for every sample so avoid a call
+        k = self.key_index.get(key)
+        if k is None:
+            k = self.add_key(key)
+        n = self.name_index.get(name)
+        if n is None:
+            n = self.add_name(name)
+        i = k * self.width + n
+        self.sums[i] += value
+        self.counts[i] += 1
+
+    def add_weighted(self, key, name, value, weight):
+        '''
+        add a (float) value which stands for weight (an integer, such as
+        seconds) to the (key, name) cell.  The count is the total weight.
+        '''
+        i = self.cell(key, name)
+        self.sums[i] += value * weight
+        self.counts[i] += weight
+
+    def add_total(self, key, name, total, count):
+        '''
+        add the sum (total) and count of several values to the (key, name)
+        cell
+        '''
+        i = self.cell(key, name)
+        self.sums[i] += total
+        self.counts[i] += count
+
+    def set(self, key, name, total, count):
+        i = self.cell(key, name)
+        self.sums[i] = total
+        self.counts[i] = count
+
+    def find(self, key, name):
+        '''
+        return the index of the (key, name) cell or None if there is none
+        '''
+        k = self.key_index.get(key)
+        n = self.name_index.get(name)
+        if k is None or n is None:
+            return None
+        return k * self.width + n
+
+    def getCount(self, key, name):
+        i = self.find(key, name)
+        if i is None:
+            return 0
+        return self.counts[i]
+
+    def getSum(self, key, name):
+        i = self.find(key, name)
+        if i is None:
+            return 0.0
+        return self.sums[i]
+
+    def getAverage(self, key, name):
+        i = self.find(key, name)
+        if i is None:
+            raise ZeroDivisionError('no values for {} {}'.format(key, name))
+        return (self.sums[i] / self.counts[i])
+
+    def row_averages(self, key, names):
+        '''
+        return a list with the average for each of names in the key row,
+        None where there are no values
+        '''
+        base = self.key_index[key] * self.width
+        averages = []
+        for name in names:
+            n = self.name_index.get(name)
+            if n is None or 0 == self.counts[base + n]:
+                averages.append(None)
+            else:
+                averages.append(self.sums[base + n] / self.counts[base + n])
+        return averages
+
+    def row_sums(self, key, names):
+        '''
+        return a list with the sum for each of names in the key row, None
+        where there are no values
+        '''
+        base = self.key_index[key] * self.width
+        sums = []
+        for name in names:
+            n = self.name_index.get(name)
+            if n is None or 0 == self.counts[base + n]:
+                sums.append(None)
+            else:
+                sums.append(self.sums[base + n])
+        return sums
+
+    def row_counts(self, key, names):
+        '''
+        return a list with the count for each of names in the key row
+        '''
+        base = self.key_index[key] * self.width
+        counts = []
+        for name in names:
+            n = self.name_index.get(name)
+            counts.append(0 if n is None else self.counts[base + n])
+        return counts
+
+    def items(self):
+        '''
+        yield (key, name, sum, count) for each cell with values
+        '''
+        for key, k in self.key_index.items():
+            base = k * self.width
+            for name, n in self.name_index.items():
+                if self.counts[base + n]:
+                    yield key, name, self.sums[base + n], self.counts[base + n]
+
+    def keep_only(self, keys):
+        '''
+        return a new accumulator with just the rows for keys
+        '''
+        result = self.__class__(self.width)
+        for name in self.names:
+            result.add_name(name)
+        for key in keys:
+            k = self.key_index[key]
+            r = result.add_key(key)
+            for attribute, typecode in self.CELL_ARRAYS:
+                getattr(result, attribute)[r*self.width:(r+1)*self.width] = \
+                    getattr(self, attribute)[k*self.width:(k+1)*self.width]
+        return result
+
+    def merge(self, other, ratio=1):
+        '''
+        add the sums and counts of another accumulator to this one.  The
+        keys of other are divided by ratio, so with keys which are time
+        slices a finer table can be added to a coarser one.
+        '''
+        for name in other.names:
+            if name not in self.name_index:
+                self.add_name(name)
+        for key, name, total, count in other.items():
+            i = self.cell(key // ratio, name)
+            self.sums[i] += total
+            self.counts[i] += count
+
+    def clear(self):
+        '''
+        forget all keys but keep the names
+        '''
+        self.keys = []
+        self.key_index = dict()
+        for attribute, typecode in self.CELL_ARRAYS:
+            del getattr(self, attribute)[:]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class sensor_statistics(sensor_accumulator):
+    '''
+    Sum and count of the values for each (key, name) cell along with the
+    number of samples, smallest, largest, mean and sum of squared
+    differences from the mean.
+
+    The number of samples is the same as the count unless the samples are
+    weighted (add_weighted), the other statistics are of the samples
+    without their weights.
+    '''
+    CELL_ARRAYS = sensor_accumulator.CELL_ARRAYS + (('samples', 'I'),
+                                                    ('mins', 'd'),
+                                                    ('maxs', 'd'),
+                                                    ('means', 'd'),
+                                                    ('m2s', 'd'))
+
+    def add(self, key, name, value):
+        i = self.cell(key, name)
+        self.sums[i] += value
+        self.counts[i] += 1
+        self.add_sample(i, value)
+
+    def add_weighted(self, key, name, value, weight):
+        i = self.cell(key, name)
+        self.sums[i] += value * weight
+        self.counts[i] += weight
+        self.add_sample(i, value)
+
+    def add_sample(self, i, value):
+        n = self.samples[i] + 1
+        self.samples[i] = n
+        if 1 == n:
+            self.mins[i] = value
+            self.maxs[i] = value
+        elif value < self.mins[i]:
+            self.mins[i] = value
+        elif value > self.maxs[i]:
+            self.maxs[i] = value
+        delta = value - self.means[i]
+        self.means[i] += delta / n
+        self.m2s[i] += delta * (value - self.means[i])
+
+    def set(self, key, name, total, count, samples, smallest, largest, mean, m2):
+        i = self.cell(key, name)
+        self.sums[i] = total
+        self.counts[i] = count
+        self.samples[i] = samples
+        self.mins[i] = smallest
+        self.maxs[i] = largest
+        self.means[i] = mean
+        self.m2s[i] = m2
+
+    def row_statistics(self, key, names, statistic):
+        '''
+        return a list with one of STATISTICS for each of names in the key
+        row, None where there are no samples.  stddev is the population
+        standard deviation of the samples.
+        '''
+        base = self.key_index[key] * self.width
+        values = []
+        for name in names:
+            n = self.name_index.get(name)
+            if n is None or 0 == self.samples[base + n]:
+                values.append(None)
+            elif 'count' == statistic:
+                values.append(self.samples[base + n])
+            elif 'min' == statistic:
+                values.append(self.mins[base + n])
+            elif 'max' == statistic:
+                values.append(self.maxs[base + n])
+            elif 'stddev' == statistic:
+                values.append(math.sqrt(self.m2s[base + n] / self.samples[base + n]))
+            else:
+                raise ValueError('unknown statistic "{}"'.format(statistic))
+        return values
+
+    def items(self):
+        '''
+        yield (key, name, sum, count, samples, min, max, mean, m2) for each
+        cell with samples
+        '''
+        for key, k in self.key_index.items():
+            base = k * self.width
+            for name, n in self.name_index.items():
+                i = base + n
+                if self.samples[i]:
+                    yield (key, name, self.sums[i], self.counts[i], self.samples[i],
+                           self.mins[i], self.maxs[i], self.means[i], self.m2s[i])
+
+    def merge(self, other, ratio=1):
+        '''
+        add the cells of another sensor_statistics to this one, see
+        sensor_accumulator.merge
+        '''
+        for name in other.names:
+            if name not in self.name_index:
+                self.add_name(name)
+        for key, name, total, count, samples, smallest, largest, mean, m2 in other.items():
+            key = key // ratio
+            i = self.cell(key, name)
+            n = self.samples[i]
+            if 0 == n:
+                self.set(key, name, total, count, samples, smallest, largest, mean, m2)
+                continue
+            self.sums[i] += total
+            self.counts[i] += count
+            self.samples[i] = n + samples
+            self.mins[i] = min(self.mins[i], smallest)
+            self.maxs[i] = max(self.maxs[i], largest)
+            delta = mean - self.means[i]
+            self.means[i] += delta * samples / (n + samples)
+            self.m2s[i] += m2 + delta * delta * n * samples / (n + samples)
+
+
+class sensor_extremes(sensor_accumulator):
+    '''
+    Sum and count of the values for each (key, name) cell along with the
+    smallest and largest value.  Whole cells can be added (add_cell) so
+    the cells of a coarser table can be made from those of a finer one.
+    '''
+    CELL_ARRAYS = sensor_accumulator.CELL_ARRAYS + (('mins', 'd'),
+                                                    ('maxs', 'd'))
+
+    def add(self, key, name, value):
+        self.add_cell(key, name, value, 1, value, value)
+
+    def add_cell(self, key, name, total, count, smallest, largest):
+        '''
+        add the sum (total), count, smallest and largest of several values
+        to the (key, name) cell
+        '''
+        i = self.cell(key, name)
+        if 0 == self.counts[i]:
+            self.mins[i] = smallest
+            self.maxs[i] = largest
+        else:
+            if smallest < self.mins[i]:
+                self.mins[i] = smallest
+            if largest > self.maxs[i]:
+                self.maxs[i] = largest
+        self.sums[i] += total
+        self.counts[i] += count
+
+    def row_cells(self, key, names):
+        '''
+        return a list with (sum, count, min, max) for each of names in the
+        key row, None where there are no values
+        '''
+        base = self.key_index[key] * self.width
+        cells = []
+        for name in names:
+            n = self.name_index.get(name)
+            if n is None or 0 == self.counts[base + n]:
+                cells.append(None)
+            else:
+                i = base + n
+                cells.append((self.sums[i], self.counts[i], self.mins[i], self.maxs[i]))
+        return cells
+
+    def items(self):
+        '''
+        yield (key, name, sum, count, min, max) for each cell with values
+        '''
+        for key, k in self.key_index.items():
+            base = k * self.width
+            for name, n in self.name_index.items():
+                i = base + n
+                if self.counts[i]:
+                    yield (key, name, self.sums[i], self.counts[i],
+                           self.mins[i], self.maxs[i])